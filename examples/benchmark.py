@@ -0,0 +1,254 @@
+"""
+Rough throughput and memory numbers for the PyMeta runtime, measured by
+parsing a TinyHTML document built from repeated copies of the example source.
+
+Run it from the examples directory:
+
+    python benchmark.py [copies]
+
+or, to parse a file in place through a memory map and report how much of it
+was paged in and the peak resident set size of the process:
+
+    python benchmark.py mmap [copies | filename]
+
+or, to compare the grammar optimizer's passes, each on its own and together,
+by the time taken to define TinyHTML and the metagrammar and to parse with
+them:
+
+    python benchmark.py passes [copies]
+"""
+import mmap, os, resource, sys, tempfile, time, tracemalloc
+
+from pymeta import grammar
+from pymeta.grammar import OMeta, SentinelOMeta, FastOMeta, GrammarOptimizer
+from pymeta.grammar import OMetaGrammarMixin, ometaGrammar
+from pymeta.builder import FastPythonWriter, TreeBuilder
+from pymeta.runtime import InputStream, CursorInput, ArrayMemo, DictMemo
+from pymeta.runtime import WhitespaceIndex, CharacterClassIndex
+from html import TinyHTML, tinyHTMLGrammar, testSource, decoded
+
+# What TinyHTML's actions need.
+htmlGlobals = {"decoded": decoded}
+
+# The same grammar, generated to signal failure without exceptions, and
+# also to track no errors.
+SentinelTinyHTML = SentinelOMeta.makeGrammar(tinyHTMLGrammar, htmlGlobals,
+                                             name="TinyHTML")
+FastTinyHTML = FastOMeta.makeGrammar(tinyHTMLGrammar, htmlGlobals,
+                                     name="TinyHTML")
+
+# And fast, but without matching its regular parts with regular expressions.
+class PEGFastOMeta(FastOMeta):
+    writerClass = type("PEGFastPythonWriter", (FastPythonWriter,),
+                       {"lowerRegular": False})
+PEGFastTinyHTML = PEGFastOMeta.makeGrammar(tinyHTMLGrammar, htmlGlobals,
+                                           name="TinyHTML")
+
+
+def variant(inputClass, memoClass, memoWindow=None, grammarClass=TinyHTML,
+            **attrs):
+    """
+    Make a TinyHTML subclass that parses with the given input engine and
+    memo store, optionally keeping memo records only within a window, and
+    with any other class attributes given.
+    """
+    attrs.update({"inputClass": inputClass, "memoClass": memoClass,
+                  "memoWindow": memoWindow})
+    return type("TinyHTML", (grammarClass,), attrs)
+
+
+engines = [
+    ("InputStream/DictMemo", variant(InputStream, DictMemo)),
+    ("InputStream/ArrayMemo", variant(InputStream, ArrayMemo)),
+    ("CursorInput/DictMemo", variant(CursorInput, DictMemo)),
+    ("CursorInput/ArrayMemo", variant(CursorInput, ArrayMemo)),
+    ("CursorInput/ArrayMemo/256", variant(CursorInput, ArrayMemo, 256)),
+    ("CursorInput/ArrayMemo/sentinel", variant(CursorInput, ArrayMemo,
+                                               grammarClass=SentinelTinyHTML)),
+    ("CursorInput/ArrayMemo/fast", variant(CursorInput, ArrayMemo,
+                                           grammarClass=FastTinyHTML)),
+    ("CursorInput/ArrayMemo/fast-peg", variant(CursorInput, ArrayMemo,
+                                               grammarClass=PEGFastTinyHTML)),
+    ("CursorInput/ArrayMemo/wsindex", variant(
+            CursorInput, ArrayMemo, whitespaceIndex=WhitespaceIndex)),
+    ("CursorInput/ArrayMemo/classes", variant(
+            CursorInput, ArrayMemo, characterClasses=CharacterClassIndex)),
+    ]
+
+
+def parse(grammarClass, source):
+    g = grammarClass(source)
+    return g.apply("html")[0]
+
+
+def measure(grammarClass, source, repeat=3):
+    """
+    Parse C{source} a few times to find the best time, then once more under
+    tracemalloc to find the peak amount of memory allocated during the parse.
+    """
+    elapsed = None
+    for i in range(repeat):
+        start = time.time()
+        result = parse(grammarClass, source)
+        t = time.time() - start
+        if elapsed is None or t < elapsed:
+            elapsed = t
+        del result
+    tracemalloc.start()
+    result = parse(grammarClass, source)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main(copies=200):
+    source = testSource * copies
+    print("%d characters of TinyHTML" % (len(source),))
+    print("%-31s %10s %10s %14s" % ("engine", "seconds", "chars/sec",
+                                     "peak memory"))
+    for name, grammarClass in engines:
+        elapsed, peak = measure(grammarClass, source)
+        print("%-31s %10.3f %10d %12.1fMB" % (name, elapsed,
+                                              len(source) / elapsed,
+                                              peak / 1048576.0))
+
+
+def optimizer(**passes):
+    """
+    Make a GrammarOptimizer subclass that runs only the passes given.
+    """
+    attrs = {"foldConstants": False, "inlineRules": False, "flatten": False,
+             "dropOptionals": False}
+    attrs.update(passes)
+    return type("GrammarOptimizer", (GrammarOptimizer,), attrs)
+
+
+optimizers = [
+    ("none", None),
+    ("foldConstants", optimizer(foldConstants=True)),
+    ("inlineRules", optimizer(inlineRules=True)),
+    ("flatten", optimizer(flatten=True)),
+    ("dropOptionals", optimizer(dropOptionals=True)),
+    ("default", GrammarOptimizer),
+    ("all", optimizer(foldConstants=True, inlineRules=True, flatten=True,
+                      dropOptionals=True)),
+    ]
+
+
+def best(f, repeat=3):
+    """
+    Return the shortest time of a few calls to C{f}.
+    """
+    times = []
+    for i in range(repeat):
+        start = time.time()
+        f()
+        times.append(time.time() - start)
+    return min(times)
+
+
+def passesMain(copies=200):
+    """
+    Time defining TinyHTML and the metagrammar with each set of passes in
+    L{optimizers}, parsing the TinyHTML source with the plain and sentinel
+    grammars, and parsing the metagrammar's own source.
+    """
+    source = testSource * copies
+    print("%d characters of TinyHTML, %d of metagrammar" % (
+            len(source), len(ometaGrammar)))
+    print("%-15s %10s %10s %10s %12s" % ("passes", "define", "TinyHTML",
+                                         "sentinel", "metagrammar"))
+    for name, optimizerClass in optimizers:
+        base = type("OMeta", (OMeta,), {"optimizerClass": optimizerClass})
+        sentinelBase = type("SentinelOMeta", (SentinelOMeta,),
+                            {"optimizerClass": optimizerClass})
+        classes = {}
+        def define():
+            classes["plain"] = variant(CursorInput, ArrayMemo,
+                grammarClass=base.makeGrammar(tinyHTMLGrammar, htmlGlobals,
+                                              name="TinyHTML"))
+            classes["sentinel"] = variant(CursorInput, ArrayMemo,
+                grammarClass=sentinelBase.makeGrammar(
+                    tinyHTMLGrammar, htmlGlobals, name="TinyHTML"))
+            classes["meta"] = type("OMetaGrammar", (
+                    OMetaGrammarMixin,
+                    base.makeGrammar(ometaGrammar, vars(grammar),
+                                     name="OMetaGrammar")), {})
+        defining = best(define)
+        plain = best(lambda: parse(classes["plain"], source))
+        sentinel = best(lambda: parse(classes["sentinel"], source))
+        meta = best(lambda: classes["meta"](ometaGrammar).parseGrammar(
+                "OMetaGrammar", TreeBuilder))
+        print("%-15s %10.3f %10.3f %10.3f %12.3f" % (name, defining, plain,
+                                                     sentinel, meta))
+
+
+def residentPages(path):
+    """
+    Return the number of pages of the given file that are mapped into this
+    process and resident in memory, from /proc/self/smaps, or None where
+    that isn't available.
+    """
+    path = os.path.realpath(path)
+    try:
+        smaps = open("/proc/self/smaps")
+    except IOError:
+        return None
+    rss = 0
+    inMapping = False
+    for line in smaps:
+        fields = line.split()
+        if "-" in fields[0] and not fields[0].endswith(":"):
+            inMapping = len(fields) >= 6 and fields[-1] == path
+        elif inMapping and fields[0] == "Rss:":
+            rss += int(fields[1]) * 1024
+    smaps.close()
+    return rss // mmap.PAGESIZE
+
+
+def mmapMain(source="2000"):
+    """
+    Parse a file with L{TinyHTML.fromFile}, which reads it straight from a
+    memory map.
+
+    @param source: A filename, or a number of copies of the example source
+    to write to a temporary file and parse.
+    """
+    if source.isdigit():
+        fd, path = tempfile.mkstemp(suffix=".html")
+        os.write(fd, (testSource * int(source)).encode("ascii"))
+        os.close(fd)
+    else:
+        path = source
+    size = os.path.getsize(path)
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.time()
+    g = TinyHTML.fromFile(path)
+    result, err = g.apply("html")
+    elapsed = time.time() - start
+    # A parse that stopped early would time only part of the file.
+    g.apply("end")
+    pages = residentPages(path)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    faults = ((after.ru_minflt + after.ru_majflt) -
+              (usage.ru_minflt + usage.ru_majflt))
+    print("%d bytes of TinyHTML in %s (%d pages)" % (
+        size, path, (size + mmap.PAGESIZE - 1) // mmap.PAGESIZE))
+    print("parsed in %.3f seconds (%d bytes/sec)" % (elapsed, size / elapsed))
+    if pages is not None:
+        print("pages of the file resident in the mapping: %d" % (pages,))
+    print("page faults during the parse: %d" % (faults,))
+    # ru_maxrss is in kilobytes on Linux and bytes on OS X.
+    scale = sys.platform == "darwin" and 1048576.0 or 1024.0
+    print("peak RSS: %.1fMB" % (after.ru_maxrss / scale,))
+    if source.isdigit():
+        os.unlink(path)
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ["mmap"]:
+        mmapMain(*sys.argv[2:])
+    elif sys.argv[1:2] == ["passes"]:
+        passesMain(*[int(arg) for arg in sys.argv[2:]])
+    else:
+        main(*[int(arg) for arg in sys.argv[1:]])
@@ -4,9 +4,19 @@ A grammar for parsing a tiny HTML-like language, plus a transformer for it.
 from pymeta.grammar import OMeta
 from itertools import chain
 
+def decoded(captured):
+    """
+    Return input captured with $(...) as a string. Slices of bytes input,
+    as read by TinyHTML.fromFile, are memoryviews of its Latin-1 text.
+    """
+    if isinstance(captured, str):
+        return captured
+    return bytes(captured).decode('latin-1')
+
+
 tinyHTMLGrammar = """
 
-name ::= <letterOrDigit>+:ls => ''.join(ls)
+name ::= $(<letterOrDigit>+):n => decoded(n)
 
 tag ::= ('<' <spaces> <name>:n <spaces> <attribute>*:attrs '>'
          <html>:c
@@ -15,7 +25,7 @@ tag ::= ('<' <spaces> <name>:n <spaces> <attribute>*:attrs '>'
 
 html ::= (<text> | <tag>)*
 
-text ::= (~('<') <anything>)+:t => ''.join(t)
+text ::= $((~('<') <anything>)+):t => decoded(t)
 
 attribute ::= <spaces> <name>:k <token '='> <quotedString>:v => (k, v)
 
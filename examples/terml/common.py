@@ -1,5 +1,6 @@
 import string
 from pymeta.grammar import OMeta
+from pymeta.runtime import WhitespaceIndex, indexedSkip
 
 baseGrammar = r"""
 spaces ::= (' '|'\t'|'\f'|('#' (~<eol> <anything>)*))*
@@ -18,9 +19,9 @@ exponent ::= ('e' | 'E'):e ('+' | '-' | => ""):s <decdigits>:ds => concat(e, s,
 floatPart :sign :ds ::= ('.' <decdigits>:fs <exponent>?:e => makeFloat(sign, ds, fs, e)
                                | <exponent>:e => float((sign or '') + concat(ds, e)))
 
-decdigits ::= <digit>:d ((:x ?(isDigit(x)) => x) | '_' => "")*:ds => concat(d, join(ds))
-octaldigit ::= :x ?(isOctDigit(x)) => x
-hexdigit ::= :x ?(isHexDigit(x)) => x
+decdigits ::= <digit>:d ({0-9} | '_' => "")*:ds => concat(d, join(ds))
+octaldigit ::= {0-7}
+hexdigit ::= {0-9a-fA-F}
 
 string ::= <token '"'> (<escapedChar> | ~('"') <anything>)*:c '"' => join(c)
 character ::= <token "'"> (<escapedChar> | ~('\''|'\n'|'\r'|'\\') <anything>):c '\'' => Character(c)
@@ -73,15 +74,6 @@ def makeHex(sign, hs):
 def makeOctal(sign, ds):
     return int((sign or '') + '0'+''.join(ds), 8)
 
-def isDigit(x):
-    return x in string.digits
-
-def isOctDigit(x):
-    return x in string.octdigits
-
-def isHexDigit(x):
-    return x in string.hexdigits
-
 def contains(container, value):
     return value in container
 
@@ -89,3 +81,15 @@ def cons(first, rest):
     return [first] + rest
 
 CommonParser = OMeta.makeGrammar(baseGrammar,  globals(), "CommonParser")
+
+
+class CommonWhitespaceIndex(WhitespaceIndex):
+    """
+    What the 'spaces' rule above skips: blanks other than newlines, and
+    comments up to the end of the line.
+    """
+    spaces = r'[ \t\f]'
+    comment = r'#[^\r\n]*'
+
+CommonParser.rule_spaces = indexedSkip(CommonWhitespaceIndex,
+                                       CommonParser.rule_spaces)
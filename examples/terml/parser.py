@@ -14,7 +14,7 @@ sos ::= <segment> | (<string>:s => tagString(s))
 
 segment ::= <ident> | <special> | <uri>
 
-ident ::= <segStart>:i1 <segPart>*:ibits => join(cons(i1, ibits))
+ident ::= $(<segStart> <segPart>*)
 
 segStart ::= <letter> | '_' | '$'
 
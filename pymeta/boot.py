@@ -85,9 +85,8 @@ class BootOMetaGrammar(OMetaBase):
                 c, e = self.input.head()
             except EOFError:
                 break
-            t = self.input.tail()
             if c.isspace() or consumingComment:
-                self.input = t
+                self.input = self.input.tail()
                 if c == '\n':
                     consumingComment = False
             elif c == '#':
@@ -337,6 +336,98 @@ class BootOMetaGrammar(OMetaBase):
         return (_G_python_7, self.currentError)
 
 
+    def rule_charSetChar(self):
+        _locals = {'self': self}
+        self.locals['charSetChar'] = _locals
+        def _G_or_1():
+            _G_apply_1, lastError = self._apply(self.rule_escapedChar, "escapedChar", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        def _G_or_2():
+            _G_exactly_1, lastError = self.exactly('\\')
+            self.considerError(lastError)
+            _G_apply_2, lastError = self._apply(self.rule_anything, "anything", [])
+            self.considerError(lastError)
+            return (_G_apply_2, self.currentError)
+        def _G_or_3():
+            def _G_not_1():
+                _G_exactly_1, lastError = self.exactly('}')
+                self.considerError(lastError)
+                return (_G_exactly_1, self.currentError)
+            _G_not_2, lastError = self._not(_G_not_1)
+            self.considerError(lastError)
+            _G_apply_3, lastError = self._apply(self.rule_anything, "anything", [])
+            self.considerError(lastError)
+            return (_G_apply_3, self.currentError)
+        _G_or_4, lastError = self._or([_G_or_1, _G_or_2, _G_or_3])
+        self.considerError(lastError)
+        return (_G_or_4, self.currentError)
+
+
+    def rule_charSetRange(self):
+        _locals = {'self': self}
+        self.locals['charSetRange'] = _locals
+        _G_apply_1, lastError = self._apply(self.rule_charSetChar, "charSetChar", [])
+        self.considerError(lastError)
+        _locals['a'] = _G_apply_1
+        def _G_or_2():
+            _G_exactly_1, lastError = self.exactly('-')
+            self.considerError(lastError)
+            def _G_not_2():
+                _G_exactly_1, lastError = self.exactly('}')
+                self.considerError(lastError)
+                return (_G_exactly_1, self.currentError)
+            _G_not_3, lastError = self._not(_G_not_2)
+            self.considerError(lastError)
+            _G_apply_4, lastError = self._apply(self.rule_charSetChar, "charSetChar", [])
+            self.considerError(lastError)
+            _locals['b'] = _G_apply_4
+            _G_python_5, lastError = eval('(a, b)', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_5, self.currentError)
+        def _G_or_3():
+            _G_python_1, lastError = eval('(a, a)', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_1, self.currentError)
+        _G_or_4, lastError = self._or([_G_or_2, _G_or_3])
+        self.considerError(lastError)
+        return (_G_or_4, self.currentError)
+
+
+    def rule_charSet(self):
+        _locals = {'self': self}
+        self.locals['charSet'] = _locals
+        _G_python_1, lastError = eval("'{'", self.globals, _locals), None
+        self.considerError(lastError)
+        _G_apply_2, lastError = self._apply(self.rule_token, "token", [_G_python_1])
+        self.considerError(lastError)
+        def _G_or_3():
+            _G_exactly_1, lastError = self.exactly('^')
+            self.considerError(lastError)
+            _G_python_2, lastError = eval('True', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_2, self.currentError)
+        def _G_or_4():
+            _G_python_1, lastError = eval('False', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_1, self.currentError)
+        _G_or_5, lastError = self._or([_G_or_3, _G_or_4])
+        self.considerError(lastError)
+        _locals['negated'] = _G_or_5
+        def _G_many_6():
+            _G_apply_1, lastError = self._apply(self.rule_charSetRange, "charSetRange", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_many_7, lastError = self.many(_G_many_6)
+        self.considerError(lastError)
+        _locals['ranges'] = _G_many_7
+        _G_exactly_8, lastError = self.exactly('}')
+        self.considerError(lastError)
+        _G_python_9, lastError = eval('self.builder.charSet(ranges, negated)', self.globals, _locals), None
+        self.considerError(lastError)
+        return (_G_python_9, self.currentError)
+
+
     def rule_name(self):
         _locals = {'self': self}
         self.locals['name'] = _locals
@@ -452,9 +543,40 @@ class BootOMetaGrammar(OMetaBase):
             _G_python_6, lastError = eval('self.builder.listpattern(e)', self.globals, _locals), None
             self.considerError(lastError)
             return (_G_python_6, self.currentError)
-        _G_or_10, lastError = self._or([_G_or_1, _G_or_2, _G_or_3, _G_or_4, _G_or_5, _G_or_6, _G_or_7, _G_or_8, _G_or_9])
+        def _G_or_10():
+            _G_python_1, lastError = eval("'$'", self.globals, _locals), None
+            self.considerError(lastError)
+            _G_apply_2, lastError = self._apply(self.rule_token, "token", [_G_python_1])
+            self.considerError(lastError)
+            _G_python_3, lastError = eval("'('", self.globals, _locals), None
+            self.considerError(lastError)
+            _G_apply_4, lastError = self._apply(self.rule_token, "token", [_G_python_3])
+            self.considerError(lastError)
+            _G_apply_5, lastError = self._apply(self.rule_expr, "expr", [])
+            self.considerError(lastError)
+            _locals['e'] = _G_apply_5
+            _G_python_6, lastError = eval("')'", self.globals, _locals), None
+            self.considerError(lastError)
+            _G_apply_7, lastError = self._apply(self.rule_token, "token", [_G_python_6])
+            self.considerError(lastError)
+            _G_python_8, lastError = eval('self.builder.capture(e)', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_8, self.currentError)
+        def _G_or_11():
+            _G_python_1, lastError = eval("'^'", self.globals, _locals), None
+            self.considerError(lastError)
+            _G_apply_2, lastError = self._apply(self.rule_token, "token", [_G_python_1])
+            self.considerError(lastError)
+            _G_python_3, lastError = eval('self.builder.cut()', self.globals, _locals), None
+            self.considerError(lastError)
+            return (_G_python_3, self.currentError)
+        def _G_or_12():
+            _G_apply_1, lastError = self._apply(self.rule_charSet, "charSet", [])
+            self.considerError(lastError)
+            return (_G_apply_1, self.currentError)
+        _G_or_13, lastError = self._or([_G_or_1, _G_or_2, _G_or_3, _G_or_4, _G_or_5, _G_or_6, _G_or_7, _G_or_8, _G_or_9, _G_or_10, _G_or_11, _G_or_12])
         self.considerError(lastError)
-        return (_G_or_10, self.currentError)
+        return (_G_or_13, self.currentError)
 
 
     def rule_expr2(self):
@@ -2,7 +2,11 @@
 import linecache, sys
 from types import ModuleType as module
 
-import itertools, linecache, sys
+import ast, itertools, linecache, sys
+
+from .runtime import failed, CharRanges, Regular, Dispatch, regularRules
+from .runtime import FirstSet, Prediction
+from .runtime import atomicRegexes
 
 class TreeBuilder(object):
     """
@@ -58,19 +62,652 @@ class TreeBuilder(object):
     def expr(self, expr):
         return ["Python", expr]
 
+    def constant(self, value):
+        return ["Constant", value]
+
     def listpattern(self, exprs):
         return ["List", exprs]
 
+    def cut(self):
+        return ["Cut"]
+
+    def capture(self, expr):
+        return ["Capture", expr]
+
+    def charSet(self, ranges, negated):
+        return ["CharSet", ranges, negated]
+
+
+
+def _mergeRanges(ranges):
+    """
+    Sort a list of (first, last) character ranges, merging those that
+    overlap or touch, and dropping empty ones.
+    """
+    merged = []
+    for lo, hi in sorted([tuple(r) for r in ranges if r[0] <= r[1]]):
+        if merged and ord(lo) <= ord(merged[-1][1]) + 1:
+            if hi > merged[-1][1]:
+                merged[-1] = (merged[-1][0], hi)
+        else:
+            merged.append((lo, hi))
+    return merged
+
+
+def _describeChar(c):
+    """
+    Write a character as it would appear in a character set.
+    """
+    if c in "\\-^}":
+        return "\\" + c
+    if c.isprintable():
+        return c
+    return repr(c)[1:-1]
+
+
+def _describeCharSet(ranges, negated):
+    """
+    Write a character set the way a grammar would, for error messages.
+    """
+    bits = []
+    for lo, hi in ranges:
+        if lo == hi:
+            bits.append(_describeChar(lo))
+        else:
+            bits.append("%s-%s" % (_describeChar(lo), _describeChar(hi)))
+    return "{%s%s}" % (negated and "^" or "", "".join(bits))
+
+
+
+def _isRegular(expr):
+    """
+    Whether a grammar tree is regular, so that a L{Regular} can match it: it
+    has only string literals, character sets and applications of the builtin
+    rules in L{regularRules}, combined without bindings, actions,
+    predicates, cuts or list patterns.
+    """
+    kind = expr[0]
+    if kind == "Exactly":
+        return isinstance(expr[1], str)
+    if kind == "CharSet":
+        return True
+    if kind == "Apply":
+        return expr[1] in regularRules and not expr[3]
+    if kind in ("And", "Or"):
+        return bool(expr[1]) and all(map(_isRegular, expr[1]))
+    if kind in ("Many", "Many1", "Optional", "Not", "Lookahead"):
+        return _isRegular(expr[1])
+    return False
+
+
+def _isText(expr, single=False):
+    """
+    Whether a regular grammar tree's value is the text it matches: true of
+    literals, characters, and choices between them, optionally after
+    lookaheads.
+
+    @param single: Whether to require that it matches exactly one character.
+    """
+    kind = expr[0]
+    if kind == "Exactly":
+        return not single or len(expr[1]) == 1
+    if kind in ("CharSet", "Apply"):
+        return True
+    if kind == "Or":
+        return all([_isText(e, single) for e in expr[1]])
+    if kind == "And":
+        return (all([e[0] in ("Not", "Lookahead") for e in expr[1][:-1]])
+                and _isText(expr[1][-1], single))
+    return False
+
+
+def _worthMatching(expr):
+    """
+    Whether matching a regular grammar tree with a L{Regular} saves more
+    than it costs: whether its code would otherwise make more than one call.
+    """
+    return expr[0] not in ("Exactly", "CharSet", "Apply")
+
+
+
+def _leadingLiteral(expr):
+    """
+    Return the string literal a grammar tree starts by matching, if it
+    always starts with one, or None.
+    """
+    kind = expr[0]
+    if kind == "Exactly":
+        if isinstance(expr[1], str) and expr[1]:
+            return expr[1]
+        return None
+    if kind == "And":
+        if expr[1]:
+            return _leadingLiteral(expr[1][0])
+        return None
+    if kind == "Bind":
+        return _leadingLiteral(expr[2])
+    if kind in ("Capture", "Many1"):
+        return _leadingLiteral(expr[1])
+    return None
+
+
+# Rules that, applied to literal arguments, only match input. Rules applied
+# to no arguments are memoized, so matching them twice at the same position
+# runs them once whatever they do.
+_matchingRules = ("token", "exactly")
+
+def _isPure(expr):
+    """
+    Whether a grammar tree only matches input, so that matching it again at
+    the same position gives the same result: it runs no actions, predicates
+    or cuts, and passes rules no arguments but literals.
+    """
+    kind = expr[0]
+    if kind in ("Exactly", "CharSet", "Constant"):
+        return True
+    if kind == "Apply":
+        if expr[1] == "super":
+            return False
+        if not expr[3]:
+            return True
+        if expr[1] not in _matchingRules:
+            return False
+        for arg in expr[3]:
+            if arg[0] == "Constant":
+                continue
+            if arg[0] != "Python":
+                return False
+            try:
+                ast.literal_eval(arg[1])
+            except (SyntaxError, ValueError):
+                return False
+        return True
+    if kind == "Bind":
+        return _isPure(expr[2])
+    if kind in ("Many", "Many1", "Optional", "Not", "Lookahead", "Capture",
+                "List"):
+        return _isPure(expr[1])
+    if kind in ("And", "Or"):
+        return all([_isPure(e) for e in expr[1]])
+    return False
+
+
+def subtrees(expr):
+    """
+    Return the grammar trees directly inside a grammar tree, including a
+    rule application's arguments.
+    """
+    kind = expr[0]
+    if kind in ("Many", "Many1", "Optional", "Not", "Lookahead", "Predicate",
+                "List", "Capture"):
+        return [expr[1]]
+    if kind in ("Bind", "Rule"):
+        return [expr[2]]
+    if kind in ("And", "Or"):
+        return list(expr[1])
+    if kind == "Apply":
+        return list(expr[3])
+    if kind == "Grammar":
+        return list(expr[2])
+    return []
+
+
+def _boundNames(expr):
+    """
+    Return the set of names a grammar tree binds.
+    """
+    names = set()
+    if expr[0] == "Bind":
+        names.add(expr[1])
+    for child in subtrees(expr):
+        names |= _boundNames(child)
+    return names
+
+
+def _hasCut(expr):
+    """
+    Whether a grammar tree contains a cut.
+    """
+    if expr[0] == "Cut":
+        return True
+    return any([_hasCut(child) for child in subtrees(expr)])
+
+
+def _sequence(expr):
+    """
+    Return the list of expressions a grammar tree matches in turn.
+    """
+    while expr[0] in ("Or", "And") and len(expr[1]) == 1:
+        expr = expr[1][0]
+    if expr[0] == "And":
+        return list(expr[1])
+    return [expr]
+
+
+def _factorPrefixes(exprs):
+    """
+    Factor the expressions that consecutive alternatives of a choice start
+    with out of them, so C{A B | A C | D} becomes C{A (B | C) | D} and C{A}
+    is matched once rather than again after C{B} fails.
+
+    Only prefixes that just match input are factored out, since matching one
+    again at the same position would give the same result, and only when
+    what follows them in each alternative doesn't bind their names again
+    (the alternative that fails would leave its bindings in place of the
+    prefix's) and isn't empty (the choice's value comes from the last
+    expression matched). Choices with a cut in them are left alone, as the
+    cut would commit to the inner choice rather than the outer one.
+
+    @param exprs: The alternatives of a choice.
+    @return: A list of alternatives.
+    """
+    if len(exprs) < 2 or any([_hasCut(e) for e in exprs]):
+        return exprs
+    seqs = [_sequence(e) for e in exprs]
+    result = []
+    i = 0
+    while i < len(exprs):
+        j = i + 1
+        first = seqs[i][:1]
+        if len(seqs[i]) > 1 and _isPure(first[0]):
+            while (j < len(exprs) and len(seqs[j]) > 1
+                   and seqs[j][:1] == first):
+                j += 1
+        if j - i < 2:
+            result.append(exprs[i])
+            i += 1
+            continue
+        group = seqs[i:j]
+        size = 1
+        while (all([len(s) > size + 1 for s in group])
+               and _isPure(group[0][size])
+               and all([s[size] == group[0][size] for s in group])):
+            size += 1
+        prefix = group[0][:size]
+        while prefix:
+            names = set()
+            for e in prefix:
+                names |= _boundNames(e)
+            rebound = set()
+            for s in group:
+                for e in s[len(prefix):]:
+                    rebound |= _boundNames(e)
+            if not names & rebound:
+                break
+            prefix = prefix[:-1]
+        if not prefix:
+            result.extend(exprs[i:j])
+        else:
+            rests = []
+            for s in group:
+                rest = s[len(prefix):]
+                if len(rest) == 1:
+                    rests.append(rest[0])
+                else:
+                    rests.append(["And", rest])
+            result.append(["And", prefix + [["Or", rests]]])
+        i = j
+    return result
+
+
+
+class _Start(object):
+    """
+    How a grammar expression can start matching: the items it can consume
+    first, whether it can match without consuming any, and whether it
+    starts by skipping whitespace, in which case the items are those it can
+    consume after the whitespace.
+
+    The items are C{"any"}, a set of them (C{"pos"}: items, character
+    ranges and builtin character classes) or everything except a set
+    (C{"neg"}: items only). C{spaced} is None for expressions that consume
+    nothing at all. For spaced expressions, C{exact} is whether every way
+    of matching nothing after the whitespace leaves the input at the end of
+    it.
+    """
+
+    def __init__(self, kind, items=frozenset(), ranges=(), classes=frozenset(),
+                 nullable=False, spaced=False, exact=True):
+        self.kind = kind
+        self.items = items
+        self.ranges = ranges
+        self.classes = classes
+        self.nullable = nullable
+        self.spaced = spaced
+        self.exact = exact
+
+    def __eq__(self, other):
+        return self.__dict__ == other.__dict__
+
+    def __ne__(self, other):
+        return not self == other
+
+    def firstSet(self):
+        """
+        Return a L{FirstSet} of the items, or None if it could be any.
+        """
+        if self.kind == "any":
+            return None
+        return FirstSet(self.items, self.ranges, sorted(self.classes),
+                        self.kind == "neg")
+
+    def withSets(self, other):
+        """
+        Return a copy with the items of C{other} instead.
+        """
+        return _Start(other.kind, other.items, other.ranges, other.classes,
+                      self.nullable, self.spaced, self.exact)
+
+    def union(self, other):
+        """
+        Return the items of this and another, with this one's other fields.
+        """
+        if self.kind == "any" or other.kind == "any":
+            return self.withSets(_ANY)
+        if self.kind == "pos" and other.kind == "pos":
+            return _Start("pos", self.items | other.items,
+                          tuple(sorted(set(self.ranges) | set(other.ranges))),
+                          self.classes | other.classes, self.nullable,
+                          self.spaced, self.exact)
+        if other.kind == "neg" and self.kind == "neg":
+            items = self.items & other.items
+        else:
+            neg, pos = self, other
+            if neg.kind == "pos":
+                neg, pos = pos, neg
+            first = pos.firstSet()
+            items = frozenset([x for x in neg.items if x not in first])
+        return _Start("neg", items, nullable=self.nullable,
+                      spaced=self.spaced, exact=self.exact)
+
+    def without(self, items):
+        """
+        Return a copy that can't start with any of C{items}.
+        """
+        if self.kind == "any":
+            return self.withSets(_Start("neg", frozenset(items)))
+        if self.kind == "neg":
+            return self.withSets(_Start("neg", self.items | items))
+        return self.withSets(_Start("pos", self.items - items, self.ranges,
+                                    self.classes))
+
+_ANY = _Start("any")
+# What an expression that consumes nothing starts with.
+_EMPTY = _Start("pos", nullable=True, spaced=None)
+# What an expression that never matches starts with.
+_NEVER = _Start("pos", spaced=None)
+# What an expression nothing is known about starts with.
+_UNKNOWN = _Start("any", nullable=True)
+
+
+
+class _Starts(object):
+    """
+    Works out what the expressions of a grammar can start with, and which
+    rules that depends on, given the grammar's rules.
+    """
+
+    # Builtin rules whose start is known.
+    builtins = ("anything", "letter", "digit", "letterOrDigit", "spaces",
+                "token", "exactly")
+
+    # The most characters a negated character set can have for the items it
+    # excludes to be listed.
+    setLimit = 1024
+
+    # The most rounds of working out the rules' starts before giving up.
+    maxRounds = 100
+
+    def __init__(self, rules):
+        """
+        @param rules: The grammar's rules, as a list of C{["Rule", name,
+        expr]} trees.
+        """
+        self.bodies = dict([(rule[1], rule[2]) for rule in rules])
+        self.starts = dict([(name, _NEVER) for name in self.bodies])
+        self.depends = dict([(name, set()) for name in self.bodies])
+        for n in range(self.maxRounds):
+            changed = False
+            for name, body in self.bodies.items():
+                used = set()
+                start = self.start(body, used)
+                self.depends[name] = used
+                if start != self.starts[name]:
+                    self.starts[name] = start
+                    changed = True
+            if not changed:
+                break
+        else:
+            self.starts = dict([(name, _UNKNOWN) for name in self.bodies])
+        for name in self.bodies:
+            self.depends[name] = self.closure([name])
+
+    def closure(self, names):
+        """
+        Return the names of the rules that those named depend on, and their
+        own.
+        """
+        found = set()
+        pending = list(names)
+        while pending:
+            name = pending.pop()
+            if name in found:
+                continue
+            found.add(name)
+            pending.extend(self.depends.get(name, ()))
+        return found
+
+    def literal(self, args):
+        """
+        Return the string a rule is applied to, if its only argument is one.
+        """
+        if len(args) != 1:
+            return None
+        if args[0][0] == "Constant":
+            value = args[0][1]
+        elif args[0][0] != "Python":
+            return None
+        else:
+            try:
+                value = ast.literal_eval(args[0][1])
+            except (ValueError, SyntaxError):
+                return None
+        if isinstance(value, str) and value:
+            return value
+        return None
+
+    def start(self, expr, used):
+        """
+        Return a L{_Start} for a grammar tree, adding the names of the rules
+        it depends on to C{used}.
+        """
+        kind = expr[0]
+        if kind == "Exactly":
+            if isinstance(expr[1], str) and expr[1]:
+                return _Start("pos", frozenset([expr[1][0], expr[1]]))
+            return _UNKNOWN
+        if kind == "CharSet":
+            ranges = _mergeRanges(expr[1])
+            if not expr[2]:
+                return _Start("pos", ranges=tuple(ranges))
+            size = sum([ord(hi) - ord(lo) + 1 for lo, hi in ranges])
+            if size > self.setLimit:
+                return _ANY
+            return _Start("neg", frozenset(
+                    [chr(c) for lo, hi in ranges
+                     for c in range(ord(lo), ord(hi) + 1)]))
+        if kind == "Apply":
+            return self.applyStart(expr[1], expr[3], used)
+        if kind == "Or":
+            return self.choiceStart(expr[1], used)
+        if kind == "And":
+            return self.sequenceStart(expr[1], used)
+        if kind in ("Many", "Optional"):
+            start = self.start(expr[1], used)
+            if start.spaced is None:
+                return _EMPTY
+            return _Start(start.kind, start.items, start.ranges,
+                          start.classes, True, start.spaced, False)
+        if kind in ("Many1", "Capture"):
+            return self.start(expr[1], used)
+        if kind == "Bind":
+            return self.start(expr[2], used)
+        if kind == "List":
+            return _ANY
+        return _EMPTY
+
+    def applyStart(self, name, args, used):
+        """
+        Return a L{_Start} for an application of a rule.
+        """
+        if name in self.bodies:
+            used.add(name)
+            if args:
+                return _UNKNOWN
+            return self.starts[name]
+        if name not in self.builtins:
+            return _UNKNOWN
+        literal = self.literal(args)
+        if name == "token" and literal is not None:
+            used.add(name)
+            return _Start("pos", frozenset([literal[0]]), spaced=True)
+        if name == "exactly" and literal is not None:
+            used.add(name)
+            return _Start("pos", frozenset([literal[0], literal]))
+        if args:
+            return _UNKNOWN
+        used.add(name)
+        if name == "anything":
+            return _ANY
+        if name == "spaces":
+            return _Start("pos", nullable=True, spaced=True)
+        return _Start("pos", classes=frozenset([name]))
+
+    def choiceStart(self, exprs, used):
+        """
+        Return a L{_Start} for a choice between expressions.
+        """
+        result = _NEVER
+        for expr in exprs:
+            start = self.start(expr, used)
+            if start == _NEVER:
+                continue
+            if result == _NEVER:
+                result = start
+                continue
+            nullable = result.nullable or start.nullable
+            spaced = result.spaced
+            if spaced is None:
+                spaced = start.spaced
+            elif start.spaced is not None and start.spaced != spaced:
+                return _Start("any", nullable=True)
+            exact = all([not s.nullable or (s.spaced and s.exact)
+                         for s in (result, start)])
+            result = result.union(start)
+            result = _Start(result.kind, result.items, result.ranges,
+                            result.classes, nullable, spaced, exact)
+        return result
+
+    def sequenceStart(self, exprs, used):
+        """
+        Return a L{_Start} for a sequence of expressions. Negative
+        lookaheads of single items rule those items out of what follows
+        them, where that starts at the same position.
+        """
+        result = _EMPTY
+        excluded = frozenset()
+        for expr in exprs:
+            if expr[0] == "Not":
+                excluded = excluded | frozenset(self.singleItems(expr[1]))
+                continue
+            start = self.start(expr, used)
+            if start.spaced is None:
+                if start.nullable:
+                    continue
+                return _Start(result.kind, result.items, result.ranges,
+                              result.classes, False, result.spaced,
+                              result.exact)
+            afterSpaces = result.spaced and result.exact
+            if result.spaced is None or result.spaced == start.spaced:
+                spaced = start.spaced
+            elif afterSpaces:
+                # Whatever follows whitespace skipped to its end starts
+                # after it too.
+                spaced = True
+            else:
+                return _UNKNOWN
+            if excluded and (afterSpaces or not start.spaced):
+                start = start.without(excluded)
+            exact = result.exact and (not start.spaced or start.exact)
+            merged = result.union(start)
+            result = _Start(merged.kind, merged.items, merged.ranges,
+                            merged.classes, start.nullable, spaced, exact)
+            if not start.nullable:
+                break
+            if start.spaced:
+                excluded = frozenset()
+        return result
+
+    def singleItems(self, expr):
+        """
+        Return the items that an expression matches on their own, whatever
+        follows them: single characters it matches as a literal or
+        character set, or as one of a choice of them.
+        """
+        if expr[0] == "And" and len(expr[1]) == 1:
+            return self.singleItems(expr[1][0])
+        if expr[0] == "Or":
+            items = []
+            for e in expr[1]:
+                items.extend(self.singleItems(e))
+            return items
+        if expr[0] == "Exactly" and isinstance(expr[1], str) and \
+                len(expr[1]) == 1:
+            return [expr[1]]
+        if expr[0] == "CharSet" and not expr[2]:
+            ranges = _mergeRanges(expr[1])
+            if sum([ord(hi) - ord(lo) + 1 for lo, hi in ranges]) <= 16:
+                return [chr(c) for lo, hi in ranges
+                        for c in range(ord(lo), ord(hi) + 1)]
+        return []
+
 
 
 class PythonWriter(object):
     """
     Converts an OMeta syntax tree into Python source.
     """
+
+    # The most characters a character set can have to be compiled to a
+    # frozenset of them, rather than a list of ranges.
+    charSetLimit = 1024
+    # Whether to compile choices whose alternatives all start with string
+    # literals to a lookup of the alternatives that can match the next item.
+    dispatchChoices = True
+    # Whether to factor what consecutive alternatives of a choice start with
+    # out of them, to match it once.
+    factorChoices = True
+
     def __init__(self, tree):
         self.tree = tree
         self.lines = []
         self.gensymCounter = 0
+        self.cutIndex = None
+        self.committing = set()
+        # Lines defining module-level constants, shared with subwriters.
+        self.constants = []
+
+
+    def _subwriter(self, expr):
+        """
+        Make a writer for code nested in this writer's, sharing its
+        constants.
+        """
+        subwriter = self.__class__(expr)
+        subwriter.constants = self.constants
+        subwriter.dispatchChoices = self.dispatchChoices
+        subwriter.factorChoices = self.factorChoices
+        return subwriter
 
 
     def _generate(self, retrn=False):
@@ -83,7 +720,8 @@ class PythonWriter(object):
 
 
     def output(self):
-        return '\n'.join(self._generate())
+        lines = self._generate()
+        return '\n'.join(self.constants + lines)
 
 
     def _generateNode(self, node):
@@ -100,16 +738,27 @@ class PythonWriter(object):
         return "_G_%s_%s" % (name, self.gensymCounter)
 
 
-    def _newThunkFor(self, name, expr):
+    def _newThunkFor(self, name, expr, choice=False):
         """
         Define a new function of no arguments.
         @param name: The name of the rule generating this thunk.
         @param expr: A list of lines of Python code.
+        @param choice: Whether the function matches one option of a choice,
+        which a cut in it commits to.
         """
         
-        subwriter = self.__class__(expr)
+        subwriter = self._subwriter(expr)
         flines  = subwriter._generate(retrn=True)
         fname = self._gensym(name)
+        if choice and subwriter.cutIndex is not None:
+            # Everything after the cut goes in a function of its own, so its
+            # failure can be told apart from a failure before the cut.
+            rest = flines[subwriter.cutIndex:]
+            del flines[subwriter.cutIndex:]
+            restname = subwriter._gensym("cut")
+            subwriter._writeFunction(restname, (), rest)
+            flines.append("return self.committed(%s)" % (restname,))
+            self.committing.add(fname)
         self._writeFunction(fname, (),  flines)
         return fname
 
@@ -160,24 +809,39 @@ class PythonWriter(object):
 
     def generate_Exactly(self, literal):
         """
-        Create a call to self.exactly(expr).
+        Create a call to self.exactly(expr), or to self.exactlyString(expr)
+        for a string of several characters.
         """
+        if isinstance(literal, str) and len(literal) > 1:
+            return self._expr('exactly', 'self.exactlyString(%r)' % (literal,))
         return self._expr('exactly', 'self.exactly(%r)' % (literal,))
 
 
     def generate_Many(self, expr):
         """
-        Create a call to self.many(lambda: expr).
+        Create a call to self.many(lambda: expr), or for a character set to
+        self.charSetMany(...), which scans the input in one loop.
         """
-        fname = self._newThunkFor("many", expr)
+        if expr[0] == "CharSet":
+            return self._expr('many', 'self.charSetMany(%s)'
+                              % (self._charSetArgs(*expr[1:]),))
+        fname = self._newThunkFor("many", expr, choice=True)
         return self._expr('many', 'self.many(%s)' % (fname,))
 
 
     def generate_Many1(self, expr):
         """
-        Create a call to self.many(lambda: expr).
+        Create a call to self.many(lambda: expr), or for a character set to
+        self.charSetMany(..., True).
         """
-        fname = self._newThunkFor("many1", expr)
+        if expr[0] == "CharSet":
+            return self._expr('many1', 'self.charSetMany(%s, True)'
+                              % (self._charSetArgs(*expr[1:]),))
+        fname = self._newThunkFor("many1", expr, choice=True)
+        if fname in self.committing:
+            # The first item is a choice too, between matching and failing.
+            return self._expr('many1', 'self.many(%s, self._or([%s]))'
+                              % (fname, fname))
         return self._expr('many1', 'self.many(%s, %s())' % (fname, fname))
 
 
@@ -185,7 +849,7 @@ class PythonWriter(object):
         """
         Try to parse an expr and continue if it fails.
         """
-        realf = self._newThunkFor("optional", expr)
+        realf = self._newThunkFor("optional", expr, choice=True)
         passf = self._gensym("optional")
         self._writeFunction(passf, (), ["return (None, self.input.nullError())"])
         return self._expr('or', 'self._or([%s])' % (', '.join([realf, passf])))
@@ -194,10 +858,31 @@ class PythonWriter(object):
     def generate_Or(self, exprs):
         """
         Create a call to
-        self._or([lambda: expr1, lambda: expr2, ... , lambda: exprN]).
+        self._or([lambda: expr1, lambda: expr2, ... , lambda: exprN]), or if
+        each alternative starts with a string literal to
+        self.dispatch(table, [...]), which calls only those whose literal
+        can match the next item. Prefixes that consecutive alternatives share
+        are factored out of them first.
+        """
+        if self.factorChoices:
+            exprs = _factorPrefixes(exprs)
+        return self._generateChoice(exprs)
+
+
+    def _generateChoice(self, exprs):
+        """
+        Generate code for a choice between alternatives whose shared
+        prefixes have been factored out, as L{generate_Or} does.
         """
         if len(exprs) > 1:
-            fnames = [self._newThunkFor("or", expr) for expr in exprs]
+            fnames = [self._newThunkFor("or", expr, choice=True)
+                      for expr in exprs]
+            literals = [_leadingLiteral(expr) for expr in exprs]
+            if self.dispatchChoices and None not in literals:
+                table = self._constant("dispatch", "Dispatch(%r)"
+                                       % (literals,))
+                return self._expr('or', 'self.dispatch(%s, [%s])'
+                                  % (table, ', '.join(fnames)))
             return self._expr('or', 'self._or([%s])' % (', '.join(fnames)))
         else:
             return self._generateNode(exprs[0])
@@ -262,6 +947,13 @@ class PythonWriter(object):
         return self.compilePythonExpr(expr)
 
 
+    def generate_Constant(self, value):
+        """
+        Generate a literal for the value of a constant Python expression.
+        """
+        return self._expr('constant', '%r, None' % (value,))
+
+
     def generate_List(self, expr):
         """
         Generate a call to self.listpattern(lambda: expr).
@@ -270,13 +962,120 @@ class PythonWriter(object):
         return  self._expr("listpattern", "self.listpattern(%s)" %(fname,))
 
 
+    def generate_Capture(self, expr):
+        """
+        Generate a call to self.capture(lambda: expr).
+        """
+        fname = self._newThunkFor("capture", expr)
+        return self._expr("capture", "self.capture(%s)" % (fname,))
+
+
+    def generate_CharSet(self, ranges, negated):
+        """
+        Create a call to self.charSet(members, negated, description).
+        """
+        return self._expr('charset', 'self.charSet(%s)'
+                          % (self._charSetArgs(ranges, negated),))
+
+
+    def _charSetArgs(self, ranges, negated):
+        """
+        Return the arguments for a call matching a character set: a constant
+        holding its members, made once when the grammar's module is loaded,
+        whether it's negated, and how it was written.
+
+        The members are a frozenset, or for sets too large to list a
+        L{pymeta.runtime.CharRanges}.
+        """
+        ranges = _mergeRanges(ranges)
+        size = sum([ord(hi) - ord(lo) + 1 for lo, hi in ranges])
+        if size <= self.charSetLimit:
+            members = ''.join([''.join(map(chr, range(ord(lo), ord(hi) + 1)))
+                               for lo, hi in ranges])
+            value = "frozenset(%r)" % (members,)
+        else:
+            value = "CharRanges(%r)" % (ranges,)
+        return "%s, %r, %r" % (self._constant("members", value), negated,
+                               _describeCharSet(ranges, negated))
+
+
+    def _constant(self, kind, value):
+        """
+        Return the name of a module-level constant with the given value,
+        defining it if there isn't one already.
+
+        @param kind: A word for the kind of value, used in its name.
+        @param value: A Python expression.
+        """
+        definition = " = " + value
+        for line in self.constants:
+            if line.endswith(definition):
+                return line[:-len(definition)]
+        name = "_G_%s_%s" % (kind, len(self.constants) + 1)
+        self.constants.append(name + definition)
+        return name
+
+
+    def generate_Cut(self):
+        """
+        Create a call to self.cut(). In an alternative or repetition, the
+        code after it runs inside a call to self.committed().
+        """
+        name = self._expr('cut', 'self.cut()')
+        if self.cutIndex is None:
+            self.cutIndex = len(self.lines)
+        return name
+
+
     def generate_Rule(self, name, expr):
         rulelines = ["_locals = {'self': self}",
                      "self.locals[%r] = _locals" % (name,)]
-        subwriter = self.__class__(expr)
+        subwriter = self._subwriter(expr)
         flines  = subwriter._generate(retrn=True)
         rulelines.extend(flines)
         self._writeFunction("rule_" + name, ("self",), rulelines)
+        repetition = self._trailingRepetition(expr)
+        if repetition is not None:
+            self.lines.extend(['', ''])
+            self._writeIterFunction(name, *repetition)
+
+
+    def _trailingRepetition(self, expr):
+        """
+        Find the repetition a rule's value comes from, if it ends with one.
+
+        @return: A list of the expressions matched before the repetition,
+        and the repetition itself, or C{None}.
+        """
+        if expr[0] in ("Many", "Many1"):
+            return [], expr
+        if expr[0] == "Bind":
+            return self._trailingRepetition(expr[2])
+        if expr[0] == "Or" and len(expr[1]) == 1:
+            return self._trailingRepetition(expr[1][0])
+        if expr[0] == "And" and expr[1]:
+            found = self._trailingRepetition(expr[1][-1])
+            if found is not None:
+                return expr[1][:-1] + found[0], found[1]
+        return None
+
+
+    def _writeIterFunction(self, name, prefix, repetition):
+        """
+        Generate a method for L{OMetaBase.iterparse} that matches everything
+        in a rule before its trailing repetition, and returns the thunk for
+        one item of the repetition and whether at least one is required.
+        """
+        subwriter = self._subwriter(["And", prefix])
+        subwriter._generateNode(subwriter.tree)
+        fname = subwriter._newThunkFor(repetition[0].lower(), repetition[1],
+                                       choice=True)
+        subwriter.lines.append("return (%s, %r)" % (fname,
+                                                    repetition[0] == "Many1"))
+        rulelines = ["_locals = {'self': self}",
+                     "self.locals[%r] = _locals" % (name,)]
+        rulelines.extend(subwriter.lines)
+        self._writeFunction("iter_" + name, ("self",), rulelines)
 
 
     def generate_Grammar(self, name, rules):
@@ -288,9 +1087,239 @@ class PythonWriter(object):
         del self.lines[-2:]
 
 
+class SentinelPythonWriter(PythonWriter):
+    """
+    Converts an OMeta syntax tree into Python source for a grammar based on
+    L{pymeta.runtime.SentinelOMetaBase}, which returns C{failed} as the
+    value of a match that fails instead of raising ParseError. The generated
+    code checks each value and returns the failure as soon as it sees one.
+    """
+
+    # Kinds of expression whose code can't fail to match.
+    infallible = ("python", "constant", "cut")
+
+    def _expr(self, typ, e):
+        """
+        Generate the code needed to execute the expression, return from the
+        function if it fails, and return the variable name bound to its
+        value.
+        """
+        name = self._gensym(typ)
+        self.lines.append("%s, lastError = %s" % (name, e))
+        if typ not in self.infallible:
+            self.lines.append("if %s is failed:" % (name,))
+            self.lines.append("    return failed, lastError")
+        self.lines.append("self.considerError(lastError)")
+        return name
+
+
+class FastPythonWriter(SentinelPythonWriter):
+    """
+    Converts an OMeta syntax tree into Python source for a grammar based on
+    L{pymeta.runtime.FastOMetaBase}, which tracks no error information. The
+    code is that of L{SentinelPythonWriter} without the calls to
+    considerError, and its functions return no error with their values.
+
+    Regular parts of the grammar are matched by a single precompiled regular
+    expression where that's possible, through L{FastOMetaBase.regular}: a
+    capture of one, a repetition of single characters, a choice between
+    strings, and a run of them whose values go unused in a sequence.
+    Failures are reported by the grammar's C{detailedClass}, which matches
+    them as usual, so the errors are those the PEG gives.
+    """
+
+    # Whether to match regular parts of the grammar with regular
+    # expressions, which needs the atomic groups of Python 3.11.
+    lowerRegular = atomicRegexes
+
+    # Whether to call only the alternatives of a choice that can start with
+    # the next item of input.
+    predictChoices = True
+
+    def __init__(self, tree):
+        SentinelPythonWriter.__init__(self, tree)
+        self.starts = _Starts([])
+        self.grammarName = None
+
+
+    def _subwriter(self, expr):
+        subwriter = SentinelPythonWriter._subwriter(self, expr)
+        subwriter.lowerRegular = self.lowerRegular
+        subwriter.predictChoices = self.predictChoices
+        subwriter.starts = self.starts
+        subwriter.grammarName = self.grammarName
+        return subwriter
+
+
+    def generate_Grammar(self, name, rules):
+        """
+        Work out what the grammar's rules can start with, then generate
+        them.
+        """
+        self.starts = _Starts(rules)
+        self.grammarName = name
+        return SentinelPythonWriter.generate_Grammar(self, name, rules)
+
+
+    def _regular(self, expr, kind, node):
+        """
+        Create a call to self.regular(pattern, kind, fn), where the pattern
+        matches C{expr} and C{fn} is the code for C{node}, without regular
+        expressions, for input that can't match them.
+        """
+        subwriter = self._subwriter(node)
+        subwriter.lowerRegular = False
+        flines = subwriter._generate(retrn=True)
+        fname = self._gensym("regular")
+        self._writeFunction(fname, (), flines)
+        pattern = self._constant("pattern", "Regular(%r)" % (expr,))
+        return self._expr("regular", "self.regular(%s, %r, %s)"
+                          % (pattern, kind, fname))
+
+
+    def generate_Capture(self, expr):
+        """
+        Match a capture of a regular expression in one step.
+        """
+        if self.lowerRegular and _isRegular(expr):
+            return self._regular(expr, "slice", ["Capture", expr])
+        return SentinelPythonWriter.generate_Capture(self, expr)
+
+
+    def generate_Many(self, expr):
+        """
+        Match a repetition of single characters in one step.
+        """
+        node = ["Many", expr]
+        if (self.lowerRegular and _worthMatching(expr) and _isRegular(expr)
+            and _isText(expr, single=True)):
+            return self._regular(node, "list", node)
+        return SentinelPythonWriter.generate_Many(self, expr)
+
+
+    def generate_Many1(self, expr):
+        """
+        Match a repetition of single characters in one step.
+        """
+        node = ["Many1", expr]
+        if (self.lowerRegular and _worthMatching(expr) and _isRegular(expr)
+            and _isText(expr, single=True)):
+            return self._regular(node, "list", node)
+        return SentinelPythonWriter.generate_Many1(self, expr)
+
+
+    def generate_Or(self, exprs):
+        """
+        Match a choice between strings in one step, or else call only the
+        alternatives that can start with the next item of input, as
+        self.dispatch(prediction, [...]) with a L{Prediction} from what
+        each alternative can start with.
+        """
+        node = ["Or", exprs]
+        if (self.lowerRegular and len(exprs) > 1 and _isRegular(node)
+            and _isText(node)):
+            return self._regular(node, "text", node)
+        if self.factorChoices:
+            exprs = _factorPrefixes(exprs)
+        literals = [_leadingLiteral(expr) for expr in exprs]
+        if (self.predictChoices and len(exprs) > 1
+            and not (self.dispatchChoices and None not in literals)):
+            prediction = self._prediction(exprs)
+            if prediction is not None:
+                fnames = [self._newThunkFor("or", expr, choice=True)
+                          for expr in exprs]
+                return self._expr('or', 'self.dispatch(%s, [%s])'
+                                  % (prediction, ', '.join(fnames)))
+        return self._generateChoice(exprs)
+
+
+    def _prediction(self, exprs):
+        """
+        Return the name of a constant holding a L{Prediction} for a choice,
+        or None if it wouldn't rule out any alternative.
+
+        Alternatives that start by skipping whitespace are told apart by the
+        item after it, others by the next item, whichever rules out more.
+        """
+        used = set()
+        starts = [self.starts.start(expr, used) for expr in exprs]
+        def ruledOut(start, spaced):
+            return (not start.nullable and start.kind != "any"
+                    and start.spaced in (None, spaced))
+        spaced = (len([s for s in starts if ruledOut(s, True)]) >
+                  len([s for s in starts if ruledOut(s, False)]))
+        firsts = [ruledOut(s, spaced) and s.firstSet() or None
+                  for s in starts]
+        if firsts.count(None) == len(firsts):
+            return None
+        used = self.starts.closure(used)
+        rules = sorted([name for name in used if name in self.starts.bodies])
+        builtins = sorted([name for name in used
+                           if name not in self.starts.bodies])
+        return self._constant("prediction", "Prediction(%r, %r, %r, %r, "
+                              "globals(), %r)" % (firsts, spaced, rules,
+                                                  builtins, self.grammarName))
+
+
+    def generate_And(self, exprs):
+        """
+        Generate code for each statement in order, matching each run of
+        regular statements before the last, whose values go unused, in one
+        step.
+        """
+        if not self.lowerRegular:
+            return SentinelPythonWriter.generate_And(self, exprs)
+        run = []
+        for ex in exprs[:-1]:
+            if _isRegular(ex):
+                run.append(ex)
+                continue
+            self._generateRun(run)
+            run = []
+            self._generateNode(ex)
+        self._generateRun(run)
+        if exprs:
+            return self._generateNode(exprs[-1])
+        return None
+
+
+    def _generateRun(self, run):
+        """
+        Generate code for a run of regular statements whose values go
+        unused, as one step if that's worth it.
+        """
+        if len(run) > 1 or (run and _worthMatching(run[0])):
+            self._regular(["And", run], "skip", ["And", run])
+        else:
+            for ex in run:
+                self._generateNode(ex)
+
+    def _generate(self, retrn=False):
+        result = self._generateNode(self.tree)
+        if retrn:
+            self.lines.append("return (%s, None)" % (result,))
+        elif result:
+            self.lines.append(result)
+        return self.lines
+
+
+    def _expr(self, typ, e):
+        """
+        Generate the code needed to execute the expression, return from the
+        function if it fails, and return the variable name bound to its
+        value.
+        """
+        name = self._gensym(typ)
+        self.lines.append("%s, lastError = %s" % (name, e))
+        if typ not in self.infallible:
+            self.lines.append("if %s is failed:" % (name,))
+            self.lines.append("    return failed, None")
+        return name
+
+
 
-def writePython(tree):
-    pw = PythonWriter(tree)
+def writePython(tree, writerClass=PythonWriter):
+    pw = writerClass(tree)
     return pw.output()
 
 
@@ -306,8 +1335,9 @@ class GeneratedCodeLoader(object):
 
 
 
-def moduleFromGrammar(tree, className, superclass, globalsDict):
-    source = writePython(tree)
+def moduleFromGrammar(tree, className, superclass, globalsDict,
+                      writerClass=PythonWriter):
+    source = writePython(tree, writerClass)
     modname = "pymeta_grammar__" + className
     filename = "/pymeta_generated_code/" + modname + ".py"
     mod = module(modname)
@@ -315,6 +1345,12 @@ def moduleFromGrammar(tree, className, superclass, globalsDict):
     mod.__name__ = modname
     mod.__dict__[superclass.__name__] = superclass
     mod.__dict__["GrammarBase"] = superclass
+    mod.__dict__["failed"] = failed
+    mod.__dict__["CharRanges"] = CharRanges
+    mod.__dict__["Regular"] = Regular
+    mod.__dict__["Dispatch"] = Dispatch
+    mod.__dict__["FirstSet"] = FirstSet
+    mod.__dict__["Prediction"] = Prediction
     mod.__loader__ = GeneratedCodeLoader(source)
     code = compile(source, filename, "exec")
     eval(code, mod.__dict__)
@@ -3,16 +3,24 @@
 Public interface to OMeta, as well as the grammars used to compile grammar
 definitions.
 """
+import ast
 import string
-from .builder import TreeBuilder, moduleFromGrammar
+from .builder import TreeBuilder, PythonWriter, SentinelPythonWriter
+from .builder import FastPythonWriter
+from .builder import moduleFromGrammar, subtrees
 from .boot import BootOMetaGrammar
-from .runtime import OMetaBase, ParseError, EOFError
+from .runtime import OMetaBase, SentinelOMetaBase, FastOMetaBase
+from .runtime import ParseError, EOFError, WhitespaceIndex
 
 class OMeta(OMetaBase):
     """
     Base class for grammar definitions.
     """
     metagrammarClass = BootOMetaGrammar
+    writerClass = PythonWriter
+    # Rewrites the grammar's tree before its code is written, if set: a
+    # GrammarOptimizer, say. Grammars are written as parsed by default.
+    optimizerClass = None
     def makeGrammar(cls, grammar, globals, name="Grammar"):
         """
         Define a new subclass with the rules in the given grammar.
@@ -24,18 +32,66 @@ class OMeta(OMetaBase):
         """
         g = cls.metagrammarClass(grammar)
         tree = g.parseGrammar(name, TreeBuilder)
-        return moduleFromGrammar(tree, name, cls, globals)
+        if cls.optimizerClass is not None:
+            tree = cls.optimizerClass().optimize(tree)
+        return moduleFromGrammar(tree, name, cls, globals, cls.writerClass)
     
     makeGrammar = classmethod(makeGrammar)
 
+
+
+class SentinelOMeta(SentinelOMetaBase, OMeta):
+    """
+    Base class for grammar definitions whose rules return a sentinel value
+    when they fail to match, rather than raising an exception. Only the
+    public C{apply} raises L{ParseError}.
+    """
+    writerClass = SentinelPythonWriter
+
+
+
+class FastOMeta(FastOMetaBase, SentinelOMeta):
+    """
+    Base class for grammar definitions that track no error information
+    while matching. A grammar that fails is parsed again by its
+    C{detailedClass}, defined from the same rules on L{SentinelOMeta}, to
+    report the error.
+    """
+    writerClass = FastPythonWriter
+    detailedClass = SentinelOMeta
+
+    def makeGrammar(cls, grammar, globals, name="Grammar"):
+        """
+        Define a new subclass with the rules in the given grammar, and a
+        subclass of this class's C{detailedClass} with the same rules to be
+        its C{detailedClass}.
+
+        @param grammar: A string containing a PyMeta grammar.
+        @param globals: A dict of names that should be accessible by this
+        grammar.
+        @param name: The name of the class to be generated.
+        """
+        g = cls.metagrammarClass(grammar)
+        tree = g.parseGrammar(name, TreeBuilder)
+        if cls.optimizerClass is not None:
+            tree = cls.optimizerClass().optimize(tree)
+        fast = moduleFromGrammar(tree, name, cls, globals, cls.writerClass)
+        fast.detailedClass = moduleFromGrammar(
+            tree, name, cls.detailedClass, globals,
+            cls.detailedClass.writerClass)
+        return fast
+
+    makeGrammar = classmethod(makeGrammar)
+
+
 ometaGrammar = r"""
 number ::= <spaces> ('-' <barenumber>:x => -x
                     |<barenumber>:x => x)
 barenumber ::= ('0' (('x'|'X') <hexdigit>*:hs => int(''.join(hs), 16)
                     |<octaldigit>*:ds => int('0'+''.join(ds), 8))
                |<digit>+:ds => int(''.join(ds)))
-octaldigit ::= :x ?(x in string.octdigits) => x
-hexdigit ::= :x ?(x in string.hexdigits) => x
+octaldigit ::= {0-7}
+hexdigit ::= {0-9a-fA-F}
 
 escapedChar ::= '\\' ('n' => "\n"
                      |'r' => "\r"
@@ -51,7 +107,14 @@ character ::= <token "'"> (<escapedChar> | <anything>):c <token "'"> => c
 bareString ::= <token '"'> (<escapedChar> | ~('"') <anything>)*:c <token '"'> => ''.join(c)
 string ::= <bareString>:s => self.builder.exactly(s)
 
-name ::= <letter>:x <letterOrDigit>*:xs !(xs.insert(0, x)) => ''.join(xs)
+charSetChar ::= (<escapedChar> | '\\' <anything> | ~('}') <anything>)
+charSetRange ::= <charSetChar>:a ('-' ~('}') <charSetChar>:b => (a, b)
+                                 | => (a, a))
+charSet ::= <token '{'> ('^' => True
+                        | => False):negated
+            <charSetRange>*:ranges '}' => self.builder.charSet(ranges, negated)
+
+name ::= $(<letter> <letterOrDigit>*)
 
 application ::= (<token '<'> <spaces> <name>:name
                   (' ' !(self.applicationArgs(finalChar='>')):args
@@ -66,7 +129,11 @@ expr1 ::= (<application>
           |(<number> | <character>):lit => self.builder.exactly(lit)
           |<string>
           |<token '('> <expr>:e <token ')'> => e
-          |<token '['> <expr>:e <token ']'> => self.builder.listpattern(e))
+          |<token '['> <expr>:e <token ']'> => self.builder.listpattern(e)
+          |<token '$'> <token '('> <expr>:e <token ')'>
+            => self.builder.capture(e)
+          |<token '^'> => self.builder.cut()
+          |<charSet>)
 
 expr2 ::= (<token '~'> (<token '~'> <expr2>:e => self.builder.lookahead(e)
                        |<expr2>:e => self.builder._not(e))
@@ -117,8 +184,8 @@ number ::= <spaces> ('-' <barenumber>:x => self.builder.exactly(-x)
 barenumber ::= '0' (('x'|'X') <hexdigit>*:hs => int(''.join(hs), 16)
                     |<octaldigit>*:ds => int('0'+''.join(ds), 8))
                |<digit>+:ds => int(''.join(ds))
-octaldigit ::= :x ?(x in string.octdigits) => x
-hexdigit ::= :x ?(x in string.hexdigits) => x
+octaldigit ::= {0-7}
+hexdigit ::= {0-9a-fA-F}
 
 escapedChar ::= '\\' ('n' => "\n"
                      |'r' => "\r"
@@ -133,7 +200,14 @@ character ::= <token "'"> (<escapedChar> | <anything>):c <token "'"> => self.bui
 
 string ::= <token '"'> (<escapedChar> | ~('"') <anything>)*:c <token '"'> => self.builder.exactly(''.join(c))
 
-name ::= <letter>:x <letterOrDigit>*:xs !(xs.insert(0, x)) => ''.join(xs)
+charSetChar ::= (<escapedChar> | '\\' <anything> | ~('}') <anything>)
+charSetRange ::= <charSetChar>:a ('-' ~('}') <charSetChar>:b => (a, b)
+                                 | => (a, a))
+charSet ::= <token '{'> ('^' => True
+                        | => False):negated
+            <charSetRange>*:ranges '}' => self.builder.charSet(ranges, negated)
+
+name ::= $(<letter> <letterOrDigit>*)
 
 application ::= <indentation>? <name>:name
                   ('(' !(self.applicationArgs(finalChar=')')):args
@@ -149,6 +223,10 @@ expr1 ::= <application>
           |<string>
           |<token '('> <expr>:e <token ')'> => e
           |<token '['> <expr>:e <token ']'> => self.builder.listpattern(e)
+          |<token '$'> <token '('> <expr>:e <token ')'>
+            => self.builder.capture(e)
+          |<token '^'> => self.builder.cut()
+          |<charSet>
 
 expr2 ::= <token '~'> (<token '~'> <expr2>:e => self.builder.lookahead(e)
                        |<expr2>:e => self.builder._not(e))
@@ -187,10 +265,21 @@ rule ::= <noindentation> ~~(<name>:n) <rulePart n>:r
 grammar ::= <rule>*:rs <spaces> => self.builder.makeGrammar(rs)
 """
 
+class GrammarWhitespaceIndex(WhitespaceIndex):
+    """
+    Whitespace in grammar definitions, which includes comments from '#' to
+    the end of the line.
+    """
+    comment = r'#[^\n]*'
+
+
+
 class OMetaGrammarMixin(object):
     """
     Helpers for the base grammar for parsing grammar definitions.
     """
+    whitespaceIndex = GrammarWhitespaceIndex
+
     def parseGrammar(self, name, builder, *args):
         """
         Entry point for converting a grammar to code (of some variety).
@@ -263,6 +352,9 @@ class OMetaGrammarMixin(object):
         """
         Consume input until a non-whitespace character is reached.
         """
+        i = self.input
+        if self.whitespaceIndex is not None and i.indexFor is not None:
+            return True, i.skipWhitespace(self.whitespaceIndex)
         consumingComment = False
         e = None
         while True:
@@ -270,9 +362,8 @@ class OMetaGrammarMixin(object):
                 c, e = self.input.head()
             except EOFError:
                 break
-            t = self.input.tail()
             if c.isspace() or consumingComment:
-                self.input = t
+                self.input = self.input.tail()
                 if c == '\n':
                     consumingComment = False
             elif c == '#':
@@ -311,7 +402,11 @@ opt ::= ( ["Apply" :ruleName :codeName [<anything>*:exprs]] => self.builder.appl
         | ["Predicate" <opt>:expr] => self.builder.pred(expr)
         | ["Action" :code] => self.builder.action(code)
         | ["Python" :code] => self.builder.expr(code)
+        | ["Constant" :value] => self.builder.constant(value)
         | ["List" <opt>:exprs] => self.builder.listpattern(exprs)
+        | ["Cut"] => self.builder.cut()
+        | ["Capture" <opt>:expr] => self.builder.capture(expr)
+        | ["CharSet" :ranges :negated] => self.builder.charSet(ranges, negated)
         )
 grammar ::= ["Grammar" :name [<rulePair>*:rs]] => self.builder.makeGrammar(rs)
 rulePair ::= ["Rule" :name <opt>:rule] => self.builder.rule(name, rule)
@@ -319,3 +414,240 @@ rulePair ::= ["Rule" :name <opt>:rule] => self.builder.rule(name, rule)
 """
 
 NullOptimizer = OMeta.makeGrammar(nullOptimizationGrammar, {}, name="NullOptimizer")
+
+
+def _contains(expr, kinds):
+    """
+    Whether a grammar tree contains a node of one of the given kinds.
+    """
+    if expr[0] in kinds:
+        return True
+    return any([_contains(child, kinds) for child in subtrees(expr)])
+
+
+def _isConstant(code):
+    """
+    Whether a Python expression is a literal whose value can be written
+    back as one: one C{ast.literal_eval} accepts and whose C{repr} it reads
+    as an equal value of the same type.
+    """
+    try:
+        value = ast.literal_eval(code)
+        again = ast.literal_eval(repr(value))
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return False
+    return type(again) is type(value) and again == value
+
+
+def _flatten(builder, kind, exprs):
+    """
+    Make an And or Or node of already flattened expressions, splicing in
+    those that are nodes of the same kind, and return the expression itself
+    if there's only one.
+
+    Empty sequences are dropped from sequences unless they come last, where
+    they give the sequence its value, None. Choices containing a cut aren't
+    spliced into choices, since the cut commits only to its own choice.
+    """
+    flat = []
+    for i, expr in enumerate(exprs):
+        if expr[0] == kind == "And":
+            if expr[1] or i == len(exprs) - 1:
+                flat.extend(expr[1] or [expr])
+        elif expr[0] == kind == "Or" and not _contains(expr, ("Cut",)):
+            flat.extend(expr[1])
+        else:
+            flat.append(expr)
+    if len(flat) == 1:
+        return flat[0]
+    if kind == "And":
+        return builder.sequence(flat)
+    return builder._or(flat)
+
+
+def _infallible(expr):
+    """
+    Whether a grammar tree always matches: repetitions and optional
+    expressions without cuts, constants, and sequences and bindings of
+    them.
+    """
+    kind = expr[0]
+    if kind in ("Many", "Optional"):
+        return not _contains(expr[1], ("Cut",))
+    if kind == "Constant":
+        return True
+    if kind == "And":
+        return all(map(_infallible, expr[1]))
+    if kind == "Bind":
+        return _infallible(expr[2])
+    return False
+
+
+def _inline(optimizer, name):
+    """
+    Return the optimized body of the rule C{name} to use in place of an
+    application of it.
+    """
+    opt = optimizer.__class__([optimizer.inlined[name]])
+    opt.builder = optimizer.builder
+    opt.inlined = optimizer.inlined
+    return opt.apply("opt")[0]
+
+
+foldConstantsGrammar = """
+opt ::= ( ["Python" :code ?(isConstant(code))] => self.builder.constant(literal_eval(code))
+        | ["Action" :code ?(isConstant(code))] => self.builder.constant(literal_eval(code))
+        | ["Apply" :ruleName :codeName [<opt>*:exprs]] => self.builder.apply(ruleName, codeName, *exprs)
+        | <super>)
+"""
+
+FoldConstants = NullOptimizer.makeGrammar(
+    foldConstantsGrammar,
+    {"isConstant": _isConstant, "literal_eval": ast.literal_eval},
+    name="FoldConstants")
+
+
+inlineRulesGrammar = """
+opt ::= ( ["Apply" :ruleName :codeName [<anything>*:exprs]]
+            ?(not exprs and ruleName in self.inlined) => inline(self, ruleName)
+        | <super>)
+"""
+
+InlineRules = NullOptimizer.makeGrammar(inlineRulesGrammar,
+                                        {"inline": _inline},
+                                        name="InlineRules")
+
+
+flattenGrammar = """
+opt ::= ( ["And" [<opt>*:exprs]] => flatten(self.builder, "And", exprs)
+        | ["Or" [<opt>*:exprs]] => flatten(self.builder, "Or", exprs)
+        | <super>)
+"""
+
+Flatten = NullOptimizer.makeGrammar(flattenGrammar, {"flatten": _flatten},
+                                    name="Flatten")
+
+
+dropOptionalsGrammar = """
+opt ::= ( ["Optional" <opt>:expr ?(infallible(expr))] => expr
+        | <super>)
+"""
+
+DropOptionals = NullOptimizer.makeGrammar(dropOptionalsGrammar,
+                                          {"infallible": _infallible},
+                                          name="DropOptionals")
+
+
+
+class GrammarOptimizer(object):
+    """
+    Rewrites a grammar's tree between parsing it and writing its code, in a
+    series of passes. Each pass is a tree grammar based on L{NullOptimizer}
+    that rewrites the nodes it can improve and copies the rest, and each
+    can be turned off by a subclass.
+    """
+
+    # Whether to turn Python expressions and actions that are literals, like
+    # '=> "\\n"', into constants written into the code rather than eval'd.
+    foldConstants = True
+
+    # Whether to replace applications of small rules, without arguments, by
+    # their bodies. Off by default: the inlined copies don't see rules
+    # redefined by subclasses, aren't memoized, and give no spans.
+    inlineRules = False
+
+    # The most nodes, other than sequences and choices, a rule inlined can
+    # have.
+    inlineLimit = 4
+
+    # Whether to splice sequences into sequences and choices into choices,
+    # and replace those of one expression with it.
+    flatten = True
+
+    # Whether to drop the '?' from expressions that always match.
+    dropOptionals = True
+
+    def optimize(self, tree):
+        """
+        Return an optimized copy of a grammar's tree.
+
+        @param tree: A C{["Grammar", name, rules]} tree.
+        """
+        if self.foldConstants:
+            tree = self.runPass(FoldConstants, tree)
+        if self.inlineRules:
+            tree = self.runPass(InlineRules, tree,
+                                inlined=self.inlinable(tree[2]))
+        if self.flatten:
+            tree = self.runPass(Flatten, tree)
+        if self.dropOptionals:
+            tree = self.runPass(DropOptionals, tree)
+        return tree
+
+
+    def runPass(self, passClass, tree, **attrs):
+        """
+        Return a grammar's tree as rewritten by one pass.
+
+        @param passClass: A subclass of L{NullOptimizer}.
+        @param attrs: Attributes to set on the pass.
+        """
+        opt = passClass([tree])
+        opt.builder = TreeBuilder(tree[1], opt)
+        for name, value in attrs.items():
+            setattr(opt, name, value)
+        return opt.apply("grammar")[0]
+
+
+    def inlinable(self, rules):
+        """
+        Return a dict of the bodies of the rules that can be inlined, by
+        name: those of no more than C{inlineLimit} nodes that don't apply
+        themselves, directly or not, and that have no bindings, cuts,
+        actions, predicates, Python expressions or super applications.
+
+        @param rules: The grammar's rules, as a list of C{["Rule", name,
+        expr]} trees.
+        """
+        bodies = dict([(rule[1], rule[2]) for rule in rules])
+        applied = dict([(name, self.applied(body) & set(bodies))
+                        for name, body in bodies.items()])
+        inlined = {}
+        for name, body in bodies.items():
+            if (self.size(body) > self.inlineLimit
+                or "super" in self.applied(body)
+                or _contains(body, ("Bind", "Cut", "Action", "Python",
+                                    "Predicate"))):
+                continue
+            reached = set()
+            pending = list(applied[name])
+            while pending:
+                other = pending.pop()
+                if other not in reached:
+                    reached.add(other)
+                    pending.extend(applied[other])
+            if name not in reached:
+                inlined[name] = body
+        return inlined
+
+
+    def applied(self, expr):
+        """
+        Return the names of the rules a grammar tree applies.
+        """
+        names = set()
+        if expr[0] == "Apply":
+            names.add(expr[1])
+        for child in subtrees(expr):
+            names |= self.applied(child)
+        return names
+
+
+    def size(self, expr):
+        """
+        Return the number of nodes in a grammar tree, other than sequences
+        and choices.
+        """
+        count = int(expr[0] not in ("And", "Or"))
+        return count + sum([self.size(child) for child in subtrees(expr)])
+
@@ -2,7 +2,13 @@
 """
 Code needed to run a grammar after it has been compiled.
 """
+import array
+import bisect
+import codecs
+import mmap
 import operator
+import re
+import sys
 class ParseError(Exception):
     """
     ?Redo from start
@@ -14,7 +20,10 @@ class ParseError(Exception):
 
     @property
     def error(self):
-        return self.args[1]
+        error = self.args[1]
+        if error.__class__ is ExpectedSet:
+            return error.items()
+        return error
 
     def __init__(self, *a):
         Exception.__init__(self, *a)
@@ -27,6 +36,7 @@ class ParseError(Exception):
     def __eq__(self, other):
         if other.__class__ == self.__class__:
             return (self.position, self.error) == (other.position, other.error)
+        return NotImplemented
 
 
     def formatReason(self):
@@ -48,33 +58,776 @@ class ParseError(Exception):
 
             return "expected one of %s, or %s" % (', '.join(bits[:-1]), bits[-1])
 
+    def lineColumn(self, input):
+        """
+        Return the line number, counting from 1, and the column, counting
+        from 0, of this error's position.
+
+        @param input: The string that was parsed, or a L{LineIndex} of it.
+        """
+        return LineIndex.of(input).lineColumn(self.position)
+
     def formatError(self, input):
         """
         Return a pretty string containing error info about string parsing failure.
+
+        @param input: The string that was parsed, or a L{LineIndex} of it.
         """
-        lines = input.split('\n')
-        counter = 0
-        lineNo = 1
-        columnNo = 0
-        for line in lines:
-            newCounter = counter + len(line)
-            if newCounter > self.position:
-                columnNo = self.position - counter
-                break
-            else:
-                counter += len(line) + 1
-                lineNo += 1
+        index = LineIndex.of(input)
+        lineNo, columnNo = index.lineColumn(self.position)
+        line = index.line(lineNo)
         reason = self.formatReason()
         return ('\n' + line + '\n' + (' ' * columnNo + '^') +
                 "\nParse error at line %s, column %s: %s\n" % (lineNo,
                                                                columnNo,
                                                                reason))
 
+
+class LineIndex(object):
+    """
+    The positions where the lines of a string start, for finding the line
+    and column of a position by binary search rather than by scanning the
+    string. The positions are found the first time they're needed.
+
+    The lines of a list of characters, or of bytes in a buffer, can be found
+    too, as the inputs' L{text} methods give them.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.starts = None
+
+    def of(cls, text):
+        """
+        Return an index of the given string. Nothing is kept of it
+        afterwards, so that a buffer such as a memory map can be released;
+        to find several positions in the same string, make one index and
+        pass it instead.
+
+        @param text: A string, or a L{LineIndex}, which is returned as is.
+        """
+        if isinstance(text, LineIndex):
+            return text
+        return cls(text)
+    of = classmethod(of)
+
+    def _findStarts(self):
+        starts = [0]
+        if isinstance(self.text, str):
+            find = self.text.find
+            i = find('\n')
+            while i != -1:
+                starts.append(i + 1)
+                i = find('\n', i + 1)
+        elif isinstance(self.text, list):
+            starts.extend([i + 1 for i, c in enumerate(self.text)
+                           if c == '\n'])
+        else:
+            starts.extend([m.end() for m in re.finditer(b'\n', self.text)])
+        self.starts = starts
+        return starts
+
+    def lineColumn(self, position):
+        """
+        Return the line number, counting from 1, and the column, counting
+        from 0, of a position in the string. A newline belongs to the line
+        it ends.
+        """
+        starts = self.starts or self._findStarts()
+        lineNo = bisect.bisect_right(starts, position)
+        return lineNo, position - starts[lineNo - 1]
+
+    def line(self, lineNo):
+        """
+        Return the text of a line, without its newline.
+
+        @param lineNo: A line number, counting from 1.
+        """
+        starts = self.starts or self._findStarts()
+        if lineNo < len(starts):
+            return self.text[starts[lineNo - 1]:starts[lineNo] - 1]
+        return self.text[starts[lineNo - 1]:]
+
+
+class WhitespaceIndex(object):
+    """
+    The position of the next item that isn't whitespace, from every position
+    of a string or bytes, found once for the whole input so that skipping
+    whitespace is a single binary search, however often it's backtracked
+    over.
+
+    Only the runs of whitespace are stored: sorted arrays of where each span
+    of positions that skip to the same place starts and stops, and that
+    place. Positions outside them aren't whitespace, and skip to themselves.
+
+    Whitespace is a run of characters matching C{spaces} and, if it isn't
+    C{None}, comments matching C{comment}, tried in that order at each
+    position as a PEG repetition would. Subclasses set them to describe the
+    whitespace of their grammars.
+    """
+
+    spaces = r'\s'
+    comment = None
+
+    def __init__(self, data):
+        """
+        @param data: A string, or bytes, read as Latin-1. Bytes are scanned
+        in place, with the patterns compiled for bytes by L{_bytePattern}.
+        """
+        self.starts = array.array('q')
+        self.stops = array.array('q')
+        self.targets = array.array('q')
+        if isinstance(data, str):
+            compile = re.compile
+        else:
+            compile = _bytePattern
+        if self.comment is None:
+            run = compile('(?:%s)+' % (self.spaces,))
+        else:
+            run = compile('(?:%s|%s)+' % (self.spaces, self.comment))
+            self.space = compile(self.spaces).match
+            self.commentAt = compile(self.comment).match
+        for m in run.finditer(data):
+            self._addRun(data, m.start(), m.end(), run)
+
+    def _addRun(self, data, start, end, run):
+        """
+        Record where the positions of a run of whitespace skip to.
+
+        @param data: The input.
+        @param start: Where the run starts.
+        @param end: Where it ends.
+        @param run: The compiled pattern for a run of whitespace.
+        """
+        if self.comment is None:
+            self._addSpan(start, end, end)
+            return
+        space = self.space
+        comment = self.commentAt
+        # Text inside a comment is only skipped when it's read from the
+        # comment's start, so work back from the end of the run.
+        ends = list(range(start, end + 1))
+        for p in range(end - 1, start - 1, -1):
+            if space(data, p):
+                ends[p - start] = ends[p + 1 - start]
+                continue
+            c = comment(data, p)
+            if c is not None and c.end() > p:
+                if c.end() <= end:
+                    ends[p - start] = ends[c.end() - start]
+                else:
+                    ends[p - start] = run.match(data, p).end()
+        p = start
+        while p < end:
+            target = ends[p - start]
+            stop = p + 1
+            while stop < end and ends[stop - start] == target:
+                stop += 1
+            if target != p:
+                self._addSpan(p, stop, target)
+            p = stop
+
+    def _addSpan(self, start, stop, target):
+        """
+        Record that the positions from C{start} up to C{stop} skip to
+        C{target}.
+        """
+        self.starts.append(start)
+        self.stops.append(stop)
+        self.targets.append(target)
+
+    def skip(self, position):
+        """
+        Return the position of the first item at or after C{position} that
+        isn't whitespace.
+        """
+        n = bisect.bisect_right(self.starts, position) - 1
+        if n >= 0 and position < self.stops[n]:
+            return self.targets[n]
+        return position
+
+
+def indexedSkip(indexClass, rule):
+    """
+    Return a rule method that skips what a grammar's own whitespace rule,
+    such as an overridden C{spaces}, would, with one lookup in an index of
+    the given kind. Inputs that can't be indexed are matched with the rule
+    itself.
+
+    @param indexClass: A L{WhitespaceIndex} subclass matching what C{rule}
+    matches.
+    @param rule: The rule method to fall back on.
+    """
+    def skip(self):
+        i = self.input
+        if i.indexFor is None:
+            return rule(self)
+        return True, i.skipWhitespace(indexClass)
+    return skip
+
+
+def _isLetterOrDigit(c):
+    return c.isalnum() or c == '_'
+
+
+class _ClassCodes(dict):
+    """
+    A translation table for C{str.translate} from each character to the
+    character whose ordinal is its mask of classes, filled in as characters
+    are met.
+    """
+
+    def __init__(self, index):
+        dict.__init__(self)
+        self.index = index
+
+    def __missing__(self, ordinal):
+        code = self[ordinal] = chr(self.index.mask(chr(ordinal)))
+        return code
+
+
+class CharacterClassIndex(object):
+    """
+    The classes of every character of a string or bytes, as one byte per
+    position with a bit set for each class the character belongs to, made
+    with a C{translate} of each C{chunkSize} characters of the input, so
+    bytes input read in place (as from an mmap) isn't copied whole.
+
+    The classes are the (name, predicate) pairs of C{classes}, at most
+    eight. Subclasses can add their own, for L{OMetaBase.charClass}.
+    """
+
+    classes = [("letter", str.isalpha),
+               ("digit", str.isdigit),
+               ("letterOrDigit", _isLetterOrDigit)]
+
+    # How many characters of the input to translate at a time.
+    chunkSize = 65536
+
+    def __init__(self, data):
+        """
+        @param data: A string, or bytes, read as Latin-1.
+        """
+        if len(self.classes) > 8:
+            raise ValueError("At most eight character classes can be indexed")
+        if isinstance(data, str):
+            table = _ClassCodes(self)
+            translate = lambda chunk: chunk.translate(table).encode('latin-1')
+        else:
+            table = bytes(bytearray([self.mask(chr(b)) for b in range(256)]))
+            data = memoryview(data)
+            translate = lambda chunk: chunk.tobytes().translate(table)
+        self.codes = codes = bytearray(len(data))
+        for start in range(0, len(data), self.chunkSize):
+            end = start + self.chunkSize
+            codes[start:end] = translate(data[start:end])
+
+    def mask(cls, c):
+        """
+        Return the mask of the classes a character belongs to.
+        """
+        mask = 0
+        for i, (name, predicate) in enumerate(cls.classes):
+            if predicate(c):
+                mask |= 1 << i
+        return mask
+    mask = classmethod(mask)
+
+    def bit(cls, name):
+        """
+        Return the bit set in the masks of characters in the named class.
+        """
+        for i, (n, predicate) in enumerate(cls.classes):
+            if n == name:
+                return 1 << i
+        raise ValueError("No character class named %r" % (name,))
+    bit = classmethod(bit)
+
+    def test(cls, name, c):
+        """
+        Return whether a character is in the named class, without an index.
+        """
+        return cls.classes[cls.bit(name).bit_length() - 1][1](c)
+    test = classmethod(test)
+
+
+class CharRanges(object):
+    """
+    The members of a character set too large to list, as sorted ranges
+    searched by bisection.
+    """
+
+    def __init__(self, ranges):
+        """
+        @param ranges: A sorted list of non-overlapping (first, last) pairs
+        of characters.
+        """
+        self.firsts = [lo for lo, hi in ranges]
+        self.lasts = [hi for lo, hi in ranges]
+
+    def __contains__(self, c):
+        try:
+            i = bisect.bisect_right(self.firsts, c) - 1
+        except TypeError:
+            return False
+        return i >= 0 and c <= self.lasts[i]
+
+
+# Builtin rules matching a single character, which a L{Regular} can match
+# in their place.
+regularRules = ("anything", "letter", "digit", "letterOrDigit")
+
+try:
+    re.compile("(?>a|b)*+")
+    # Atomic groups and possessive repetitions, which match as PEG
+    # choices and repetitions do, first appeared in Python 3.11.
+    atomicRegexes = True
+except re.error:
+    atomicRegexes = False
+
+
+def _rangeSource(ranges):
+    """
+    Write a list of (first, last) code point ranges as the inside of a
+    regular expression character class.
+    """
+    def char(n):
+        if n < 0x100:
+            return "\\x%02x" % (n,)
+        if n < 0x10000:
+            return "\\u%04x" % (n,)
+        return "\\U%08x" % (n,)
+    return "".join([lo == hi and char(lo) or "%s-%s" % (char(lo), char(hi))
+                    for lo, hi in ranges])
+
+
+def _codeRanges(codes):
+    """
+    Collapse a sorted list of code points into (first, last) ranges.
+    """
+    ranges = []
+    for n in codes:
+        if ranges and ranges[-1][1] == n - 1:
+            ranges[-1][1] = n
+        else:
+            ranges.append([n, n])
+    return ranges
+
+
+_unicodeClasses = None
+
+def _unicodeClassSources():
+    """
+    Return regular expression classes matching the characters that the
+    builtin letter and digit rules match, found the first time they're
+    needed. Those rules use C{isalpha} and C{isdigit}, which differ from
+    C{re}'s C{\\w} and C{\\d} on some numeric characters.
+    """
+    global _unicodeClasses
+    if _unicodeClasses is None:
+        everything = "".join(map(chr, range(sys.maxunicode + 1)))
+        nonLetters = [c for c in re.findall(r"[^\W\d_]", everything)
+                      if not c.isalpha()]
+        digits = [ord(c) for c in nonLetters if c.isdigit()]
+        _unicodeClasses = {
+            "letter": "[^\\W\\d_%s]" % (_rangeSource(
+                    _codeRanges(sorted(map(ord, nonLetters)))),),
+            "digit": "[\\d%s]" % (_rangeSource(_codeRanges(digits)),),
+            "letterOrDigit": "\\w"}
+    return _unicodeClasses
+
+
+def _byteClassSource(predicate):
+    """
+    Return a regular expression class matching the bytes whose Latin-1
+    characters satisfy C{predicate}.
+    """
+    return "[%s]" % (_rangeSource(_codeRanges(
+                [n for n in range(256) if predicate(chr(n))])),)
+
+
+def _bytePattern(pattern):
+    """
+    Compile a regular expression written for strings to match bytes as it
+    would match their Latin-1 characters. The class escapes C{\\s}, C{\\w},
+    C{\\d} and their negations, which only match ASCII in a bytes pattern,
+    are replaced by the bytes whose characters they match.
+    """
+    out = []
+    inClass = False
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '\\' and i + 1 < len(pattern):
+            escape = pattern[i:i + 2]
+            if escape[1] in 'sSwWdD':
+                ranges = _rangeSource(_codeRanges(
+                        [n for n in range(256) if re.match(escape, chr(n))]))
+                if not inClass:
+                    ranges = '[%s]' % (ranges,)
+                out.append(ranges)
+            else:
+                out.append(escape)
+            i += 2
+            continue
+        out.append(c)
+        i += 1
+        if c == '[' and not inClass:
+            inClass = True
+            # A ']' first in a class, after any '^', is one of its members.
+            for special in '^]':
+                if pattern[i:i + 1] == special:
+                    out.append(special)
+                    i += 1
+        elif c == ']' and inClass:
+            inClass = False
+    return re.compile(''.join(out).encode('latin-1'))
+
+
+_byteClasses = {
+    "letter": _byteClassSource(str.isalpha),
+    "digit": _byteClassSource(str.isdigit),
+    "letterOrDigit": _byteClassSource(_isLetterOrDigit)}
+
+
+class Regular(object):
+    """
+    A regular expression matching a regular part of a grammar: one made only
+    of string literals, character sets, the builtin rules in
+    L{regularRules}, and sequences, choices, repetitions, optional patterns
+    and lookaheads of them. Choices and repetitions become atomic groups and
+    possessive repetitions, which never backtrack into what they matched,
+    so the expression matches exactly what the PEG would.
+
+    It's compiled for string input and for bytes input when first needed
+    for each.
+    """
+
+    def __init__(self, expr):
+        """
+        @param expr: A grammar tree, as built by L{pymeta.builder.TreeBuilder}.
+        """
+        self.expr = expr
+        self.rules = set()
+        self._findRules(expr)
+        self.patterns = {}
+
+    def _findRules(self, expr):
+        """
+        Add the names of the rules applied in a grammar tree to C{rules}.
+        """
+        if expr[0] == "Apply":
+            self.rules.add(expr[1])
+        elif expr[0] in ("And", "Or"):
+            for e in expr[1]:
+                self._findRules(e)
+        elif expr[0] in ("Many", "Many1", "Optional", "Not", "Lookahead"):
+            self._findRules(expr[1])
+
+    def compiled(self, forBytes):
+        """
+        Return the compiled expression, for matching bytes if C{forBytes}.
+        """
+        pattern = self.patterns.get(forBytes)
+        if pattern is None:
+            source = self.source(self.expr, forBytes)
+            if forBytes:
+                source = source.encode('latin-1')
+            pattern = self.patterns[forBytes] = re.compile(source, re.DOTALL)
+        return pattern
+
+    def source(self, expr, forBytes):
+        """
+        Return the source of a regular expression matching a grammar tree.
+        """
+        kind = expr[0]
+        if kind == "Exactly":
+            if forBytes and [c for c in expr[1] if ord(c) > 0xff]:
+                return "(?!)"
+            return "".join([_rangeSource([(ord(c), ord(c))])
+                            for c in expr[1]])
+        if kind == "CharSet":
+            ranges = [(ord(lo), ord(hi)) for lo, hi in expr[1]]
+            if forBytes:
+                ranges = [(lo, min(hi, 0xff)) for lo, hi in ranges
+                          if lo <= 0xff]
+            if expr[2]:
+                if not ranges:
+                    return "."
+                return "[^%s]" % (_rangeSource(ranges),)
+            if not ranges:
+                return "(?!)"
+            return "[%s]" % (_rangeSource(ranges),)
+        if kind == "Apply":
+            if expr[1] == "anything":
+                return "."
+            if forBytes:
+                return _byteClasses[expr[1]]
+            return _unicodeClassSources()[expr[1]]
+        if kind == "And":
+            return "".join([self.source(e, forBytes) for e in expr[1]])
+        if kind == "Or":
+            return "(?>%s)" % ("|".join([self.source(e, forBytes)
+                                         for e in expr[1]]),)
+        inner = self.source(expr[1], forBytes)
+        return {"Many": "(?:%s)*+",
+                "Many1": "(?:%s)++",
+                "Optional": "(?:%s)?+",
+                "Not": "(?!%s)",
+                "Lookahead": "(?=%s)"}[kind] % (inner,)
+
+
+
+class Dispatch(object):
+    """
+    Which alternatives of a choice can match, by the next item of input, for
+    a choice whose alternatives each start with a string literal. Those whose
+    literal can't match the item would fail where they start, so they need
+    not be tried; the rest are tried in their order in the choice, as an
+    earlier one may fail after its literal and leave a later one to match.
+    """
+
+    def __init__(self, literals):
+        """
+        @param literals: The literal each alternative starts with, in order.
+        """
+        self.literals = literals
+        table = {}
+        for n, literal in enumerate(literals):
+            # A literal of several characters matches a run of characters,
+            # starting with its first, on input read from a string or bytes,
+            # and an item equal to it on other input. Keying it on both lets
+            # one table serve either.
+            for key in set([literal[0], literal]):
+                table.setdefault(key, []).append(n)
+        self.table = dict([(key, tuple(ns)) for key, ns in table.items()])
+        self.valid = {}
+
+    # Whether to look at the item after any whitespace.
+    spaced = False
+
+    def validFor(self, cls, base):
+        """
+        Whether the table holds for a grammar class. A table of literals
+        holds for every one.
+        """
+        self.valid[cls] = True
+        return True
+
+    def candidates(self, item):
+        """
+        Return the indexes, in order, of the alternatives that can match
+        input starting with C{item}, or None if it's not one that can be
+        looked up, and all of them must be tried.
+        """
+        try:
+            return self.table.get(item, ())
+        except TypeError:
+            return None
+
+
+
+class FirstSet(object):
+    """
+    The items of input a part of a grammar can start by matching: those
+    equal to one of C{items}, characters (or other strings) in one of
+    C{ranges}, and those in one of the character classes of the builtin
+    rules named in C{classes}. A negated set holds every item except those
+    in C{items}.
+    """
+
+    classTests = {
+        "letter": lambda c: c.isalpha(),
+        "digit": lambda c: c.isdigit(),
+        "letterOrDigit": lambda c: c.isalnum() or c == '_',
+        }
+
+    def __init__(self, items=(), ranges=(), classes=(), negated=False):
+        self.items = frozenset(items)
+        self.ranges = tuple(ranges)
+        self.classes = tuple(classes)
+        self.negated = negated
+
+    def __contains__(self, item):
+        try:
+            found = item in self.items
+        except TypeError:
+            return self.negated
+        if self.negated:
+            return not found
+        if found:
+            return True
+        if isinstance(item, str):
+            for lo, hi in self.ranges:
+                if lo <= item <= hi:
+                    return True
+            for name in self.classes:
+                if self.classTests[name](item):
+                    return True
+        return False
+
+    def __repr__(self):
+        args = [sorted(self.items), list(self.ranges), list(self.classes)]
+        if self.negated:
+            args.append(True)
+        return "FirstSet(%s)" % (", ".join(map(repr, args)),)
+
+
+
+class Prediction(Dispatch):
+    """
+    Which alternatives of a choice can match, by the next item of input, as
+    found from the L{FirstSet} of each: the alternatives that can match
+    without consuming input, and those whose first set has the item. For a
+    choice whose alternatives start by skipping whitespace, the item is the
+    one after it.
+
+    The first sets were worked out from the grammar's rules, so they hold
+    only for grammars that don't redefine any of the rules they depend on.
+    """
+
+    # How many items to remember the candidates of.
+    cacheSize = 1024
+
+    def __init__(self, firsts, spaced, rules, builtins, namespace, grammar):
+        """
+        @param firsts: The L{FirstSet} of each alternative, or None for one
+        that must always be tried.
+        @param spaced: Whether to look at the item after any whitespace.
+        @param rules: The names of the grammar's rules the first sets
+        depend on.
+        @param builtins: The names of the builtin rules they depend on.
+        @param namespace: The globals of the module the grammar was defined
+        in.
+        @param grammar: The name of the grammar class in C{namespace} the
+        first sets were worked out for, defined after the prediction.
+        """
+        self.firsts = firsts
+        self.spaced = spaced
+        self.rules = rules
+        self.builtins = builtins
+        self.namespace = namespace
+        self.grammar = grammar
+        self.table = {}
+        self.valid = {}
+
+    def candidates(self, item):
+        try:
+            return self.table[item]
+        except KeyError:
+            pass
+        except TypeError:
+            return None
+        found = tuple([n for n, first in enumerate(self.firsts)
+                       if first is None or item in first])
+        if len(self.table) < self.cacheSize:
+            self.table[item] = found
+        return found
+
+    def validFor(self, cls, base):
+        """
+        Whether the first sets hold for a grammar class: whether its rules
+        are those of the grammar they were worked out for, and its builtin
+        rules those of C{base}. (The builtin 'spaces' rule need only be the
+        grammar's eatWhitespace.)
+        """
+        valid = self.valid.get(cls)
+        if valid is None:
+            valid = True
+            for name in self.rules:
+                rule = getattr(cls, "rule_" + name, None)
+                built = self.namespace[self.grammar]
+                if rule is not getattr(built, "rule_" + name):
+                    valid = False
+            for name in self.builtins:
+                rule = getattr(cls, "rule_" + name, None)
+                if name == "spaces":
+                    expected = getattr(cls, "eatWhitespace")
+                else:
+                    expected = getattr(base, "rule_" + name)
+                if rule is not expected:
+                    valid = False
+            self.valid[cls] = valid
+        return valid
+
+
 class EOFError(ParseError):
     def __init__(self, position):
         ParseError.__init__(self, position, eof())
 
 
+class Committed(ParseError):
+    """
+    Raised when matching fails after a cut. The choice the cut committed to
+    fails as a whole, rather than trying its remaining options.
+    """
+
+
+class ReparsedError(ParseError):
+    """
+    The error of a rule that a L{FastOMetaBase} grammar applied and that
+    matched: the L{ParseError} its C{detailedClass} gives for the same
+    application, found by parsing again only when the error is first read.
+    """
+
+    def __init__(self, grammar, position, ruleName, args):
+        """
+        @param grammar: The grammar that applied the rule.
+        @param position: The position of the input the rule started from.
+        @param ruleName: The rule's name.
+        @param args: The arguments it was applied with.
+        """
+        ParseError.__init__(self)
+        self.reparse = (grammar, position, ruleName, args)
+        self.found = None
+
+    @property
+    def args(self):
+        if self.found is None:
+            grammar, position, ruleName, args = self.reparse
+            self.found = grammar.reparse(position, ruleName, *args)[1]
+            self.reparse = None
+        return self.found.args
+
+    def __eq__(self, other):
+        if isinstance(other, ParseError):
+            return ParseError(*self.args) == ParseError(*other.args)
+        return NotImplemented
+
+    def __str__(self):
+        return str(self.args)
+
+    def __repr__(self):
+        return "%s%r" % (self.__class__.__name__, self.args)
+
+
+class BacktrackError(Exception):
+    """
+    Raised when a grammar with a L{OMetaBase.memoWindow} backtracks to a
+    position whose memo records have already been evicted. It is
+    deliberately not a L{ParseError}: the input may well match, just not
+    within the window, so no alternative should be tried in its place.
+    """
+
+    @property
+    def position(self):
+        return self.args[0]
+
+
+class NeedMoreInput(Exception):
+    """
+    Raised when parsing reaches the end of the data buffered so far by a
+    L{StreamInput} that hasn't been closed. It is deliberately not a
+    L{ParseError}, so no alternative or repetition treats it as a failure to
+    match: the whole attempt is abandoned and retried when more data
+    arrives.
+    """
+
+    @property
+    def position(self):
+        return self.args[0]
+
+
 def expected(typ, val=None):
     """
     Return an indication of expected input and the position where it was
@@ -93,25 +846,59 @@ def eof():
 def joinErrors(errors):
     """
     Return the error from the branch that matched the most of the input.
+    When several tie for it, what each expected is kept, unmerged, in an
+    L{ExpectedSet}.
     """
-    def get_key(item):
-        val = item[0]
-        if val == None:
-            val = -1000000000
-        return val
-    errors.sort(reverse=True, key=get_key)
-    results = set()
-    pos = errors[0][0]
+    top = None
+    parts = None
     for err in errors:
-        if pos == err[0]:
-            e = err[1]
-            if e is not None:
-                for item in e:
-                        results.add(item)
-        else:
-            break
+        if err is None:
+            # Inputs that don't track per-item errors report none at all.
+            continue
+        pos = err[0]
+        if top is None or (pos is not None and (top[0] is None or
+                                                pos > top[0])):
+            top = err
+            parts = None
+        elif pos == top[0]:
+            if parts is None:
+                parts = [top[1]]
+            parts.append(err[1])
+    if top is None:
+        return [None, []]
+    if parts is None:
+        return [top[0], top[1] or []]
+    return [top[0], ExpectedSet(parts)]
+
+
+class ExpectedSet(object):
+    """
+    What several failed matches at the same position expected, as the
+    lists (or other L{ExpectedSet}s) each reported. They're only merged
+    into one list of distinct items when L{items} is called, which
+    L{ParseError.error} does.
+    """
+    __slots__ = ['parts']
+
+    def __init__(self, parts):
+        self.parts = parts
+
+    def items(self):
+        """
+        Return a list of the distinct items expected.
+        """
+        results = set()
+        pending = list(self.parts)
+        while pending:
+            part = pending.pop()
+            if part.__class__ is ExpectedSet:
+                pending.extend(part.parts)
+            elif part is not None:
+                results.update(part)
+        return list(results)
 
-    return [pos, list(results)]
+    def __repr__(self):
+        return repr(self.items())
 
 
 class character(str):
@@ -141,93 +928,318 @@ try:
 except NameError:
     _has_unicode = False
 
-class InputStream(object):
+# Returned by memo stores in place of a record for a position that a sliding
+# window has evicted.
+evicted = object()
+
+# Returned as the value of a failed match by L{SentinelOMetaBase} and the code
+# generated for it, in place of raising ParseError. The error returned with
+# it is what the ParseError would have carried.
+failed = object()
+
+# Returned in place of failed when the failure came after a cut, in place of
+# raising Committed.
+failedCommitted = object()
+
+class ArrayMemo(object):
     """
-    The basic input mechanism used by OMeta grammars.
+    Memo store keeping one list per rule, indexed by input position.
+
+    Each rule's list is allocated the first time the rule is memoized, and
+    holds a slot for every position in the input (plus one for the end).
     """
 
-    def fromIterable(cls, iterable):
+    def __init__(self, size):
         """
-        @param iterable: Any iterable Python object.
+        @param size: The length of the input being memoized.
         """
-        if isinstance(iterable, str):
-            data = [character(c) for c in iterable]
-        elif _has_unicode and isinstance(iterable, unicode):
-            data = [unicodeCharacter(c) for c in iterable]
-        else:
-            data = list(iterable)
-        return cls(data, 0)
-    fromIterable = classmethod(fromIterable)
-
-    def __init__(self, data, position):
-        self.data = data
-        self.position = position
-        self.memo = {}
-        self.tl = None
-
-    def head(self):
-        if self.position >= len(self.data):
-            raise EOFError(self.position)
-        return self.data[self.position], [self.position, None]
+        self.size = size + 1
+        self.offset = 0
+        self.cleared = 0
+        self.early = {}
+        self.tables = {}
+        self.window = None
+        self.limit = sys.maxsize
+        self.horizon = 0
 
-    def nullError(self):
-        return [self.position, None]
 
-    def tail(self):
-        if self.tl is None:
-            self.tl = InputStream(self.data, self.position+1)
-        return self.tl
+    def setWindow(self, window):
+        """
+        Only keep records for positions up to C{window} behind the farthest
+        one stored, so the lists stay a size proportional to the window
+        rather than the input. Looking up an evicted position returns
+        L{evicted}.
+        """
+        self.window = window
+        self.limit = window
+        self.size = min(self.size, window * 2 + 1)
 
-    def prev(self):
-        return InputStream(self.data, self.position-1)
 
-    def getMemo(self, name):
+    def get(self, name, position):
         """
-        Returns the memo record for the named rule.
-        @param name: A rule name.
+        Returns the memo record for the named rule at the given position, or
+        C{None}.
         """
-        return self.memo.get(name, None)
+        if position < self.cleared:
+            rec = self.early.get((name, position))
+            if rec is None and position < self.horizon:
+                return evicted
+            return rec
+        table = self.tables.get(name)
+        if table is None:
+            return None
+        try:
+            return table[position - self.offset]
+        except IndexError:
+            return None
 
 
-    def setMemo(self, name, rec):
+    def set(self, name, position, rec):
         """
-        Store a memo record for the given value and position for the given
-        rule.
-        @param name: A rule name.
-        @param rec: A memo record.
+        Store a memo record for the named rule at the given position. Lists
+        grow as needed for inputs that grow after the store is created.
+        Records for positions that have been discarded, stored by rule
+        applications that started before the discard, are kept aside until
+        the next one.
         """
-        self.memo[name] = rec
+        if position < self.cleared:
+            self.early[name, position] = rec
+            return rec
+        if position >= self.limit:
+            self.evict(position - self.window)
+            self.limit = position + self.window
+        table = self.tables.get(name)
+        if table is None:
+            table = self.tables[name] = [None] * self.size
+        index = position - self.offset
+        try:
+            table[index] = rec
+        except IndexError:
+            table.extend([None] * (index + 1 + len(table)))
+            table[index] = rec
         return rec
 
-class ArgInput(object):
-    def __init__(self, arg, parent):
-        self.arg = arg
-        self.parent = parent
-        self.memo = {}
-        self.err = parent.nullError()
-
-    def head(self):
-        try:
-            x = self.arg
-        except:
-            import pdb; pdb. set_trace()
-        return self.arg, self.err
 
-    def tail(self):
-        return self.parent
+    def discard(self, position):
+        """
+        Forget all memo records for positions before the given one.
 
+        Records are cleared in place, and the lists only shrink once at least
+        half of them is cleared, so discarding a little at a time costs time
+        proportional to the amount discarded.
+        """
+        if position <= self.cleared:
+            return
+        drop = position - self.offset
+        if drop * 2 >= self.size:
+            for table in self.tables.values():
+                del table[:drop]
+            self.offset = position
+            self.size = max(self.size - drop, 1)
+        else:
+            start = self.cleared - self.offset
+            for table in self.tables.values():
+                end = min(drop, len(table))
+                if start < end:
+                    table[start:end] = [None] * (end - start)
+        self.cleared = position
+        for key in [k for k in self.early if k[1] < position]:
+            del self.early[key]
 
 
+    def evict(self, position):
+        """
+        Forget all memo records for positions before the given one, and
+        answer lookups for them with L{evicted} from now on.
+        """
+        self.discard(position)
+        self.horizon = position
+
+
+
+class DictMemo(object):
+    """
+    Memo store keeping a dict of rule names to memo records for each input
+    position that has any, like inputs did before memo stores existed.
+    """
+
+    def __init__(self, size=None):
+        """
+        @param size: The length of the input being memoized. Unused.
+        """
+        self.positions = {}
+        self.window = None
+        self.limit = sys.maxsize
+        self.horizon = 0
+
+
+    def setWindow(self, window):
+        """
+        Only keep records for positions up to C{window} behind the farthest
+        one stored. Looking up an evicted position returns L{evicted}.
+        """
+        self.window = window
+        self.limit = window
+
+
+    def get(self, name, position):
+        """
+        Returns the memo record for the named rule at the given position, or
+        C{None}.
+        """
+        memo = self.positions.get(position)
+        if memo is not None:
+            rec = memo.get(name)
+            if rec is not None or position >= self.horizon:
+                return rec
+        elif position >= self.horizon:
+            return None
+        return evicted
+
+
+    def set(self, name, position, rec):
+        """
+        Store a memo record for the named rule at the given position.
+        """
+        if position >= self.limit:
+            self.evict(position - self.window)
+            self.limit = position + self.window
+        memo = self.positions.get(position)
+        if memo is None:
+            memo = self.positions[position] = {}
+        memo[name] = rec
+        return rec
+
+
+    def discard(self, position):
+        """
+        Forget all memo records for positions before the given one.
+        """
+        for p in [p for p in self.positions if p < position]:
+            del self.positions[p]
+
+
+    def evict(self, position):
+        """
+        Forget all memo records for positions before the given one, and
+        answer lookups for them with L{evicted} from now on.
+        """
+        self.discard(position)
+        self.horizon = position
+
+
+
+class InputStream(object):
+    """
+    The basic input mechanism used by OMeta grammars.
+    """
+
+    yieldsCharacters = False
+    # Inputs read from a string or bytes have methods for matching a run of
+    # characters in one comparison, for indexing their whitespace and for
+    # matching a L{Regular}; see L{StringInput.matchLength},
+    # L{StringInput.indexFor} and L{StringInput.matchRegular}. Those that
+    # track their position as an integer can scan a run of characters in a
+    # set with L{CursorInput.scan}.
+    matchLength = None
+    indexFor = None
+    matchRegular = None
+    scan = None
+
+    def fromIterable(cls, iterable, memoClass=ArrayMemo):
+        """
+        @param iterable: Any iterable Python object.
+        @param memoClass: The memo store type to use for this input.
+        """
+        if isinstance(iterable, str):
+            data = [character(c) for c in iterable]
+        elif _has_unicode and isinstance(iterable, unicode):
+            data = [unicodeCharacter(c) for c in iterable]
+        else:
+            data = list(iterable)
+            return cls(data, 0, memoClass(len(data)))
+        return cls(data, 0, memoClass(len(data)), True)
+    fromIterable = classmethod(fromIterable)
+
+    def __init__(self, data, position, memo=None, isText=False):
+        """
+        @param isText: Whether the items were read from a string, so that
+        slices of them are joined back into one.
+        """
+        self.data = data
+        self.position = position
+        if memo is None:
+            memo = DictMemo()
+        self.memo = memo
+        self.isText = isText
+        self.tl = None
+
+    def head(self):
+        if self.position >= len(self.data):
+            raise EOFError(self.position)
+        return self.data[self.position], [self.position, None]
+
+    def peek(self):
+        """
+        Like L{head}, but return L{failed} and the error at the end of the
+        input instead of raising L{EOFError}.
+        """
+        if self.position >= len(self.data):
+            return failed, [self.position, eof()]
+        return self.data[self.position], [self.position, None]
+
     def nullError(self):
-        return self.parent.nullError()
+        return [self.position, None]
+
+    def tail(self):
+        if self.tl is None:
+            self.tl = InputStream(self.data, self.position+1, self.memo,
+                                  self.isText)
+        return self.tl
+
+    def prev(self):
+        return InputStream(self.data, self.position-1, self.memo,
+                           self.isText)
+
+    def mark(self):
+        """
+        Return a value that L{rewind} can later use to return to this
+        position. Input streams are immutable, so that's the stream itself.
+        """
+        return self
+
+    def rewind(self, mark):
+        """
+        Return the input positioned at the given mark.
+        @param mark: A value previously returned by L{mark}.
+        """
+        return mark
 
+    def slice(self, start, end):
+        """
+        Return the input items between two positions. Characters read from
+        a string are joined back into one.
+        """
+        items = self.data[start:end]
+        if self.isText:
+            return ''.join(items)
+        return items
+
+    def text(self):
+        """
+        Return the input's characters, for a L{LineIndex} to find the lines
+        of.
+        """
+        if not self.isText:
+            raise ValueError("Input not read from a string has no lines")
+        return self.data
 
     def getMemo(self, name):
         """
         Returns the memo record for the named rule.
         @param name: A rule name.
         """
-        return self.memo.get(name, None)
+        return self.memo.get(name, self.position)
 
 
     def setMemo(self, name, rec):
@@ -237,129 +1249,2355 @@ class ArgInput(object):
         @param name: A rule name.
         @param rec: A memo record.
         """
-        self.memo[name] = rec
-        return rec
+        return self.memo.set(name, self.position, rec)
 
 
-class LeftRecursion(object):
+    def discard(self, position):
+        """
+        Drop the memo records before the given position, which will not be
+        returned to.
+        """
+        self.memo.discard(position)
+
+
+    def fork(self, position):
+        """
+        Return a new input over the same data at the given position, with a
+        memo store of the same kind but no records in it.
+        """
+        return InputStream(self.data, position,
+                           self.memo.__class__(len(self.data)), self.isText)
+
+
+class CursorInput(object):
     """
-    Marker for left recursion in a grammar rule.
+    An input engine that keeps the whole input in one shared buffer and
+    tracks the parse position as an integer.
+
+    Unlike L{InputStream}, moving through the input allocates nothing:
+    C{tail()} and C{prev()} move this object in place and return it, and
+    C{head()} reports no per-position error. Callers save and restore
+    positions with L{mark} and L{rewind} instead of holding on to old input
+    objects.
     """
-    detected = False
 
-class OMetaBase(object):
-    """
-    Base class providing implementations of the fundamental OMeta
-    operations. Built-in rules are defined here.
-    """
-    globals = None
-    def __init__(self, string, globals=None):
+    yieldsCharacters = False
+    isText = False
+    matchLength = None
+    indexFor = None
+    matchRegular = None
+
+    def fromIterable(cls, iterable, memoClass=ArrayMemo):
+        """
+        @param iterable: Any iterable Python object. Strings are indexed
+        directly by a L{StringInput}.
+        @param memoClass: The memo store type to use for this input.
+        """
+        if isinstance(iterable, str) or (_has_unicode and
+                                         isinstance(iterable, unicode)):
+            return StringInput(iterable, 0, memoClass(len(iterable)))
+        if isinstance(iterable, _byteTypes):
+            return BytesInput.fromIterable(iterable, memoClass)
+        data = list(iterable)
+        return cls(data, 0, memoClass(len(data)))
+    fromIterable = classmethod(fromIterable)
+
+    def __init__(self, data, position=0, memo=None):
+        self.data = data
+        self.length = len(data)
+        self.position = position
+        if memo is None:
+            memo = DictMemo()
+        self.memo = memo
+        self.indexes = {}
+
+    def head(self):
+        if self.position >= self.length:
+            raise EOFError(self.position)
+        return self.data[self.position], None
+
+    def peek(self):
+        """
+        Like L{head}, but return L{failed} and the error at the end of the
+        input instead of raising L{EOFError}.
+        """
+        if self.position >= self.length:
+            return failed, [self.position, eof()]
+        return self.data[self.position], None
+
+    def nullError(self):
+        return [self.position, None]
+
+    def tail(self):
+        self.position += 1
+        return self
+
+    def prev(self):
+        self.position -= 1
+        return self
+
+    def mark(self):
+        """
+        Return the current position, for use with L{rewind}.
+        """
+        return self.position
+
+    def slice(self, start, end):
+        """
+        Return the input items between two positions.
+        """
+        return self.data[start:end]
+
+    def text(self):
+        """
+        Return the input's text, for a L{LineIndex} to find the lines of.
+        """
+        raise ValueError("Input not read from a string has no lines")
+
+    def scan(self, members, negated):
+        """
+        Move past the items that are in C{members} (or, if C{negated},
+        aren't) from the current position on, and return them in a list.
+        """
+        data = self.data
+        start = position = self.position
+        end = self.length
+        while position < end and (data[position] in members) is not negated:
+            position += 1
+        self.position = position
+        return list(data[start:position])
+
+    def skipWhitespace(self, indexClass):
+        """
+        Move past the whitespace at the current position, as found by an
+        index of the given kind, and return the error reading the next item
+        would give: none, or the end of the input.
+        """
+        position = self.position = self.indexFor(indexClass).skip(
+            self.position)
+        if position >= self.length:
+            return [position, eof()]
+        return None
+
+    def rewind(self, mark):
+        """
+        Move back (or forward) to the given mark and return the input to use
+        from there.
+
+        @param mark: A value previously returned by L{mark} on this input or
+        on an L{ArgInput} stacked on top of it.
+        """
+        if mark.__class__ is int:
+            self.position = mark
+            return self
+        return mark
+
+    def getMemo(self, name):
+        """
+        Returns the memo record for the named rule at the current position.
+        @param name: A rule name.
+        """
+        return self.memo.get(name, self.position)
+
+
+    def setMemo(self, name, rec):
+        """
+        Store a memo record for the named rule at the current position.
+        @param name: A rule name.
+        @param rec: A memo record.
+        """
+        return self.memo.set(name, self.position, rec)
+
+
+    def discard(self, position):
+        """
+        Drop the memo records before the given position, which will not be
+        returned to.
+        """
+        self.memo.discard(position)
+
+
+    def fork(self, position):
+        """
+        Return a new input over the same data at the given position, with a
+        memo store of the same kind but no records in it. Indexes of the data
+        are shared.
+        """
+        i = self.__class__(self.data, position,
+                           self.memo.__class__(self.length))
+        i.indexes = self.indexes
+        return i
+
+
+def _indexFor(self, indexClass):
+    """
+    Return an index of the input of the given kind, such as a
+    L{WhitespaceIndex}, made the first time it's asked for.
+    """
+    index = self.indexes.get(indexClass)
+    if index is None:
+        index = self.indexes[indexClass] = indexClass(self.data)
+    return index
+
+
+def _matchLength(data, start, wanted):
+    """
+    Return how many of the characters of C{wanted}, from the first, C{data}
+    has from C{start} on.
+    """
+    if data.startswith(wanted, start):
+        return len(wanted)
+    end = len(data)
+    n = 0
+    for c in wanted:
+        if start + n >= end or data[start + n] != c:
+            break
+        n += 1
+    return n
+
+
+class StringInput(CursorInput):
+    """
+    A L{CursorInput} that indexes a string directly, rather than building a
+    list of L{character} objects from it.
+
+    Items read from it are plain one-character strings, so it sets
+    C{yieldsCharacters} to tell L{OMetaBase.listpattern} not to treat them
+    as sequences.
+    """
+
+    yieldsCharacters = True
+    isText = True
+
+    def fromIterable(cls, iterable, memoClass=ArrayMemo):
+        """
+        @param iterable: A string.
+        @param memoClass: The memo store type to use for this input.
+        """
+        return cls(iterable, 0, memoClass(len(iterable)))
+    fromIterable = classmethod(fromIterable)
+
+    def matchLength(self, wanted):
+        """
+        Return how many of the characters of a string, from the first, the
+        input has from the current position on: all of them if it starts
+        with the string.
+        """
+        return _matchLength(self.data, self.position, wanted)
+
+    def text(self):
+        """
+        Return the string, for a L{LineIndex} to find the lines of.
+        """
+        return self.data
+
+    indexFor = _indexFor
+
+    def matchRegular(self, regular):
+        """
+        Match a L{Regular} at the current position, and return the position
+        after what it matched, or C{None} if it doesn't match.
+        """
+        m = regular.compiled(False).match(self.data, self.position)
+        if m is None:
+            return None
+        return m.end()
+
+
+class StreamInput(StringInput):
+    """
+    A L{StringInput} whose data arrives in pieces, via L{feed}, rather than
+    all at once.
+
+    Reading past the data fed so far raises L{NeedMoreInput} until the
+    stream is closed, after which the end of the data is the end of the
+    input. Positions count from the start of the stream, even after
+    L{discard} has dropped data that can no longer be reached. Bytes are
+    decoded as Latin-1, so they read as the same characters a
+    L{BytesInput} would produce.
+    """
+
+    # The data is still arriving, so it can't be indexed, and a regular
+    # expression that reaches its end can't tell whether it would match.
+    indexFor = None
+    matchRegular = None
+
+    def __init__(self, memo=None):
+        StringInput.__init__(self, "", 0, memo)
+        self.offset = 0
+        self.restart = None
+        self.closed = False
+
+    def head(self):
+        if self.position >= self.length:
+            if self.closed:
+                raise EOFError(self.position)
+            raise NeedMoreInput(self.position)
+        return self.data[self.position - self.offset], None
+
+    def peek(self):
+        """
+        Like L{head}, but return L{failed} and the error at the end of a
+        closed stream instead of raising L{EOFError}.
+        """
+        if self.position >= self.length:
+            if self.closed:
+                return failed, [self.position, eof()]
+            raise NeedMoreInput(self.position)
+        return self.data[self.position - self.offset], None
+
+    def slice(self, start, end):
+        """
+        Return the input items between two positions.
+        """
+        return self.data[start - self.offset:end - self.offset]
+
+    def text(self):
+        """
+        Return the data fed so far, for a L{LineIndex} to find the lines of,
+        unless some of it has been discarded.
+        """
+        if self.offset:
+            raise ValueError("The start of the stream has been discarded; "
+                             "pass the text that was parsed")
+        return self.data
+
+    def scan(self, members, negated):
+        """
+        Move past the characters that are in C{members} (or, if C{negated},
+        aren't) and return them in a list. Running out of data before
+        finding one that isn't raises L{NeedMoreInput}, unless the stream is
+        closed.
+        """
+        data = self.data
+        offset = self.offset
+        start = position = self.position - offset
+        end = self.length - offset
+        while position < end and (data[position] in members) is not negated:
+            position += 1
+        if position == end and not self.closed:
+            raise NeedMoreInput(position + offset)
+        self.position = position + offset
+        return list(data[start:position])
+
+    def matchLength(self, wanted):
+        """
+        Return how many of the characters of a string, from the first, the
+        stream has from the current position on. Running out of data before
+        finding one that differs raises L{NeedMoreInput}, unless the stream
+        is closed.
+        """
+        n = _matchLength(self.data, self.position - self.offset, wanted)
+        if (n < len(wanted) and self.position + n >= self.length
+            and not self.closed):
+            raise NeedMoreInput(self.position + n)
+        return n
+
+    def feed(self, data):
+        """
+        Add data to the end of the stream.
+        @param data: A string, or bytes to be decoded as Latin-1.
+        """
+        if isinstance(data, _byteTypes):
+            data = codecs.latin_1_decode(data)[0]
+        self.data += data
+        self.length += len(data)
+
+    def close(self):
+        """
+        Mark the end of the stream.
+        """
+        self.closed = True
+
+    def discard(self, position):
+        """
+        Drop the memo records and buffered data before the given position.
+        While a parse is in progress, the data from C{restart}, where it
+        starts again if it runs out of data, is kept.
+        """
+        self.memo.discard(position)
+        if self.restart is not None:
+            position = min(position, self.restart)
+        if position > self.offset:
+            self.data = self.data[position - self.offset:]
+            self.offset = position
+
+    def fork(self, position):
+        """
+        Return a new stream with the data buffered so far, at the given
+        position, with a memo store of the same kind but no records in it.
+        """
+        i = StreamInput(self.memo.__class__(0))
+        i.data = self.data
+        i.length = self.length
+        i.offset = self.offset
+        i.closed = self.closed
+        i.position = position
+        return i
+
+
+_byteTypes = (bytes, bytearray, memoryview)
+_byteCharacters = [chr(b) for b in range(256)]
+
+class BytesInput(CursorInput):
+    """
+    A L{CursorInput} that reads a C{bytes}, C{bytearray}, C{memoryview} or
+    other buffer in place, through a memoryview over it.
+
+    Each byte is read as the one-character string with the same ordinal
+    (the byte decoded as Latin-1), so character literals, tokens and the
+    builtin character rules match bytes as they would ASCII text. Slices
+    taken with L{slice} are memoryviews sharing the original buffer.
+    """
+
+    yieldsCharacters = True
+    isText = True
+    released = 0
+
+    def fromIterable(cls, iterable, memoClass=ArrayMemo):
+        """
+        @param iterable: An object supporting the buffer protocol.
+        @param memoClass: The memo store type to use for this input.
+        """
+        data = memoryview(iterable)
+        if data.format != 'B' or data.ndim != 1:
+            data = data.cast('B')
+        return cls(data, 0, memoClass(len(data)))
+    fromIterable = classmethod(fromIterable)
+
+    def head(self):
+        if self.position >= self.length:
+            raise EOFError(self.position)
+        return _byteCharacters[self.data[self.position]], None
+
+    def peek(self):
+        """
+        Like L{head}, but return L{failed} and the error at the end of the
+        input instead of raising L{EOFError}.
+        """
+        if self.position >= self.length:
+            return failed, [self.position, eof()]
+        return _byteCharacters[self.data[self.position]], None
+
+    def matchLength(self, wanted):
+        """
+        Return how many of the characters of a string, from the first, the
+        input has from the current position on, comparing the bytes in place
+        with the string encoded as Latin-1. Bytes, or another buffer such
+        as a slice of the input, are compared as they are.
+        """
+        start = self.position
+        data = self.data
+        if isinstance(wanted, str):
+            try:
+                encoded = wanted.encode('latin-1')
+            except UnicodeEncodeError:
+                encoded = None
+        else:
+            encoded = memoryview(wanted).cast('B')
+        if encoded is not None:
+            if data[start:start + len(encoded)] == encoded:
+                return len(encoded)
+            n = 0
+            for b in encoded:
+                if start + n >= self.length or data[start + n] != b:
+                    break
+                n += 1
+            return n
+        n = 0
+        for c in wanted:
+            if (start + n >= self.length or
+                _byteCharacters[data[start + n]] != c):
+                break
+            n += 1
+        return n
+
+    def text(self):
+        """
+        Return the buffer, for a L{LineIndex} to find the lines of.
+        """
+        return self.data
+
+    indexFor = _indexFor
+
+    def matchRegular(self, regular):
+        """
+        Match a L{Regular}, compiled for bytes, at the current position, and
+        return the position after what it matched, or C{None} if it doesn't
+        match.
+        """
+        m = regular.compiled(True).match(self.data, self.position)
+        if m is None:
+            return None
+        return m.end()
+
+    def scan(self, members, negated):
+        """
+        Move past the bytes whose characters are in C{members} (or, if
+        C{negated}, aren't) and return the characters in a list.
+        """
+        data = self.data
+        start = position = self.position
+        end = self.length
+        while (position < end and
+               (_byteCharacters[data[position]] in members) is not negated):
+            position += 1
+        self.position = position
+        return [_byteCharacters[b] for b in data[start:position]]
+
+    def discard(self, position):
+        """
+        Drop the memo records before the given position and, when reading a
+        memory-mapped file, let the pages wholly before it be dropped from
+        memory too.
+        """
+        self.memo.discard(position)
+        source = self.data.obj
+        if isinstance(source, mmap.mmap) and hasattr(mmap, "MADV_DONTNEED"):
+            end = position - position % mmap.PAGESIZE
+            if end > self.released:
+                source.madvise(mmap.MADV_DONTNEED, self.released,
+                               end - self.released)
+                self.released = end
+
+
+class ArgInput(object):
+    yieldsCharacters = False
+    isText = False
+    matchLength = None
+    indexFor = None
+    matchRegular = None
+    scan = None
+
+    def __init__(self, arg, parent):
+        self.arg = arg
+        self.parent = parent
+        self.parentMark = parent.mark()
+        self.memo = {}
+        self.err = parent.nullError()
+        self.position = self.err[0]
+
+    def head(self):
+        return self.arg, self.err
+
+    peek = head
+
+    def tail(self):
+        return self.parent.rewind(self.parentMark)
+
+
+
+    def nullError(self):
+        return self.parent.nullError()
+
+
+    def mark(self):
+        return self
+
+
+    def rewind(self, mark):
+        return self.parent.rewind(mark)
+
+
+    def slice(self, start, end):
+        return self.parent.slice(start, end)
+
+
+    def text(self):
+        return self.parent.text()
+
+
+    def getMemo(self, name):
+        """
+        Returns the memo record for the named rule.
+        @param name: A rule name.
+        """
+        return self.memo.get(name, None)
+
+
+    def setMemo(self, name, rec):
+        """
+        Store a memo record for the given value and position for the given
+        rule.
+        @param name: A rule name.
+        @param rec: A memo record.
+        """
+        self.memo[name] = rec
+        return rec
+
+
+    def discard(self, position):
+        """
+        Nothing to drop: an argument hasn't been consumed yet.
+        """
+
+
+    def fork(self, position):
+        """
+        Return a new input over the data beneath the arguments.
+        """
+        return self.parent.fork(position)
+
+
+class LeftRecursion(object):
+    """
+    Marker for left recursion in a grammar rule.
+    """
+    detected = False
+
+class OMetaBase(object):
+    """
+    Base class providing implementations of the fundamental OMeta
+    operations. Built-in rules are defined here.
+    """
+    globals = None
+    inputClass = InputStream
+    memoClass = ArrayMemo
+    # How many positions behind the farthest one reached to keep memo
+    # records for, or None to keep them all.
+    memoWindow = None
+    # Whether to record the span of input each rule application matched,
+    # for L{span}.
+    trackSpans = False
+    # A L{WhitespaceIndex} subclass for L{eatWhitespace} to skip whitespace
+    # in string and bytes input with, or None to read it an item at a time.
+    whitespaceIndex = None
+    # A L{CharacterClassIndex} subclass declaring the classes for
+    # L{charClass}, which the builtin letter, digit and letterOrDigit rules
+    # look characters up in on string and bytes input; or None to test
+    # each character as it's read.
+    characterClasses = None
+    def __init__(self, string, globals=None):
+        """
+        @param string: The string to be parsed, or an input object to read
+        it from.
+
+        @param globals: A dictionary of names to objects, for use in evaluating
+        embedded Python expressions.
+        """
+        if isinstance(string, (InputStream, CursorInput)):
+            self.input = string
+        else:
+            self.input = self.inputClass.fromIterable(string, self.memoClass)
+        if self.memoWindow is not None:
+            self.input.memo.setWindow(self.memoWindow)
+        self.locals = {}
+        self.applying = []
+        self.errors = []
+        self._lineIndex = None
+        if self.trackSpans:
+            # Shadowing the method here leaves grammars that don't track
+            # spans without even a check for it.
+            self.spans = {}
+            self._apply = self._applyWithSpans
+        if self.characterClasses is not None:
+            self._indexClasses()
+        if self.globals is None:
+            if globals is None:
+                self.globals = {}
+            else:
+                self.globals = globals
+
+        self.currentError = self.input.nullError()
+
+
+    def fromFile(cls, file, globals=None):
+        """
+        Create a grammar that parses the contents of a file in place, from a
+        read-only memory map of it, with a L{BytesInput}.
+
+        @param file: A filename, or a file object open for reading in
+        binary mode.
+
+        @param globals: A dictionary of names to objects, for use in evaluating
+        embedded Python expressions.
+        """
+        if isinstance(file, str):
+            f = open(file, 'rb')
+            try:
+                return cls.fromFile(f, globals)
+            finally:
+                f.close()
+        try:
+            data = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # Empty files can't be mapped.
+            data = b""
+        return cls(BytesInput.fromIterable(data, cls.memoClass), globals)
+    fromFile = classmethod(fromFile)
+
+
+    def streaming(cls, ruleName, globals=None):
+        """
+        Create a grammar that parses data pushed to it with L{feed}, applying
+        the named rule over and over to produce a result for each complete
+        match.
+
+        @param ruleName: The name of the rule to apply.
+
+        @param globals: A dictionary of names to objects, for use in evaluating
+        embedded Python expressions.
+        """
+        g = cls(StreamInput(cls.memoClass(0)), globals)
+        g.streamRule = ruleName
+        g.streamError = None
+        return g
+    streaming = classmethod(streaming)
+
+
+    def feed(self, data):
+        """
+        Add data to the input of a grammar made with L{streaming}, and parse
+        as many results from it as can be decided so far.
+
+        @param data: A string, or bytes to be decoded as Latin-1.
+
+        @return: A list of the results of each application of the rule that
+        completed.
+        """
+        self.input.feed(data)
+        return self._parseStream()
+
+
+    def close(self):
+        """
+        Mark the end of the input of a grammar made with L{streaming}, and
+        parse the results that remain.
+
+        @return: A list of the results of each remaining application of the
+        rule.
+        """
+        self.input.close()
+        results = self._parseStream()
+        if self.input.position < self.input.length:
+            raise self.streamError
+        return results
+
+
+    def _parseStream(self):
+        """
+        Apply the streaming rule until it needs more input than has arrived.
+        A L{ParseError} means the input can't match, however it continues.
+        """
+        results = []
+        stream = self.input
+        while stream.position < stream.length:
+            start = stream.restart = stream.mark()
+            recovered = len(self.errors)
+            try:
+                val, self.streamError = self.apply(self.streamRule)
+            except NeedMoreInput:
+                self.input = stream.rewind(start)
+                del self.errors[recovered:]
+                if self.trackSpans:
+                    self._dropSpans()
+                break
+            if stream.position == start:
+                break
+            results.append(val)
+        stream.restart = None
+        stream.discard(stream.position)
+        return results
+
+
+
+    def iterparse(self, ruleName, *args):
+        """
+        Apply the named rule, which must end with a repetition, producing
+        each item of the repetition as soon as it matches, instead of a list
+        of all of them at the end.
+
+        Once an item has been produced the input can't be rewound to before
+        it, so the memo records and, where the input allows, the data behind
+        it are dropped as parsing goes on.
+
+        @param ruleName: A rule name.
+
+        @return: An iterator of the values of the repetition's items.
+        """
+        start = getattr(self, "iter_"+ruleName, None)
+        if start is None:
+            if getattr(self, "rule_"+ruleName, None) is None:
+                raise NameError("No rule named '%s'" %(ruleName,))
+            raise ValueError("Rule '%s' doesn't end with a repetition"
+                             %(ruleName,))
+        for arg in args[::-1]:
+            self.input = ArgInput(arg, self.input)
+        item, atLeastOne = start()
+        return self._iterItems(item, atLeastOne)
+
+
+    def _iterItems(self, item, atLeastOne):
+        """
+        Call C{item} until it fails to match the input, yielding each value
+        it produces.
+        """
+        if atLeastOne:
+            v, _ = self._or([item])
+            self.input.discard(self.input.position)
+            yield v
+        while True:
+            m = self.input.mark()
+            n = len(self.errors)
+            try:
+                v, _ = item()
+            except Committed as e:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                raise ParseError(*e.args)
+            except ParseError:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                return
+            self.input.discard(self.input.position)
+            yield v
+
+
+    def considerError(self, error):
+        if error and  error[0] > self.currentError[0]:
+            self.currentError = error
+
+
+    def superApply(self, ruleName, *args):
+        """
+        Apply the named rule as defined on this object's superclass.
+
+        @param ruleName: A rule name.
+        """
+        r = getattr(super(self.__class__, self), "rule_"+ruleName, None)
+        if r is not None:
+            self.input.setMemo(ruleName, None)
+            return self._apply(r, ruleName, args)
+        else:
+            raise NameError("No rule named '%s'" %(ruleName,))
+
+    def apply(self, ruleName, *args):
+        """
+        Apply the named rule, optionally with some arguments.
+
+        @param ruleName: A rule name.
+        """
+        r = getattr(self, "rule_"+ruleName, None)
+        if r is not None:
+            val, err = self._apply(r, ruleName, args)
+            if err is None:
+                # Builtin rules report no error on inputs that don't track
+                # one per item.
+                err = self.currentError
+            return val, ParseError(*err)
+
+        else:
+            raise NameError("No rule named '%s'" %(ruleName,))
+
+
+    def _apply(self, rule, ruleName, args):
+        """
+        Apply a rule method to some args.
+        @param rule: A method of this object.
+        @param ruleName: The name of the rule invoked.
+        @param args: A sequence of arguments to it.
+        """
+        if args:
+            if rule.__code__.co_argcount - 1 != len(args):
+                for arg in args[::-1]:
+                    self.input = ArgInput(arg, self.input)
+                return rule()
+            else:
+                return rule(*args)
+        memoRec = self.input.getMemo(ruleName)
+        if memoRec is None:
+            oldPosition = self.input.mark()
+            recovered = len(self.errors)
+            lr = LeftRecursion()
+            memoRec = self.input.setMemo(ruleName, lr)
+            self.applying.append((ruleName, oldPosition))
+
+            #print "Calling", rule
+            try:
+                try:
+                    ans = rule()
+                except ParseError:
+                    #print "Failed", rule
+                    raise
+                #print "Success", rule
+                sentinel = self.input.mark()
+                self.input = self.input.rewind(oldPosition)
+                memoRec = self.input.setMemo(
+                    ruleName, self._memoRecord(ans, sentinel, recovered))
+                if lr.detected:
+                    while True:
+                        del self.errors[recovered:]
+                        try:
+                            ans = rule()
+                            if (self.input.mark() == sentinel):
+                                break
+                            end = self.input.mark()
+                            self.input = self.input.rewind(oldPosition)
+                            memoRec = self.input.setMemo(
+                                ruleName,
+                                self._memoRecord(ans, end, recovered))
+                        except ParseError:
+                            break
+            except NeedMoreInput:
+                # The rule read past the data a stream has buffered so far,
+                # so nothing memoized for it here is final yet.
+                self.input = self.input.rewind(oldPosition)
+                self.input.setMemo(ruleName, None)
+                raise
+            finally:
+                self.applying.pop()
+            self.input = self.input.rewind(oldPosition)
+            del self.errors[recovered:]
+
+        elif isinstance(memoRec, LeftRecursion):
+            memoRec.detected = True
+            raise ParseError(None, None)
+        elif memoRec is evicted:
+            raise BacktrackError(self.input.position,
+                                 "Backtracked to position %s, before the "
+                                 "memo window of %s positions" % (
+                                     self.input.position, self.memoWindow))
+        self.input = self.input.rewind(memoRec[1])
+        if len(memoRec) > 2:
+            self._reuseMemo(memoRec)
+        return memoRec[0]
+
+
+    def _memoRecord(self, ans, end, recovered):
+        """
+        Make the memo record of a rule application that matched from the
+        current position up to C{end}, having started when C{self.errors}
+        held C{recovered} errors. The errors it recovered from since, and
+        the spans it recorded, are kept with it, so that a later
+        application reusing the record reports them again.
+        """
+        if self.trackSpans and self.spans:
+            start = self.input.position
+            spans = []
+            for rec in reversed(self.spans.values()):
+                if rec[1] < start:
+                    break
+                spans.append(rec)
+            return [ans, end, self.errors[recovered:], spans]
+        if len(self.errors) > recovered:
+            return [ans, end, self.errors[recovered:]]
+        return [ans, end]
+
+
+    def _reuseMemo(self, memoRec):
+        """
+        Report again the errors and spans that the rule application a memo
+        record was made for recorded.
+        """
+        self.errors.extend(memoRec[2])
+        if len(memoRec) > 3:
+            spans = self.spans
+            for rec in reversed(memoRec[3]):
+                spans.setdefault(id(rec[0]), rec)
+
+
+    def _indexClasses(self):
+        """
+        Shadow the builtin rules for the character classes that
+        C{characterClasses} declares with versions that look the next
+        character up in an index of the input. Rules a grammar defines for
+        itself are left alone.
+        """
+        cls = self.__class__
+        for name, predicate in self.characterClasses.classes:
+            rule = getattr(cls, name, None)
+            if rule is None or getattr(cls, "rule_" + name, None) is not rule:
+                continue
+            indexed = self._indexedClass(name, getattr(self, name))
+            setattr(self, name, indexed)
+            setattr(self, "rule_" + name, indexed)
+
+
+    def _indexedClass(self, name, rule):
+        """
+        Return a function that matches a character of the named class when
+        the index of the input says the next one is, and otherwise applies
+        C{rule}, which also handles input that can't be indexed.
+        """
+        indexClass = self.characterClasses
+        bit = indexClass.bit(name)
+        def match():
+            i = self.input
+            if i.indexFor is not None:
+                position = i.position
+                if (position < i.length and
+                    i.indexFor(indexClass).codes[position] & bit):
+                    x, e = i.head()
+                    i.position = position + 1
+                    return x, e
+            return rule()
+        return match
+
+
+    def _applyWithSpans(self, rule, ruleName, args):
+        """
+        Apply a rule method to some args, as L{_apply} does, and record the
+        span of input matched to produce its value in C{self.spans}, unless
+        a rule application inside it produced the same value first.
+        """
+        start = self.input.position
+        ans = self.__class__._apply(self, rule, ruleName, args)
+        value = ans[0]
+        if value is not failed and id(value) not in self.spans:
+            self.spans[id(value)] = (value, start, self.input.position)
+        return ans
+
+
+    def _dropSpans(self):
+        """
+        Forget the spans recorded since the input was marked at the
+        position it's just been rewound to, so the values of rule
+        applications the parse has backtracked out of aren't kept alive.
+        """
+        spans = self.spans
+        position = self.input.position
+        while spans and next(reversed(spans.values()))[2] > position:
+            spans.popitem()
+
+
+    def span(self, value):
+        """
+        Return the start and end positions of the input that the innermost
+        rule application producing C{value} matched, or C{None}. Spans are
+        only recorded when C{trackSpans} is set. They're looked up by
+        identity, so they're only useful for values built by the rules
+        themselves: small integers, single characters and the like can be
+        shared by many.
+
+        @param value: A value produced by a rule application.
+        """
+        rec = self.spans.get(id(value))
+        if rec is None:
+            return None
+        return rec[1], rec[2]
+
+
+    def lineSpan(self, value, text=None):
+        """
+        Return the line and column, as L{LineIndex.lineColumn} gives them,
+        of the start and end of the span of C{value}, or C{None}.
+
+        @param value: A value produced by a rule application.
+        @param text: The string that was parsed, or a L{LineIndex} of it.
+        By default, what the input's C{text} method returns. Inputs not read
+        from a string or bytes, and streams that have discarded data, raise
+        C{ValueError} instead.
+        """
+        span = self.span(value)
+        if span is None:
+            return None
+        if text is None:
+            index = self.lineIndex()
+        else:
+            index = LineIndex.of(text)
+        return index.lineColumn(span[0]), index.lineColumn(span[1])
+
+
+    def lineIndex(self):
+        """
+        Return a L{LineIndex} of what the input's C{text} method returns,
+        made once and kept with this grammar for as long as the text stays
+        the same, to pass to the L{ParseError.formatError} of each of
+        C{self.errors}.
+        """
+        text = self.input.text()
+        index = self._lineIndex
+        if index is None or index.text is not text:
+            index = self._lineIndex = LineIndex(text)
+        return index
+
+
+    def rule_anything(self):
+        """
+        Match a single item from the input of any kind.
+        """
+        h, p = self.input.head()
+        self.input = self.input.tail()
+        return h, p
+
+    def exactly(self, wanted):
+        """
+        Match a single item from the input equal to the given specimen.
+
+        @param wanted: What to match.
+        """
+        i = self.input
+        val, p = i.head()
+        if wanted == val:
+            self.input = i.tail()
+            return val, p
+        else:
+            raise ParseError(i.position, expected(None, wanted))
+
+    rule_exactly = exactly
+
+    def exactlyString(self, wanted):
+        """
+        Match a string of several characters. Inputs read from a string or
+        bytes, whatever their engine, match it as a run of characters;
+        others match it as a single item equal to it, like L{exactly}.
+
+        @param wanted: The string to match.
+        """
+        i = self.input
+        if i.matchLength is None and not i.isText:
+            return self.exactly(wanted)
+        position, e = self._matchString(wanted)
+        if position is None:
+            return wanted, None
+        raise ParseError(position, expected(None, wanted))
+
+    def _matchString(self, wanted):
+        """
+        Move past a run of characters equal to a string, compared all at
+        once where the input can, and return None and the error of the last
+        of them (None if compared at once); or, if the input doesn't start
+        with it, return the position where they first differ and None.
+
+        @param wanted: The string to match.
+        """
+        i = self.input
+        if i.matchLength is not None:
+            n = i.matchLength(wanted)
+            if n == len(wanted):
+                i.position += n
+                return None, None
+            return i.position + n, None
+        e = None
+        for c in wanted:
+            x, e = i.peek()
+            if x != c:
+                return i.position, None
+            i = i.tail()
+        self.input = i
+        return None, e
+
+    def many(self, fn, *initial):
+        """
+        Call C{fn} until it fails to match the input. Collect the resulting
+        values into a list.
+
+        @param fn: A callable of no arguments.
+        @param initial: Initial values to populate the returned list with.
+        """
+        ans = []
+        e = None
+        for x, e in initial:
+            ans.append(x)
+        while True:
+            m = self.input.mark()
+            n = len(self.errors)
+            try:
+                v, _ = fn()
+                ans.append(v)
+            except Committed as e:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                raise ParseError(*e.args)
+            except ParseError:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                break
+        return ans, e
+
+    def cut(self):
+        """
+        Pass a cut, after which the alternative or repetition item being
+        matched won't backtrack to before this point. Memo records (and,
+        where the input allows, data) before it are dropped, except those
+        of the rule applications still in progress, which left recursion
+        relies on.
+        """
+        i = self.input
+        if isinstance(i, ArgInput):
+            return True, None
+        memo = i.memo
+        live = []
+        for name, mark in self.applying:
+            position = getattr(mark, "position", mark)
+            live.append((name, position, memo.get(name, position)))
+        i.discard(i.position)
+        for name, position, rec in live:
+            memo.set(name, position, rec)
+        return True, None
+
+    def committed(self, fn):
+        """
+        Call C{fn}, which matches the rest of an alternative after a cut. If
+        it fails, raise L{Committed} so the choice the alternative belongs
+        to fails as well.
+
+        @param fn: A callable of no arguments.
+        """
+        try:
+            return fn()
+        except ParseError as e:
+            raise Committed(*e.args)
+
+    def _or(self, fns):
+        """
+        Call each of a list of functions in sequence until one succeeds,
+        rewinding the input between each.
+
+        @param fns: A list of no-argument callables.
+        """
+        errors = []
+        for f in fns:
+            m = self.input.mark()
+            n = len(self.errors)
+            try:
+                ret, err = f()
+                errors.append(err)
+                return ret, joinErrors(errors)
+            except Committed as e:
+                errors.append(e)
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                break
+            except ParseError as e:
+                errors.append(e)
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+        raise ParseError(*joinErrors(errors))
+
+
+    def dispatch(self, table, fns):
+        """
+        Choose between alternatives that each start with a string literal,
+        as L{_or} would, but call only those that a L{Dispatch} table says
+        can match the next item of input. The others fail where they start,
+        expecting their literal, and are counted among the choice's errors as
+        such without being called.
+
+        @param table: A L{Dispatch} for the alternatives' literals.
+        @param fns: A list of no-argument callables.
+        """
+        i = self.input
+        item, p = i.peek()
+        if item is failed:
+            return self._or(fns)
+        candidates = table.candidates(item)
+        if candidates is None:
+            return self._or(fns)
+        position = i.position
+        literals = table.literals
+        errors = []
+        skipped = 0
+        for n in candidates:
+            for wanted in literals[skipped:n]:
+                errors.append([position, expected(None, wanted)])
+            skipped = n + 1
+            m = self.input.mark()
+            recovered = len(self.errors)
+            try:
+                ret, err = fns[n]()
+                errors.append(err)
+                return ret, joinErrors(errors)
+            except Committed as e:
+                errors.append(e)
+                self.input = self.input.rewind(m)
+                del self.errors[recovered:]
+                if self.trackSpans:
+                    self._dropSpans()
+                raise ParseError(*joinErrors(errors))
+            except ParseError as e:
+                errors.append(e)
+                self.input = self.input.rewind(m)
+                del self.errors[recovered:]
+                if self.trackSpans:
+                    self._dropSpans()
+        for wanted in literals[skipped:]:
+            errors.append([position, expected(None, wanted)])
+        raise ParseError(*joinErrors(errors))
+
+
+    def _not(self, fn):
+        """
+        Call the given function. Raise ParseError iff it does not.
+
+        @param fn: A callable of no arguments.
+        """
+        m = self.input.mark()
+        n = len(self.errors)
+        try:
+            fn()
+        except ParseError as e:
+            self.input = self.input.rewind(m)
+            del self.errors[n:]
+            if self.trackSpans:
+                self._dropSpans()
+            return True, self.input.nullError()
+        else:
+            del self.errors[n:]
+            raise ParseError(*self.input.nullError())
+
+    def eatWhitespace(self):
+        """
+        Consume input until a non-whitespace character is reached.
+        """
+        i = self.input
+        if self.whitespaceIndex is not None and i.indexFor is not None:
+            return True, i.skipWhitespace(self.whitespaceIndex)
+        e = None
+        while True:
+            try:
+                c, e = self.input.head()
+            except EOFError as eof:
+                e = eof
+                break
+            if c.isspace():
+                self.input = self.input.tail()
+            else:
+                break
+        return True, e
+    rule_spaces = eatWhitespace
+
+
+    def pred(self, expr):
+        """
+        Call the given function, raising ParseError if it returns false.
+
+        @param expr: A callable of no arguments.
+        """
+        val, e = expr()
+        if not val:
+            raise ParseError(*e)
+        else:
+            return True, e
+
+    def listpattern(self, expr):
+        """
+        Call the given function, treating the next object on the stack as an
+        iterable to be used for input.
+
+        @param expr: A callable of no arguments.
+        """
+        source = self.input
+        v, e = self.rule_anything()
+        oldInput = self.input
+        try:
+            if source.yieldsCharacters:
+                raise TypeError("Characters are not iterable")
+            self.input = self.inputClass.fromIterable(v, self.memoClass)
+        except TypeError:
+            e = self.input.nullError()
+            e[1] = expected("an iterable")
+            raise ParseError(*e)
+        try:
+            expr()
+            self.end()
+        finally:
+            self.input = oldInput
+        return v, e
+
+
+    def end(self):
+        """
+        Match the end of the stream.
+        """
+        return self._not(self.rule_anything)
+
+    rule_end = end
+
+    def lookahead(self, f):
+        """
+        Execute the given callable, rewinding the stream no matter whether it
+        returns successfully or not.
+
+        @param f: A callable of no arguments.
+        """
+        m = self.input.mark()
+        n = len(self.errors)
+        try:
+            x = f()
+            return x
+        finally:
+            self.input = self.input.rewind(m)
+            del self.errors[n:]
+            if self.trackSpans:
+                self._dropSpans()
+
+
+    def capture(self, fn):
+        """
+        Call the given function, and return the input it matched, as a slice
+        of the input rather than the values it produced.
+
+        @param fn: A callable of no arguments.
+        """
+        start = self.input.position
+        v, e = fn()
+        return self.input.slice(start, self.input.position), e
+
+
+    def token(self, tok):
+        """
+        Match and return the given string, consuming any preceding whitespace.
+        """
+        m = self.input.mark()
+        try:
+            position, e = self._matchToken(tok)
+        except ParseError as err:
+            position = err[0]
+        if position is None:
+            return tok, e
+        self.input = self.input.rewind(m)
+        raise ParseError(position, expected("token", tok))
+
+    rule_token = token
+
+    def _matchToken(self, tok):
+        """
+        Skip whitespace, then match a string as L{_matchString} does.
+
+        @param tok: The string to match.
+        """
+        self.eatWhitespace()
+        return self._matchString(tok)
+
+    def letter(self):
+        """
+        Match a single letter.
+        """
+        x, e = self._matchCharacter(str.isalpha)
+        if x is failed:
+            raise self._mismatch(e, expected("letter"))
+        return x, e
+
+    rule_letter = letter
+
+    def letterOrDigit(self):
+        """
+        Match a single alphanumeric character.
+        """
+        x, e = self._matchCharacter(_isLetterOrDigit)
+        if x is failed:
+            raise self._mismatch(e, expected("letter or digit"))
+        return x, e
+
+    rule_letterOrDigit = letterOrDigit
+
+    def digit(self):
+        """
+        Match a single digit.
+        """
+        x, e = self._matchCharacter(str.isdigit)
+        if x is failed:
+            raise self._mismatch(e, expected("digit"))
+        return x, e
+
+    rule_digit = digit
+
+    def charClass(self, name):
+        """
+        Match a single character in the named class of the grammar's
+        C{characterClasses}.
+        """
+        x, e = self._matchClass(name)
+        if x is failed:
+            raise self._mismatch(e, expected(name))
+        return x, e
+
+    rule_charClass = charClass
+
+    def charSet(self, members, negated, description):
+        """
+        Match a single character that is one of C{members}, or if
+        C{negated} one that isn't.
+
+        @param members: A frozenset of characters, or a L{CharRanges}.
+        @param negated: Whether to match characters not in C{members}.
+        @param description: The set as written in the grammar.
+        """
+        x, e = self._matchMember(members, negated)
+        if x is failed:
+            raise self._mismatch(e, expected("character in", description))
+        return x, e
+
+    rule_charSet = charSet
+
+    # The matchers below are shared by every base, which only signals
+    # their failures its own way. Each moves past the next character and
+    # returns it and its error if it matches, and otherwise returns failed
+    # with the error at the end of the input, or None if there's a
+    # character that doesn't match.
+
+    def _matchCharacter(self, test):
+        """
+        Match a character for which C{test} returns true.
+        """
+        i = self.input
+        x, e = i.peek()
+        if x is failed:
+            return x, e
+        if test(x):
+            self.input = i.tail()
+            return x, e
+        return failed, None
+
+    def _matchClass(self, name):
+        """
+        Match a character in the named class of C{characterClasses}.
+        """
+        i = self.input
+        x, e = i.peek()
+        if x is failed:
+            return x, e
+        classes = self.characterClasses
+        if i.indexFor is not None:
+            matched = i.indexFor(classes).codes[i.position] & classes.bit(name)
+        else:
+            matched = classes.test(name, x)
+        if matched:
+            self.input = i.tail()
+            return x, e
+        return failed, None
+
+    def _matchMember(self, members, negated):
+        """
+        Match a character in C{members}, or if C{negated} one that isn't.
+        """
+        i = self.input
+        x, e = i.peek()
+        if x is failed:
+            return x, e
+        if (x in members) is not negated:
+            self.input = i.tail()
+            return x, e
+        return failed, None
+
+    def _mismatch(self, error, expectation):
+        """
+        Return the L{ParseError} to raise for a matcher's failure: an
+        L{EOFError} at the end of the input, or one expecting
+        C{expectation} where the input is.
+        """
+        if error is not None:
+            return EOFError(error[0])
+        return ParseError(self.input.position, expectation)
+
+    def charSetMany(self, members, negated, description, atLeastOne=False):
+        """
+        Match characters of a set for as long as the input has them,
+        collecting them into a list as L{many} would. Inputs with C{scan}
+        find them in one loop.
+
+        @param atLeastOne: Whether to fail if there isn't one.
+        """
+        if atLeastOne:
+            initial = [self.charSet(members, negated, description)]
+        else:
+            initial = []
+        return self._charSetRest(members, negated, description, initial)
+
+
+    def _charSetRest(self, members, negated, description, initial):
+        """
+        Match the rest of a L{charSetMany}, after the C{initial} matches
+        of its first character.
+        """
+        i = self.input
+        if i.scan is None:
+            return self.many(lambda: self.charSet(members, negated,
+                                                  description), *initial)
+        ans = [x for x, e in initial]
+        ans.extend(i.scan(members, negated))
+        return ans, initial and initial[0][1] or None
+
+
+    def recover(self, ruleName, sync):
+        """
+        Apply the named rule. If it fails anywhere but at the end of the
+        input, add its L{ParseError} to C{self.errors}, skip the input up to
+        and including the next item found in C{sync}, and succeed with
+        C{None}, so that parsing carries on and one pass finds every error.
+
+        @param ruleName: The name of a rule that takes no arguments.
+        @param sync: The items that end a stretch of input to skip, such as
+        C{";"} or C{"\\n"}.
+        """
+        m = self.input.mark()
+        n = len(self.errors)
+        try:
+            return self._apply(getattr(self, "rule_"+ruleName), ruleName, ())
+        except ParseError as e:
+            if e.position is None:
+                # Left recursion is being detected, not a real failure.
+                raise
+            self.input = self.input.rewind(m)
+            del self.errors[n:]
+            if self.trackSpans:
+                self._dropSpans()
+            try:
+                self.input.head()
+            except EOFError:
+                raise e
+            self.errors.append(e)
+        while True:
+            try:
+                x, _ = self.input.head()
+            except EOFError:
+                break
+            self.input = self.input.tail()
+            if x in sync:
+                break
+        return None, self.input.nullError()
+
+    rule_recover = recover
+
+
+    def pythonExpr(self, endChars="\r\n"):
+        """
+        Extract a Python expression from the input and return it.
+
+        @arg endChars: A set of characters delimiting the end of the expression.
+        """
+        delimiters = { "(": ")", "[": "]", "{": "}"}
+        stack = []
+        expr = []
+        lastc = None
+        endchar = None
+        while True:
+            try:
+                c, e = self.rule_anything()
+            except ParseError as err:
+                e = err
+                endchar = None
+                break
+            if c in endChars and len(stack) == 0:
+                endchar = c
+                break
+            else:
+                expr.append(c)
+                if c in delimiters:
+                    stack.append(delimiters[c])
+                elif len(stack) > 0 and c == stack[-1]:
+                    stack.pop()
+                elif c in list(delimiters.values()):
+                    raise ParseError(self.input.position, expected("Python expression"))
+                elif c in "\"'":
+                    while True:
+                        strc, stre = self.rule_anything()
+                        expr.append(strc)
+                        slashcount = 0
+                        while strc == '\\':
+                            strc, stre = self.rule_anything()
+                            expr.append(strc)
+                            slashcount += 1
+                        if strc == c and slashcount % 2 == 0:
+                            break
+            
+        if len(stack) > 0:
+            raise ParseError(self.input.position, expected("Python expression"))
+        return (''.join(expr).strip(), endchar), e
+
+
+
+class SentinelOMetaBase(OMetaBase):
+    """
+    Base class for grammars whose code is generated by
+    L{pymeta.builder.SentinelPythonWriter}, with implementations of the
+    fundamental OMeta operations that signal failure to match by returning
+    L{failed} as their value, along with the error, instead of raising
+    L{ParseError}. Nothing is raised and caught as alternatives and
+    repetitions fail; L{apply} raises the L{ParseError} if the rule it
+    applies fails.
+    """
+
+    def apply(self, ruleName, *args):
+        """
+        Apply the named rule, optionally with some arguments, raising
+        L{ParseError} if it fails.
+
+        @param ruleName: A rule name.
+        """
+        r = getattr(self, "rule_"+ruleName, None)
+        if r is not None:
+            val, err = self._apply(r, ruleName, args)
+            if err is None:
+                err = self.currentError
+            if val is failed:
+                raise ParseError(*err)
+            return val, ParseError(*err)
+
+        else:
+            raise NameError("No rule named '%s'" %(ruleName,))
+
+
+    def _apply(self, rule, ruleName, args):
+        """
+        Apply a rule method to some args.
+        @param rule: A method of this object.
+        @param ruleName: The name of the rule invoked.
+        @param args: A sequence of arguments to it.
+        """
+        if args:
+            if rule.__code__.co_argcount - 1 != len(args):
+                for arg in args[::-1]:
+                    self.input = ArgInput(arg, self.input)
+                return rule()
+            else:
+                return rule(*args)
+        memoRec = self.input.getMemo(ruleName)
+        if memoRec is None:
+            oldPosition = self.input.mark()
+            recovered = len(self.errors)
+            lr = LeftRecursion()
+            memoRec = self.input.setMemo(ruleName, lr)
+            self.applying.append((ruleName, oldPosition))
+            try:
+                ans = rule()
+                if ans[0] is failed:
+                    return ans
+                sentinel = self.input.mark()
+                self.input = self.input.rewind(oldPosition)
+                memoRec = self.input.setMemo(
+                    ruleName, self._memoRecord(ans, sentinel, recovered))
+                if lr.detected:
+                    while True:
+                        del self.errors[recovered:]
+                        ans = rule()
+                        if ans[0] is failed or self.input.mark() == sentinel:
+                            break
+                        end = self.input.mark()
+                        self.input = self.input.rewind(oldPosition)
+                        memoRec = self.input.setMemo(
+                            ruleName, self._memoRecord(ans, end, recovered))
+            except NeedMoreInput:
+                self.input = self.input.rewind(oldPosition)
+                self.input.setMemo(ruleName, None)
+                raise
+            finally:
+                self.applying.pop()
+            self.input = self.input.rewind(oldPosition)
+            del self.errors[recovered:]
+
+        elif isinstance(memoRec, LeftRecursion):
+            memoRec.detected = True
+            return failed, [None, None]
+        elif memoRec is evicted:
+            raise BacktrackError(self.input.position,
+                                 "Backtracked to position %s, before the "
+                                 "memo window of %s positions" % (
+                                     self.input.position, self.memoWindow))
+        self.input = self.input.rewind(memoRec[1])
+        if len(memoRec) > 2:
+            self._reuseMemo(memoRec)
+        return memoRec[0]
+
+
+    def _iterItems(self, item, atLeastOne):
+        """
+        Raise L{ParseError} if the part of the rule before its repetition
+        failed, or return an iterator of the repetition's items.
+        """
+        if item is failed:
+            self._iterFailed(atLeastOne)
+        return self._iterMatches(item, atLeastOne)
+
+
+    def _iterMatches(self, item, atLeastOne):
+        """
+        Call C{item} until it fails to match the input, yielding each value
+        it produces.
+        """
+        if atLeastOne:
+            v, e = self._or([item])
+            if v is failed:
+                self._iterFailed(e)
+            self.input.discard(self.input.position)
+            yield v
+        while True:
+            m = self.input.mark()
+            n = len(self.errors)
+            v, e = item()
+            if v is failed:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                return
+            if v is failedCommitted:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                self._iterFailed(e)
+            self.input.discard(self.input.position)
+            yield v
+
+
+    def _iterFailed(self, error):
+        """
+        Raise the L{ParseError} for a failure to match in L{iterparse}.
+        """
+        raise ParseError(*error)
+
+
+    def rule_anything(self):
+        """
+        Match a single item from the input of any kind.
+        """
+        h, p = self.input.peek()
+        if h is not failed:
+            self.input = self.input.tail()
+        return h, p
+
+
+    def exactly(self, wanted):
+        """
+        Match a single item from the input equal to the given specimen.
+
+        @param wanted: What to match.
+        """
+        i = self.input
+        val, p = i.peek()
+        if wanted == val:
+            self.input = i.tail()
+            return val, p
+        if val is failed:
+            return val, p
+        return failed, [i.position, expected(None, wanted)]
+
+    rule_exactly = exactly
+
+
+    def exactlyString(self, wanted):
+        """
+        Match a string of several characters, as a run of characters on
+        inputs read from a string or bytes and otherwise as a single item.
+
+        @param wanted: The string to match.
+        """
+        i = self.input
+        if i.matchLength is None and not i.isText:
+            return self.exactly(wanted)
+        position, e = self._matchString(wanted)
+        if position is None:
+            return wanted, None
+        return failed, [position, expected(None, wanted)]
+
+
+    def many(self, fn, *initial):
+        """
+        Call C{fn} until it fails to match the input. Collect the resulting
+        values into a list.
+
+        @param fn: A callable of no arguments.
+        @param initial: Initial values to populate the returned list with.
+        """
+        ans = []
+        e = None
+        for x, e in initial:
+            if x is failed:
+                return x, e
+            ans.append(x)
+        while True:
+            m = self.input.mark()
+            n = len(self.errors)
+            v, err = fn()
+            if v is failed:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                break
+            if v is failedCommitted:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                return failed, err
+            ans.append(v)
+        return ans, e
+
+
+    def committed(self, fn):
+        """
+        Call C{fn}, which matches the rest of an alternative after a cut. If
+        it fails, return L{failedCommitted} so the choice the alternative
+        belongs to fails as well.
+
+        @param fn: A callable of no arguments.
+        """
+        v, e = fn()
+        if v is failed:
+            return failedCommitted, e
+        return v, e
+
+
+    def _or(self, fns):
+        """
+        Call each of a list of functions in sequence until one succeeds,
+        rewinding the input between each.
+
+        @param fns: A list of no-argument callables.
+        """
+        errors = []
+        for f in fns:
+            m = self.input.mark()
+            n = len(self.errors)
+            ret, err = f()
+            errors.append(err)
+            if ret is failed:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+            elif ret is failedCommitted:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                break
+            else:
+                return ret, joinErrors(errors)
+        return failed, joinErrors(errors)
+
+
+    def dispatch(self, table, fns):
+        """
+        Choose between alternatives that each start with a string literal,
+        as L{_or} would, but call only those that a L{Dispatch} table says
+        can match the next item of input.
+
+        @param table: A L{Dispatch} for the alternatives' literals.
+        @param fns: A list of no-argument callables.
+        """
+        i = self.input
+        item, p = i.peek()
+        if item is failed:
+            return self._or(fns)
+        candidates = table.candidates(item)
+        if candidates is None:
+            return self._or(fns)
+        position = i.position
+        literals = table.literals
+        errors = []
+        skipped = 0
+        for n in candidates:
+            for wanted in literals[skipped:n]:
+                errors.append([position, expected(None, wanted)])
+            skipped = n + 1
+            m = self.input.mark()
+            recovered = len(self.errors)
+            ret, err = fns[n]()
+            errors.append(err)
+            if ret is failed:
+                self.input = self.input.rewind(m)
+                del self.errors[recovered:]
+                if self.trackSpans:
+                    self._dropSpans()
+            elif ret is failedCommitted:
+                self.input = self.input.rewind(m)
+                del self.errors[recovered:]
+                if self.trackSpans:
+                    self._dropSpans()
+                return failed, joinErrors(errors)
+            else:
+                return ret, joinErrors(errors)
+        for wanted in literals[skipped:]:
+            errors.append([position, expected(None, wanted)])
+        return failed, joinErrors(errors)
+
+
+    def _not(self, fn):
+        """
+        Call the given function. Fail iff it does not.
+
+        @param fn: A callable of no arguments.
+        """
+        m = self.input.mark()
+        n = len(self.errors)
+        v, e = fn()
+        del self.errors[n:]
+        if v is failed:
+            self.input = self.input.rewind(m)
+            if self.trackSpans:
+                self._dropSpans()
+            return True, self.input.nullError()
+        return failed, self.input.nullError()
+
+
+    def eatWhitespace(self):
+        """
+        Consume input until a non-whitespace character is reached.
+        """
+        i = self.input
+        if self.whitespaceIndex is not None and i.indexFor is not None:
+            return True, i.skipWhitespace(self.whitespaceIndex)
+        while True:
+            c, e = self.input.peek()
+            if c is failed or not c.isspace():
+                break
+            self.input = self.input.tail()
+        return True, e
+    rule_spaces = eatWhitespace
+
+
+    def pred(self, expr):
+        """
+        Call the given function, failing if it returns false.
+
+        @param expr: A callable of no arguments.
+        """
+        val, e = expr()
+        if val is failed:
+            return val, e
+        if not val:
+            return failed, e
+        return True, e
+
+
+    def listpattern(self, expr):
+        """
+        Call the given function, treating the next object on the stack as an
+        iterable to be used for input.
+
+        @param expr: A callable of no arguments.
+        """
+        source = self.input
+        v, e = self.rule_anything()
+        if v is failed:
+            return v, e
+        oldInput = self.input
+        try:
+            if source.yieldsCharacters:
+                raise TypeError("Characters are not iterable")
+            self.input = self.inputClass.fromIterable(v, self.memoClass)
+        except TypeError:
+            e = self.input.nullError()
+            e[1] = expected("an iterable")
+            return failed, e
+        try:
+            r, err = expr()
+            if r is failed:
+                return r, err
+            r, err = self.end()
+            if r is failed:
+                return r, err
+        finally:
+            self.input = oldInput
+        return v, e
+
+
+    def capture(self, fn):
+        """
+        Call the given function, and return the input it matched, as a slice
+        of the input rather than the values it produced.
+
+        @param fn: A callable of no arguments.
+        """
+        start = self.input.position
+        v, e = fn()
+        if v is failed:
+            return v, e
+        return self.input.slice(start, self.input.position), e
+
+
+    def token(self, tok):
+        """
+        Match and return the given string, consuming any preceding whitespace.
+        """
+        m = self.input.mark()
+        position, e = self._matchToken(tok)
+        if position is None:
+            return tok, e
+        self.input = self.input.rewind(m)
+        return failed, [position, expected("token", tok)]
+
+    rule_token = token
+
+
+    def letter(self):
+        """
+        Match a single letter.
+        """
+        x, e = self._matchCharacter(str.isalpha)
+        if x is failed:
+            return x, e or [self.input.position, expected("letter")]
+        return x, e
+
+    rule_letter = letter
+
+
+    def letterOrDigit(self):
+        """
+        Match a single alphanumeric character.
+        """
+        x, e = self._matchCharacter(_isLetterOrDigit)
+        if x is failed:
+            return x, e or [self.input.position, expected("letter or digit")]
+        return x, e
+
+    rule_letterOrDigit = letterOrDigit
+
+
+    def digit(self):
+        """
+        Match a single digit.
+        """
+        x, e = self._matchCharacter(str.isdigit)
+        if x is failed:
+            return x, e or [self.input.position, expected("digit")]
+        return x, e
+
+    rule_digit = digit
+
+
+    def charClass(self, name):
+        """
+        Match a single character in the named class of the grammar's
+        C{characterClasses}.
+        """
+        x, e = self._matchClass(name)
+        if x is failed:
+            return x, e or [self.input.position, expected(name)]
+        return x, e
+
+    rule_charClass = charClass
+
+
+    def charSet(self, members, negated, description):
+        """
+        Match a single character that is one of C{members}, or if
+        C{negated} one that isn't.
         """
-        @param string: The string to be parsed.
+        x, e = self._matchMember(members, negated)
+        if x is failed:
+            return x, e or [self.input.position,
+                            expected("character in", description)]
+        return x, e
 
-        @param globals: A dictionary of names to objects, for use in evaluating
-        embedded Python expressions.
+    rule_charSet = charSet
+
+
+    def charSetMany(self, members, negated, description, atLeastOne=False):
         """
-        self.input = InputStream.fromIterable(string)
-        self.locals = {}
-        if self.globals is None:
-            if globals is None:
-                self.globals = {}
-            else:
-                self.globals = globals
+        Match characters of a set for as long as the input has them,
+        collecting them into a list as L{many} would.
 
-        self.currentError = self.input.nullError()
+        @param atLeastOne: Whether to fail if there isn't one.
+        """
+        initial = []
+        if atLeastOne:
+            first = self.charSet(members, negated, description)
+            if first[0] is failed:
+                return first
+            initial.append(first)
+        return self._charSetRest(members, negated, description, initial)
 
-    def considerError(self, error):
-        if error and  error[0] > self.currentError[0]:
-            self.currentError = error
 
+    def recover(self, ruleName, sync):
+        """
+        Apply the named rule. If it fails anywhere but at the end of the
+        input, add its L{ParseError} to C{self.errors}, skip the input up to
+        and including the next item found in C{sync}, and succeed with
+        C{None}.
 
-    def superApply(self, ruleName, *args):
+        @param ruleName: The name of a rule that takes no arguments.
+        @param sync: The items that end a stretch of input to skip.
         """
-        Apply the named rule as defined on this object's superclass.
+        m = self.input.mark()
+        position = self.input.position
+        n = len(self.errors)
+        val, err = self._apply(getattr(self, "rule_"+ruleName), ruleName, ())
+        if val is not failed:
+            return val, err
+        self.input = self.input.rewind(m)
+        del self.errors[n:]
+        if self.trackSpans:
+            self._dropSpans()
+        x, _ = self.input.peek()
+        if x is failed:
+            return failed, err
+        e = self._recoveredError(position, ruleName, err)
+        if e is None:
+            return failed, err
+        self.errors.append(e)
+        while x is not failed:
+            self.input = self.input.tail()
+            if x in sync:
+                break
+            x, _ = self.input.peek()
+        return None, self.input.nullError()
 
-        @param ruleName: A rule name.
+    rule_recover = recover
+
+
+    def _recoveredError(self, position, ruleName, error):
         """
-        r = getattr(super(self.__class__, self), "rule_"+ruleName, None)
-        if r is not None:
-            self.input.setMemo(ruleName, None)
-            return self._apply(r, ruleName, args)
-        else:
-            raise NameError("No rule named '%s'" %(ruleName,))
+        Return the L{ParseError} for a rule that L{recover} applied and that
+        failed with the given error, or C{None} if that failure is the
+        detection of left recursion and mustn't be recovered from.
+        """
+        if error[0] is None:
+            return None
+        return ParseError(*error)
+
+
+
+class FastOMetaBase(SentinelOMetaBase):
+    """
+    Base class for grammars whose code is generated by
+    L{pymeta.builder.FastPythonWriter}: a L{SentinelOMetaBase} that tracks
+    no error information at all, so matching pays nothing for diagnostics.
+
+    When a rule applied with L{apply} fails, the input is parsed again from
+    where the rule started by an instance of C{detailedClass}, a version of
+    the grammar that does track errors, to raise the L{ParseError} it
+    reports. Subclasses that add methods used by the grammar's actions
+    should add them to C{detailedClass} too.
+    """
+    detailedClass = SentinelOMetaBase
 
     def apply(self, ruleName, *args):
         """
-        Apply the named rule, optionally with some arguments.
+        Apply the named rule, optionally with some arguments. If it fails,
+        the L{ParseError} raised comes from L{reparse}; if it matches, the
+        error returned with its value is a L{ReparsedError}, which reparses
+        only if it's read.
 
         @param ruleName: A rule name.
         """
         r = getattr(self, "rule_"+ruleName, None)
         if r is not None:
+            position = self.input.position
             val, err = self._apply(r, ruleName, args)
-            return val, ParseError(*err)
+            if val is failed:
+                return self.reparse(position, ruleName, *args)
+            return val, ReparsedError(self, position, ruleName, args)
 
         else:
             raise NameError("No rule named '%s'" %(ruleName,))
 
 
-    def _apply(self, rule, ruleName, args):
+    def regular(self, pattern, kind, fn):
         """
-        Apply a rule method to some args.
-        @param rule: A method of this object.
-        @param ruleName: The name of the rule invoked.
-        @param args: A sequence of arguments to it.
+        Match a regular part of the grammar in one step, with a L{Regular},
+        on input that can match one. Elsewhere, or if the grammar redefines
+        a builtin rule the pattern uses, call C{fn}, the part's own code.
+
+        @param pattern: A L{Regular}.
+        @param kind: What to return: C{"skip"} for nothing in particular,
+        C{"text"} for the string matched, C{"list"} for a list of its
+        characters, and C{"slice"} for the input matched, as from
+        L{capture}.
+        @param fn: A callable of no arguments.
         """
-        if args:
-            if rule.__code__.co_argcount - 1 != len(args):
-                for arg in args[::-1]:
-                    self.input = ArgInput(arg, self.input)
-                return rule()
-            else:
-                return rule(*args)
-        memoRec = self.input.getMemo(ruleName)
-        if memoRec is None:
-            oldPosition = self.input
-            lr = LeftRecursion()
-            memoRec = self.input.setMemo(ruleName, lr)
+        i = self.input
+        if i.matchRegular is None or not pattern.rules.isdisjoint(
+            self._redefinedRules()):
+            return fn()
+        start = i.position
+        end = i.matchRegular(pattern)
+        if end is None:
+            return failed, None
+        i.position = end
+        if kind == "skip":
+            return True, None
+        value = i.slice(start, end)
+        if kind == "slice":
+            return value, None
+        if not isinstance(value, str):
+            value = codecs.latin_1_decode(value)[0]
+        if kind == "list":
+            return list(value), None
+        return value, None
+
+
+    def _redefinedRules(self):
+        """
+        Return the builtin rules in L{regularRules} that this grammar's
+        class defines differently, found once per class.
+        """
+        cls = self.__class__
+        redefined = cls.__dict__.get("_redefined")
+        if redefined is None:
+            redefined = set([name for name in regularRules
+                             if getattr(cls, "rule_" + name) is not
+                             getattr(FastOMetaBase, "rule_" + name)])
+            cls._redefined = redefined
+        return redefined
 
-            #print "Calling", rule
-            try:
-                memoRec = self.input.setMemo(ruleName,
-                                             [rule(), self.input])
-            except ParseError:
-                #print "Failed", rule
-                raise
-            #print "Success", rule
-            if lr.detected:
-                sentinel = self.input
-                while True:
-                    try:
-                        self.input = oldPosition
-                        ans = rule()
-                        if (self.input == sentinel):
-                            break
 
-                        memoRec = oldPosition.setMemo(ruleName,
-                                                     [ans, self.input])
-                    except ParseError:
-                        break
-            self.input = oldPosition
+    def reparse(self, position, ruleName, *args):
+        """
+        Apply the named rule from the given position of the input with a
+        new instance of C{detailedClass}, and return its value and error.
+        Attributes set on this grammar since it was made, like the builder
+        a metagrammar's actions use, are set on that instance too.
 
-        elif isinstance(memoRec, LeftRecursion):
-            memoRec.detected = True
-            raise ParseError(None, None)
-        self.input = memoRec[1]
-        return memoRec[0]
+        @param position: The position in the input to start from.
+        @param ruleName: A rule name.
+        """
+        g = self.detailedClass(self.input.fork(position), self.globals)
+        for name, value in self.__dict__.items():
+            # Methods shadowed on this instance, like _apply when tracking
+            # spans, would apply rules to this grammar's input, not g's.
+            if getattr(value, "__self__", None) is not self:
+                g.__dict__.setdefault(name, value)
+        if self.memoWindow is not None:
+            g.input.memo.setWindow(self.memoWindow)
+        return g.apply(ruleName, *args)
+
+
+    def close(self):
+        """
+        Mark the end of the input of a grammar made with L{streaming}, and
+        parse the results that remain.
+
+        @return: A list of the results of each remaining application of the
+        rule.
+        """
+        self.input.close()
+        results = self._parseStream()
+        if self.input.position < self.input.length:
+            val, err = self.reparse(self.input.position, self.streamRule)
+            raise err
+        return results
 
 
-    def rule_anything(self):
+    def iterparse(self, ruleName, *args):
         """
-        Match a single item from the input of any kind.
+        Apply the named rule, which must end with a repetition, producing
+        each item of the repetition as soon as it matches. If matching
+        fails, the L{ParseError} comes from reparsing the rule from the
+        start.
+
+        @param ruleName: A rule name.
+
+        @return: An iterator of the values of the repetition's items.
         """
-        h, p = self.input.head()
-        self.input = self.input.tail()
-        return h, p
+        self.iterStart = (self.input.position, ruleName, args)
+        return SentinelOMetaBase.iterparse(self, ruleName, *args)
+
+
+    def _iterFailed(self, error):
+        """
+        Reparse the rule given to L{iterparse} to raise its L{ParseError}.
+        """
+        position, ruleName, args = self.iterStart
+        val, err = self.reparse(position, ruleName, *args)
+        raise err
+
 
     def exactly(self, wanted):
         """
@@ -368,16 +3606,30 @@ class OMetaBase(object):
         @param wanted: What to match.
         """
         i = self.input
-        val, p = self.input.head()
-        self.input = self.input.tail()
+        val, p = i.peek()
         if wanted == val:
-            return val, p
-        else:
-            self.input = i
-            raise ParseError(p[0], expected(None, wanted))
+            self.input = i.tail()
+            return val, None
+        return failed, None
 
     rule_exactly = exactly
 
+
+    def exactlyString(self, wanted):
+        """
+        Match a string of several characters, as a run of characters on
+        inputs read from a string or bytes and otherwise as a single item.
+
+        @param wanted: The string to match.
+        """
+        i = self.input
+        if i.matchLength is None and not i.isText:
+            return self.exactly(wanted)
+        if self._matchString(wanted)[0] is None:
+            return wanted, None
+        return failed, None
+
+
     def many(self, fn, *initial):
         """
         Call C{fn} until it fails to match the input. Collect the resulting
@@ -387,18 +3639,29 @@ class OMetaBase(object):
         @param initial: Initial values to populate the returned list with.
         """
         ans = []
-        e = None
         for x, e in initial:
+            if x is failed:
+                return x, None
             ans.append(x)
         while True:
-            try:
-                m = self.input
-                v, _ = fn()
-                ans.append(v)
-            except ParseError:
-                self.input = m
+            m = self.input.mark()
+            n = len(self.errors)
+            v, e = fn()
+            if v is failed:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
                 break
-        return ans, e
+            if v is failedCommitted:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+                return failed, None
+            ans.append(v)
+        return ans, None
+
 
     def _or(self, fns):
         """
@@ -407,205 +3670,164 @@ class OMetaBase(object):
 
         @param fns: A list of no-argument callables.
         """
-        errors = []
         for f in fns:
-            try:
-                m = self.input
-                ret, err = f()
-                errors.append(err)
-                return ret, joinErrors(errors)
-            except ParseError as e:
-                errors.append(e)
-                self.input = m
-        raise ParseError(*joinErrors(errors))
-
-
-    def _not(self, fn):
-        """
-        Call the given function. Raise ParseError iff it does not.
-
-        @param fn: A callable of no arguments.
-        """
-        m = self.input
-        try:
-            fn()
-        except ParseError as e:
-            self.input = m
-            return True, self.input.nullError()
-        else:
-            raise ParseError(*self.input.nullError())
-
-    def eatWhitespace(self):
-        """
-        Consume input until a non-whitespace character is reached.
-        """
-        while True:
-            try:
-                c, e = self.input.head()
-            except EOFError as e:
+            m = self.input.mark()
+            n = len(self.errors)
+            ret, err = f()
+            if ret is failed:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
+            elif ret is failedCommitted:
+                self.input = self.input.rewind(m)
+                del self.errors[n:]
+                if self.trackSpans:
+                    self._dropSpans()
                 break
-            t = self.input.tail()
-            if c.isspace():
-                self.input = t
             else:
-                break
-        return True, e
-    rule_spaces = eatWhitespace
+                return ret, None
+        return failed, None
 
 
-    def pred(self, expr):
+    def dispatch(self, table, fns):
         """
-        Call the given function, raising ParseError if it returns false.
+        Choose between alternatives as L{_or} would, but call only those
+        that a L{Dispatch} table, or a L{Prediction} from their first sets,
+        says can match the next item of input. A prediction for a grammar
+        that redefines a rule it depends on is ignored.
 
-        @param expr: A callable of no arguments.
+        @param table: A L{Dispatch} or L{Prediction}.
+        @param fns: A list of no-argument callables.
         """
-        val, e = expr()
-        if not val:
-            raise ParseError(*e)
+        valid = table.valid.get(self.__class__)
+        if valid is None:
+            valid = table.validFor(self.__class__, FastOMetaBase)
+        if not valid:
+            return self._or(fns)
+        if table.spaced:
+            m = self.input.mark()
+            self.eatWhitespace()
+            item, p = self.input.peek()
+            self.input = self.input.rewind(m)
         else:
-            return True, e
-
-    def listpattern(self, expr):
-        """
-        Call the given function, treating the next object on the stack as an
-        iterable to be used for input.
-
-        @param expr: A callable of no arguments.
-        """
-        v, e = self.rule_anything()
-        oldInput = self.input
+            item, p = self.input.peek()
+        if item is failed:
+            return self._or(fns)
         try:
-            self.input = InputStream.fromIterable(v)
+            candidates = table.table[item]
+        except KeyError:
+            candidates = table.candidates(item)
         except TypeError:
-            e = self.input.nullError()
-            e[1] = expected("an iterable")
-            raise ParseError(*e)
-        expr()
-        self.end()
-        self.input = oldInput
-        return v, e
-
-
-    def end(self):
-        """
-        Match the end of the stream.
-        """
-        return self._not(self.rule_anything)
+            return self._or(fns)
+        for n in candidates:
+            m = self.input.mark()
+            recovered = len(self.errors)
+            ret, err = fns[n]()
+            if ret is failed:
+                self.input = self.input.rewind(m)
+                del self.errors[recovered:]
+                if self.trackSpans:
+                    self._dropSpans()
+            elif ret is failedCommitted:
+                self.input = self.input.rewind(m)
+                del self.errors[recovered:]
+                if self.trackSpans:
+                    self._dropSpans()
+                break
+            else:
+                return ret, None
+        return failed, None
 
-    rule_end = end
 
-    def lookahead(self, f):
+    def _not(self, fn):
         """
-        Execute the given callable, rewinding the stream no matter whether it
-        returns successfully or not.
+        Call the given function. Fail iff it does not.
 
-        @param f: A callable of no arguments.
+        @param fn: A callable of no arguments.
         """
-        try:
-            m = self.input
-            x = f()
-            return x
-        finally:
-            self.input = m
+        m = self.input.mark()
+        n = len(self.errors)
+        v, e = fn()
+        del self.errors[n:]
+        if v is failed:
+            self.input = self.input.rewind(m)
+            if self.trackSpans:
+                self._dropSpans()
+            return True, None
+        return failed, None
 
 
     def token(self, tok):
         """
         Match and return the given string, consuming any preceding whitespace.
         """
-        m = self.input
-        try:
-            self.eatWhitespace()
-            for c in tok:
-                v, e = self.exactly(c)
-            return tok, e
-        except ParseError as e:
-            self.input = m
-            
-            raise ParseError(e[0], expected("token", tok))
+        m = self.input.mark()
+        if self._matchToken(tok)[0] is None:
+            return tok, None
+        self.input = self.input.rewind(m)
+        return failed, None
 
     rule_token = token
 
+
     def letter(self):
         """
         Match a single letter.
         """
-        x, e = self.rule_anything()
-        if x.isalpha():
-            return x, e
-        else:
-            e[1] = expected("letter")
-            raise ParseError(*e)
+        return self._matchCharacter(str.isalpha)[0], None
 
     rule_letter = letter
 
+
     def letterOrDigit(self):
         """
         Match a single alphanumeric character.
         """
-        x, e = self.rule_anything()
-        if x.isalnum() or x == '_':
-            return x, e
-        else:
-            e[1] = expected("letter or digit")
-            raise ParseError(*e)
+        return self._matchCharacter(_isLetterOrDigit)[0], None
 
     rule_letterOrDigit = letterOrDigit
 
+
     def digit(self):
         """
         Match a single digit.
         """
-        x, e = self.rule_anything()
-        if x.isdigit():
-            return x, e
-        else:
-            e[1] = expected("digit")
-            raise ParseError(*e)
+        return self._matchCharacter(str.isdigit)[0], None
 
     rule_digit = digit
 
 
-    def pythonExpr(self, endChars="\r\n"):
+    def charClass(self, name):
         """
-        Extract a Python expression from the input and return it.
+        Match a single character in the named class of the grammar's
+        C{characterClasses}.
+        """
+        return self._matchClass(name)[0], None
 
-        @arg endChars: A set of characters delimiting the end of the expression.
+    rule_charClass = charClass
+
+
+    def charSet(self, members, negated, description):
         """
-        delimiters = { "(": ")", "[": "]", "{": "}"}
-        stack = []
-        expr = []
-        lastc = None
-        endchar = None
-        while True:
-            try:
-                c, e = self.rule_anything()
-            except ParseError as e:
-                endchar = None
-                break
-            if c in endChars and len(stack) == 0:
-                endchar = c
-                break
-            else:
-                expr.append(c)
-                if c in delimiters:
-                    stack.append(delimiters[c])
-                elif len(stack) > 0 and c == stack[-1]:
-                    stack.pop()
-                elif c in list(delimiters.values()):
-                    raise ParseError(self.input.position, expected("Python expression"))
-                elif c in "\"'":
-                    while True:
-                        strc, stre = self.rule_anything()
-                        expr.append(strc)
-                        slashcount = 0
-                        while strc == '\\':
-                            strc, stre = self.rule_anything()
-                            expr.append(strc)
-                            slashcount += 1
-                        if strc == c and slashcount % 2 == 0:
-                            break
-            
-        if len(stack) > 0:
-            raise ParseError(self.input.position, expected("Python expression"))
-        return (''.join(expr).strip(), endchar), e
+        Match a single character that is one of C{members}, or if
+        C{negated} one that isn't.
+        """
+        return self._matchMember(members, negated)[0], None
+
+    rule_charSet = charSet
+
+
+    def _recoveredError(self, position, ruleName, error):
+        """
+        Return the L{ParseError} for a rule that L{recover} applied and that
+        failed, found by reparsing it, or C{None} if that failure is the
+        detection of left recursion and mustn't be recovered from.
+        """
+        if error is not None and error[0] is None:
+            return None
+        try:
+            self.reparse(position, ruleName)
+        except ParseError as e:
+            return e
+        return None
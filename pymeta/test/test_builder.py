@@ -1,7 +1,9 @@
 from textwrap import dedent
 from twisted.trial import unittest
 
-from pymeta.builder import TreeBuilder, writePython
+from pymeta.builder import TreeBuilder, PythonWriter, SentinelPythonWriter
+from pymeta.builder import FastPythonWriter
+from pymeta.builder import writePython
 
 def dd(txt):
     return dedent(txt).strip()
@@ -35,6 +37,19 @@ class PythonWriterTests(unittest.TestCase):
                             """))
 
 
+    def test_exactlyString(self):
+        """
+        Strings of several characters are matched with 'exactlyString'.
+        """
+        x = self.builder.exactly("xyz")
+        self.assertEqual(writePython(x),
+                         dd("""
+                            _G_exactly_1, lastError = self.exactlyString('xyz')
+                            self.considerError(lastError)
+                            _G_exactly_1
+                            """))
+
+
 
     def test_apply(self):
         """
@@ -125,6 +140,7 @@ class PythonWriterTests(unittest.TestCase):
                                self.builder.exactly("y")])
         self.assertEqual(writePython(xy),
                          dd("""
+                            _G_dispatch_1 = Dispatch(['x', 'y'])
                             def _G_or_1():
                                 _G_exactly_1, lastError = self.exactly('x')
                                 self.considerError(lastError)
@@ -133,11 +149,151 @@ class PythonWriterTests(unittest.TestCase):
                                 _G_exactly_1, lastError = self.exactly('y')
                                 self.considerError(lastError)
                                 return (_G_exactly_1, self.currentError)
+                            _G_or_3, lastError = self.dispatch(_G_dispatch_1, [_G_or_1, _G_or_2])
+                            self.considerError(lastError)
+                            _G_or_3
+                            """))
+
+
+    def test_orApply(self):
+        """
+        A choice with an alternative that doesn't start with a string
+        literal calls self._or, trying every alternative.
+        """
+
+        xy = self.builder._or([self.builder.exactly("x"),
+                               self.builder.apply("y", "main")])
+        self.assertEqual(writePython(xy),
+                         dd("""
+                            def _G_or_1():
+                                _G_exactly_1, lastError = self.exactly('x')
+                                self.considerError(lastError)
+                                return (_G_exactly_1, self.currentError)
+                            def _G_or_2():
+                                _G_apply_1, lastError = self._apply(self.rule_y, "y", [])
+                                self.considerError(lastError)
+                                return (_G_apply_1, self.currentError)
+                            _G_or_3, lastError = self._or([_G_or_1, _G_or_2])
+                            self.considerError(lastError)
+                            _G_or_3
+                            """))
+
+
+    def test_dispatch(self):
+        """
+        A choice whose alternatives all start with string literals calls
+        self.dispatch with a table of them, made once when the grammar's
+        module is loaded.
+        """
+        x = self.builder._or([
+                self.builder.sequence([self.builder.exactly("x"),
+                                       self.builder.action("1")]),
+                self.builder.bind(self.builder.exactly("yz"), "a")])
+        self.assertEqual(writePython(x),
+                         dd("""
+                            _G_dispatch_1 = Dispatch(['x', 'yz'])
+                            def _G_or_1():
+                                _G_exactly_1, lastError = self.exactly('x')
+                                self.considerError(lastError)
+                                _G_python_2, lastError = eval('1', self.globals, _locals), None
+                                self.considerError(lastError)
+                                return (_G_python_2, self.currentError)
+                            def _G_or_2():
+                                _G_exactly_1, lastError = self.exactlyString('yz')
+                                self.considerError(lastError)
+                                _locals['a'] = _G_exactly_1
+                                return (_locals['a'], self.currentError)
+                            _G_or_3, lastError = self.dispatch(_G_dispatch_1, [_G_or_1, _G_or_2])
+                            self.considerError(lastError)
+                            _G_or_3
+                            """))
+
+
+    def test_factor(self):
+        """
+        What consecutive alternatives of a choice start with is matched once,
+        followed by a choice between the rest of them.
+        """
+        x = self.builder._or([
+                self.builder.sequence([
+                        self.builder.bind(self.builder.apply("digit", "main"),
+                                          "d"),
+                        self.builder.exactly("a"),
+                        self.builder.action("1")]),
+                self.builder.sequence([
+                        self.builder.bind(self.builder.apply("digit", "main"),
+                                          "d"),
+                        self.builder.exactly("b")]),
+                self.builder.exactly("c")])
+        self.assertEqual(writePython(x),
+                         dd("""
+                            _G_dispatch_1 = Dispatch(['a', 'b'])
+                            def _G_or_1():
+                                _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+                                self.considerError(lastError)
+                                _locals['d'] = _G_apply_1
+                                def _G_or_2():
+                                    _G_exactly_1, lastError = self.exactly('a')
+                                    self.considerError(lastError)
+                                    _G_python_2, lastError = eval('1', self.globals, _locals), None
+                                    self.considerError(lastError)
+                                    return (_G_python_2, self.currentError)
+                                def _G_or_3():
+                                    _G_exactly_1, lastError = self.exactly('b')
+                                    self.considerError(lastError)
+                                    return (_G_exactly_1, self.currentError)
+                                _G_or_4, lastError = self.dispatch(_G_dispatch_1, [_G_or_2, _G_or_3])
+                                self.considerError(lastError)
+                                return (_G_or_4, self.currentError)
+                            def _G_or_2():
+                                _G_exactly_1, lastError = self.exactly('c')
+                                self.considerError(lastError)
+                                return (_G_exactly_1, self.currentError)
                             _G_or_3, lastError = self._or([_G_or_1, _G_or_2])
                             self.considerError(lastError)
                             _G_or_3
                             """))
 
+
+    def test_factorUnsafe(self):
+        """
+        Prefixes that do more than match input, that the rest of an
+        alternative binds names of again, or that are all of an alternative
+        aren't factored out, and neither is anything in a choice with a cut.
+        """
+        b = self.builder
+        def unfactored(x):
+            class Unfactored(PythonWriter):
+                factorChoices = False
+            return writePython(x) == writePython(x, Unfactored)
+        apply = lambda name, *args: b.apply(name, "main", *args)
+        self.assertTrue(unfactored(b._or([
+                        b.sequence([b.action("f()"), b.exactly("a")]),
+                        b.sequence([b.action("f()"), b.exactly("b")])])))
+        self.assertTrue(unfactored(b._or([
+                        b.sequence([apply("rule", b.expr("x")), b.exactly("a")]),
+                        b.sequence([apply("rule", b.expr("x")),
+                                    b.exactly("b")])])))
+        self.assertTrue(unfactored(b._or([
+                        b.sequence([b.bind(apply("letter"), "x"),
+                                    b.bind(apply("digit"), "x"),
+                                    b.exactly("a")]),
+                        b.sequence([b.bind(apply("letter"), "x"),
+                                    b.exactly("b")])])))
+        self.assertTrue(unfactored(b._or([
+                        apply("letter"),
+                        b.sequence([apply("letter"), b.exactly("b")])])))
+        self.assertTrue(unfactored(b._or([
+                        b.sequence([apply("letter"), b.cut(),
+                                    b.exactly("a")]),
+                        b.sequence([apply("letter"), b.exactly("b")])])))
+        self.assertFalse(unfactored(b._or([
+                        b.sequence([apply("token", b.expr("'x'")),
+                                    b.exactly("a")]),
+                        b.sequence([apply("token", b.expr("'x'")),
+                                    b.exactly("b")])])))
+
+
     def test_singleOr(self):
         """
         Test code generation for a sequence of alternatives.
@@ -276,6 +432,26 @@ class PythonWriterTests(unittest.TestCase):
                             _G_python_1
                             """))
 
+
+    def test_constant(self):
+        """
+        Constants are written into the code as literals, and code that
+        signals failure with a sentinel doesn't check them.
+        """
+        x = self.builder.constant("\n")
+        self.assertEqual(writePython(x),
+                         dd("""
+                            _G_constant_1, lastError = '\\n', None
+                            self.considerError(lastError)
+                            _G_constant_1
+                            """))
+        self.assertEqual(writePython(x, SentinelPythonWriter),
+                         dd("""
+                            _G_constant_1, lastError = '\\n', None
+                            self.considerError(lastError)
+                            _G_constant_1
+                            """))
+
     def test_listpattern(self):
         """
         Test code generation for list patterns.
@@ -293,6 +469,90 @@ class PythonWriterTests(unittest.TestCase):
                             """))
 
 
+    def test_capture(self):
+        """
+        Test code generation for captures.
+        """
+        x = self.builder.capture(self.builder.many(self.builder.exactly("x")))
+        self.assertEqual(writePython(x),
+                         dd("""
+                            def _G_capture_1():
+                                def _G_many_1():
+                                    _G_exactly_1, lastError = self.exactly('x')
+                                    self.considerError(lastError)
+                                    return (_G_exactly_1, self.currentError)
+                                _G_many_2, lastError = self.many(_G_many_1)
+                                self.considerError(lastError)
+                                return (_G_many_2, self.currentError)
+                            _G_capture_2, lastError = self.capture(_G_capture_1)
+                            self.considerError(lastError)
+                            _G_capture_2
+                            """))
+
+
+    def test_charSet(self):
+        """
+        Character sets compile to a membership test against a constant,
+        defined once at the top of the module, and their repetitions to a
+        single scan. Ranges are merged, and large sets are kept as ranges.
+        """
+        x = self.builder.sequence([
+                self.builder.charSet([("a", "c"), ("b", "d"), ("_", "_")],
+                                     False),
+                self.builder.many1(self.builder.charSet([("0", "9")], True)),
+                self.builder.many(self.builder.charSet([("a", "d"),
+                                                        ("_", "_")], False)),
+                self.builder.charSet([(u"\u4e00", u"\u9fff")], False)])
+        self.assertEqual(writePython(x),
+                         dd("""
+                            _G_members_1 = frozenset('_abcd')
+                            _G_members_2 = frozenset('0123456789')
+                            _G_members_3 = CharRanges([('\u4e00', '\u9fff')])
+                            _G_charset_1, lastError = self.charSet(_G_members_1, False, '{_a-d}')
+                            self.considerError(lastError)
+                            _G_many1_2, lastError = self.charSetMany(_G_members_2, True, '{^0-9}', True)
+                            self.considerError(lastError)
+                            _G_many_3, lastError = self.charSetMany(_G_members_1, False, '{_a-d}')
+                            self.considerError(lastError)
+                            _G_charset_4, lastError = self.charSet(_G_members_3, False, '{\u4e00-\u9fff}')
+                            self.considerError(lastError)
+                            _G_charset_4
+                            """))
+
+
+    def test_cut(self):
+        """
+        Test code generation for cuts. In an alternative, the code after the
+        cut is run through self.committed().
+        """
+        x = self.builder._or([
+                self.builder.sequence([self.builder.exactly("x"),
+                                       self.builder.cut(),
+                                       self.builder.exactly("y")]),
+                self.builder.exactly("z")])
+        self.assertEqual(writePython(x),
+                         dd("""
+                            _G_dispatch_1 = Dispatch(['x', 'z'])
+                            def _G_or_1():
+                                _G_exactly_1, lastError = self.exactly('x')
+                                self.considerError(lastError)
+                                _G_cut_2, lastError = self.cut()
+                                self.considerError(lastError)
+                                def _G_cut_4():
+                                    _G_exactly_3, lastError = self.exactly('y')
+                                    self.considerError(lastError)
+                                    return (_G_exactly_3, self.currentError)
+                                return self.committed(_G_cut_4)
+                            def _G_or_2():
+                                _G_exactly_1, lastError = self.exactly('z')
+                                self.considerError(lastError)
+                                return (_G_exactly_1, self.currentError)
+                            _G_or_3, lastError = self.dispatch(_G_dispatch_1, [_G_or_1, _G_or_2])
+                            self.considerError(lastError)
+                            _G_or_3
+                            """))
+
+
     def test_rule(self):
         """
         Test generation of entire rules.
@@ -310,6 +570,45 @@ class PythonWriterTests(unittest.TestCase):
                             """))
 
 
+    def test_iterRule(self):
+        """
+        Rules whose value comes from a trailing repetition also get a method
+        for L{OMetaBase.iterparse}, which matches what comes before the
+        repetition and returns the function matching one item of it.
+        """
+
+        x = self.builder.rule("foo", self.builder.sequence([
+                    self.builder.exactly("x"),
+                    self.builder.many1(self.builder.exactly("y"))]))
+        self.assertEqual(writePython(x),
+                         dd("""
+                            def rule_foo(self):
+                                _locals = {'self': self}
+                                self.locals['foo'] = _locals
+                                _G_exactly_1, lastError = self.exactly('x')
+                                self.considerError(lastError)
+                                def _G_many1_2():
+                                    _G_exactly_1, lastError = self.exactly('y')
+                                    self.considerError(lastError)
+                                    return (_G_exactly_1, self.currentError)
+                                _G_many1_3, lastError = self.many(_G_many1_2, _G_many1_2())
+                                self.considerError(lastError)
+                                return (_G_many1_3, self.currentError)
+
+
+                            def iter_foo(self):
+                                _locals = {'self': self}
+                                self.locals['foo'] = _locals
+                                _G_exactly_1, lastError = self.exactly('x')
+                                self.considerError(lastError)
+                                def _G_many1_2():
+                                    _G_exactly_1, lastError = self.exactly('y')
+                                    self.considerError(lastError)
+                                    return (_G_exactly_1, self.currentError)
+                                return (_G_many1_2, True)
+                            """))
+
+
     def test_grammar(self):
         """
         Test generation of an entire grammar.
@@ -335,3 +634,182 @@ class PythonWriterTests(unittest.TestCase):
                                     self.considerError(lastError)
                                     return (_G_exactly_1, self.currentError)
                             """))
+
+
+
+class SentinelPythonWriterTests(unittest.TestCase):
+    """
+    Tests for generating Python source that signals failure by returning a
+    sentinel.
+    """
+
+    def setUp(self):
+        self.builder = TreeBuilder("BuilderTest")
+
+
+    def test_failure(self):
+        """
+        Each expression that can fail is followed by a check of its value
+        that returns the failure. Embedded Python and cuts aren't checked.
+        """
+        x = self.builder._or([
+                self.builder.sequence([self.builder.exactly("x"),
+                                       self.builder.cut(),
+                                       self.builder.action("y")]),
+                self.builder.apply("z", "main")])
+        self.assertEqual(writePython(x, SentinelPythonWriter),
+                         dd("""
+                            def _G_or_1():
+                                _G_exactly_1, lastError = self.exactly('x')
+                                if _G_exactly_1 is failed:
+                                    return failed, lastError
+                                self.considerError(lastError)
+                                _G_cut_2, lastError = self.cut()
+                                self.considerError(lastError)
+                                def _G_cut_4():
+                                    _G_python_3, lastError = eval('y', self.globals, _locals), None
+                                    self.considerError(lastError)
+                                    return (_G_python_3, self.currentError)
+                                return self.committed(_G_cut_4)
+                            def _G_or_2():
+                                _G_apply_1, lastError = self._apply(self.rule_z, "z", [])
+                                if _G_apply_1 is failed:
+                                    return failed, lastError
+                                self.considerError(lastError)
+                                return (_G_apply_1, self.currentError)
+                            _G_or_3, lastError = self._or([_G_or_1, _G_or_2])
+                            if _G_or_3 is failed:
+                                return failed, lastError
+                            self.considerError(lastError)
+                            _G_or_3
+                            """))
+
+
+    def test_fast(self):
+        """
+        Code generated for grammars that track no errors doesn't call
+        considerError, and returns no error with its values.
+        """
+        x = self.builder.many(self.builder.apply("z", "main"))
+        self.assertEqual(writePython(x, FastPythonWriter),
+                         dd("""
+                            def _G_many_1():
+                                _G_apply_1, lastError = self._apply(self.rule_z, "z", [])
+                                if _G_apply_1 is failed:
+                                    return failed, None
+                                return (_G_apply_1, None)
+                            _G_many_2, lastError = self.many(_G_many_1)
+                            if _G_many_2 is failed:
+                                return failed, None
+                            _G_many_2
+                            """))
+
+
+    def test_regular(self):
+        """
+        Regular expressions, such as captures of repeated builtin rules, are
+        matched by a precompiled pattern, falling back to the code for the
+        expression on input that can't be matched by one.
+        """
+        x = self.builder.capture(self.builder.many1(
+                self.builder.apply("letterOrDigit", "main")))
+        writer = FastPythonWriter(x)
+        writer.lowerRegular = True
+        self.assertEqual(writer.output(),
+                         dd("""
+                            _G_pattern_1 = Regular(['Many1', ['Apply', 'letterOrDigit', 'main', ()]])
+                            def _G_regular_1():
+                                def _G_capture_1():
+                                    def _G_many1_1():
+                                        _G_apply_1, lastError = self._apply(self.rule_letterOrDigit, "letterOrDigit", [])
+                                        if _G_apply_1 is failed:
+                                            return failed, None
+                                        return (_G_apply_1, None)
+                                    _G_many1_2, lastError = self.many(_G_many1_1, _G_many1_1())
+                                    if _G_many1_2 is failed:
+                                        return failed, None
+                                    return (_G_many1_2, None)
+                                _G_capture_2, lastError = self.capture(_G_capture_1)
+                                if _G_capture_2 is failed:
+                                    return failed, None
+                                return (_G_capture_2, None)
+                            _G_regular_2, lastError = self.regular(_G_pattern_1, 'slice', _G_regular_1)
+                            if _G_regular_2 is failed:
+                                return failed, None
+                            _G_regular_2
+                            """))
+
+
+    def test_predict(self):
+        """
+        A choice between alternatives that can't all start with the same
+        items calls self.dispatch with a L{Prediction} of which can match
+        each item, from what each alternative can start with.
+        """
+        x = self.builder._or([
+                self.builder.sequence([self.builder.apply("digit", "main"),
+                                       self.builder.action("1")]),
+                self.builder.apply("anything", "main")])
+        self.assertEqual(writePython(x, FastPythonWriter),
+                         dd("""
+                            _G_prediction_1 = Prediction([FirstSet([], [], ['digit']), None], False, [], ['anything', 'digit'], globals(), None)
+                            def _G_or_1():
+                                _G_apply_1, lastError = self._apply(self.rule_digit, "digit", [])
+                                if _G_apply_1 is failed:
+                                    return failed, None
+                                _G_python_2, lastError = eval('1', self.globals, _locals), None
+                                return (_G_python_2, None)
+                            def _G_or_2():
+                                _G_apply_1, lastError = self._apply(self.rule_anything, "anything", [])
+                                if _G_apply_1 is failed:
+                                    return failed, None
+                                return (_G_apply_1, None)
+                            _G_or_3, lastError = self.dispatch(_G_prediction_1, [_G_or_1, _G_or_2])
+                            if _G_or_3 is failed:
+                                return failed, None
+                            _G_or_3
+                            """))
+
+
+    def test_predictRules(self):
+        """
+        What applications of the grammar's rules can start with comes from
+        the rules, and choices whose alternatives skip whitespace first are
+        told apart by what follows it.
+        """
+        b = self.builder
+        g = b.makeGrammar([
+                b.rule("kw", b._or([
+                            b.apply("token", "kw", b.expr('"if"')),
+                            b.sequence([b.apply("spaces", "kw"),
+                                        b.apply("name", "kw")])])),
+                b.rule("name", b.many1(b.apply("letter", "name")))])
+        self.assertIn("_G_prediction_1 = Prediction([FirstSet(['i'], [], []), "
+                      "FirstSet([], [], ['letter'])], True, ['name'], "
+                      "['letter', 'spaces', 'token'], globals(), 'BuilderTest')",
+                      writePython(g, FastPythonWriter).splitlines())
+
+
+    def test_factorOnce(self):
+        """
+        L{FastPythonWriter} factors the prefixes out of a choice's
+        alternatives once, whether or not it predicts the choice.
+        """
+        from pymeta import builder
+        factored = []
+        def factorPrefixes(exprs):
+            factored.append(exprs)
+            return original(exprs)
+        original = builder._factorPrefixes
+        self.patch(builder, "_factorPrefixes", factorPrefixes)
+        b = self.builder
+        x = b._or([b.sequence([b.exactly("a"), b.apply("digit", "main")]),
+                   b.sequence([b.exactly("a"), b.apply("letter", "main")])])
+        for predictChoices in [True, False]:
+            class Writer(FastPythonWriter):
+                pass
+            Writer.predictChoices = predictChoices
+            del factored[:]
+            writePython(x, Writer)
+            self.assertEqual(factored, [x[1], [b.apply("digit", "main"),
+                                               b.apply("letter", "main")]])
@@ -1,8 +1,12 @@
+import sys
 from textwrap import dedent
 from twisted.trial import unittest
-from pymeta.runtime import ParseError, OMetaBase, EOFError, expected
+from pymeta.runtime import ParseError, OMetaBase, EOFError, expected, CursorInput
+from pymeta.runtime import InputStream, SentinelOMetaBase, FastOMetaBase
 from pymeta.boot import BootOMetaGrammar
-from pymeta.builder import TreeBuilder, moduleFromGrammar
+from pymeta.builder import TreeBuilder, PythonWriter, SentinelPythonWriter
+from pymeta.builder import FastPythonWriter, writePython
+from pymeta.builder import moduleFromGrammar
 
 class HandyWrapper(object):
     """
@@ -40,6 +44,14 @@ class HandyWrapper(object):
 
 
 
+class CursorOMetaBase(OMetaBase):
+    """
+    Grammar base class that parses with L{CursorInput}.
+    """
+    inputClass = CursorInput
+
+
+
 class OMetaTestCase(unittest.TestCase):
     """
     Tests of OMeta grammar compilation.
@@ -373,6 +385,65 @@ class OMetaTestCase(unittest.TestCase):
            """)
         self.assertEqual(g.interp([["Foo", 1, 2]]), 3)
 
+
+    def test_multiCharacterString(self):
+        """
+        Strings in double quotes of several characters match runs of
+        characters in input read from a string, whatever the input engine,
+        and single items in other input.
+        """
+        g = self.compile("""
+              kw ::= ("letrec" | "let"):k <spaces> <letter>+ => k
+              """)
+        self.assertEqual(g.kw("let x"), "let")
+        self.assertEqual(g.kw("letrec f"), "letrec")
+        self.assertEqual(g.kw(["let", " ", "x"]), "let")
+        e = self.assertRaises(ParseError, g.kw, "lex")
+        self.assertEqual(e.position, 2)
+
+
+    def test_fromFileCapturedToken(self):
+        """
+        A grammar reading a file through fromFile can match the input it
+        captured earlier again, as a token.
+        """
+        g = self.compile("""
+              name ::= <spaces> $(<letter>+)
+              pair ::= <name>:n <token n> => n
+              """)
+        path = self.mktemp()
+        f = open(path, 'wb')
+        f.write(b"ab ab ac ad")
+        f.close()
+        o = g.klass.fromFile(path)
+        self.assertEqual(bytes(o.apply("pair")[0]), b"ab")
+        self.assertEqual(o.input.position, 5)
+        e = self.assertRaises(ParseError, o.apply, "pair")
+        self.assertEqual(e.position, 10)
+
+
+    def test_fromFileCaptures(self):
+        """
+        Captures of input read through fromFile are the bytes matched, and
+        a grammar of nested tags that decodes them parses the whole file.
+        """
+        g = self.compile("""
+              name ::= $(<letter>+):n => n.tobytes().decode('latin-1')
+              text ::= $((~('<') <anything>)+):t => t.tobytes().decode('latin-1')
+              tag ::= '<' <name>:n '>' <html>:c '<' '/' <token n> '>' => [n, c]
+              html ::= (<text> | <tag>)*
+              """)
+        path = self.mktemp()
+        f = open(path, 'wb')
+        f.write(b"<p>caf\xe9 <b>au</b> lait</p><i></i>")
+        f.close()
+        o = g.klass.fromFile(path)
+        self.assertEqual(o.apply("html")[0],
+                         [["p", [u"caf\xe9 ", ["b", ["au"]], " lait"]],
+                          ["i", []]])
+        self.assertEqual(o.apply("end")[0], True)
+
+
     def test_argEscape(self):
         """
         Regression test for bug #239344.
@@ -398,6 +469,341 @@ class OMetaTestCase(unittest.TestCase):
         self.assertEqual(g.bits('0110110'), '0110110')
 
 
+    def test_spans(self):
+        """
+        Grammars with C{trackSpans} set record the span of input each rule
+        application's value was matched from.
+        """
+        g = self.compile("""
+              num ::= <spaces> <digit>+:ds => [int(''.join(ds))]
+              pair ::= <num>:a <token ','> <num>:b => [a, b]
+              """)
+        Grammar = type("Grammar", (g.klass,), {"trackSpans": True})
+        o = Grammar("12,\n 345")
+        pair, err = o.apply("pair")
+        self.assertEqual(pair, [[12], [345]])
+        self.assertEqual(o.span(pair), (0, 8))
+        self.assertEqual(o.span(pair[0]), (0, 2))
+        self.assertEqual(o.span(pair[1]), (3, 8))
+        self.assertEqual(o.span([12]), None)
+        self.assertEqual(o.lineSpan(pair[1], "12,\n 345"), ((1, 3), (2, 4)))
+        o = g.klass("12")
+        self.assertEqual(o.apply("num")[0], [12])
+        self.assertNotIn("_apply", vars(o))
+
+
+    def test_spansBacktracked(self):
+        """
+        The spans of values from an alternative that's backtracked out of
+        are forgotten, and those of a rule application reused from the
+        memo are recorded again.
+        """
+        g = self.compile("""
+              num ::= <spaces> <digit>+:ds => [int(''.join(ds))]
+              pair ::= <num>:a <token ','> <num>:b => [a, b]
+              item ::= <pair>:p '!' => p
+                     | <num>:a <token ','> <num>:b ';' => (a, b)
+              again ::= <pair>:p '!' => p
+                      | <spaces> <pair>:p ';' => p
+              """)
+        Grammar = type("Grammar", (g.klass,), {"trackSpans": True})
+        o = Grammar("12, 345;")
+        item, err = o.apply("item")
+        self.assertEqual(item, ([12], [345]))
+        self.assertEqual(o.span(item[0]), (0, 2))
+        self.assertEqual(o.span(item[1]), (3, 7))
+        self.assertNotIn([[12], [345]],
+                         [rec[0] for rec in o.spans.values()])
+        o = Grammar("12, 345;")
+        pair, err = o.apply("again")
+        self.assertEqual(o.span(pair), (0, 7))
+        self.assertEqual(o.span(pair[0]), (0, 2))
+        self.assertEqual(o.span(pair[1]), (3, 7))
+
+
+    def test_lineSpanInputs(self):
+        """
+        L{OMetaBase.lineSpan} finds lines in the text of string and bytes
+        input, whatever the input engine, without being given it. Input
+        not read from a string has no lines.
+        """
+        g = self.compile("""
+              num ::= <spaces> <digit>+:ds => [int(''.join(ds))]
+              pair ::= <num>:a <token ','> <num>:b => [a, b]
+              """)
+        for inputClass, texts in [
+            (InputStream, ["12,\n 345"]),
+            (CursorInput, ["12,\n 345", b"12,\n 345",
+                           memoryview(b"12,\n 345")])]:
+            Grammar = type("Grammar", (g.klass,), {"trackSpans": True,
+                                                   "inputClass": inputClass})
+            for text in texts:
+                o = Grammar(text)
+                pair, err = o.apply("pair")
+                self.assertEqual(o.lineSpan(pair[1]), ((1, 3), (2, 4)))
+            o = Grammar([["1"]])
+            o.spans[id(pair)] = (pair, 0, 1)
+            self.assertRaises(ValueError, o.lineSpan, pair)
+
+
+    def test_recover(self):
+        """
+        C{recover} records the error of a rule that fails, skips past the
+        next sync item and carries on, so one parse finds every error.
+        """
+        g = self.compile("""
+              stmt ::= <letter>:n <token '='> <spaces> <digit>+:ds ';' => (n, len(ds))
+              stmts ::= (<spaces> <recover "stmt" ";">)*:ss <spaces> <end> => ss
+              """)
+        o = g.klass("a = 1; b = ; c = 33;  d = x")
+        self.assertEqual(o.apply("stmts")[0], [("a", 1), None, ("c", 2), None])
+        self.assertEqual([e.position for e in o.errors], [11, 26])
+        self.assertEqual(o.errors[0].error, expected("digit"))
+        o = g.klass("a = 1;")
+        self.assertEqual(o.apply("stmts")[0], [("a", 1)])
+        self.assertEqual(o.errors, [])
+
+
+    def test_recoverBacktracked(self):
+        """
+        Errors recovered from by an alternative that goes on to fail are
+        dropped when the next alternative is tried. A rule application
+        reused from the memo reports the errors it recovered from again.
+        """
+        g = self.compile("""
+              stmt ::= <letter>:n <token '='> <spaces> <digit>+:ds ';' => (n, len(ds))
+              stmts ::= (<spaces> <recover "stmt" ";">)*:ss <spaces> => ss
+              prog ::= <stmts>:ss '!' => ss
+                     | <anything>*:xs => len(xs)
+              again ::= <stmts>:ss '!' => ss
+                      | <stmts>:ss <end> => ss
+              """)
+        o = g.klass("a = ; b = 1;")
+        self.assertEqual(o.apply("prog")[0], 12)
+        self.assertEqual(o.errors, [])
+        o = g.klass("a = ; b = 1;")
+        self.assertEqual(o.apply("again")[0], [None, ("b", 1)])
+        self.assertEqual([e.position for e in o.errors], [4])
+
+
+    def test_cut(self):
+        """
+        Once a cut is passed, the alternative it's in is committed to: if it
+        fails, the alternatives after it aren't tried.
+        """
+        g = self.compile("""
+        stmt ::= ('x' ^ '=' <digit>:d => int(d)
+                 |<letter>:c => c.upper())
+        """)
+        self.assertEqual(g.stmt("x=1"), 1)
+        self.assertEqual(g.stmt("y"), 'Y')
+        e = self.assertRaises(ParseError, g.stmt, "x")
+        self.assertEqual(e.position, 1)
+
+
+    def test_capture(self):
+        """
+        C{$(expr)} matches expr and returns the input it matched, rather
+        than expr's value.
+        """
+        g = self.compile("""
+        name ::= $(<letter> <letterOrDigit>*)
+        pair ::= $(<name> (',' <name>)*):ns ';' => ns
+        """)
+        self.assertEqual(g.name("abc1"), "abc1")
+        self.assertEqual(g.pair("a,bc;"), "a,bc")
+        self.assertRaises(ParseError, g.name, "1a")
+
+
+    def test_charSet(self):
+        """
+        C{{...}} matches a single character in a set of characters and
+        ranges, or with a leading C{^} one not in it. Repeating a set
+        collects the characters as any repetition would.
+        """
+        g = self.compile(r"""
+        ident ::= {a-zA-Z_}:c {a-zA-Z0-9_}*:cs => c + ''.join(cs)
+        hex ::= {0-9a-fA-F}+:ds => int(''.join(ds), 16)
+        quoted ::= '"' {^"\\}*:cs '"' => ''.join(cs)
+        odd ::= {\-\}\n}
+        """)
+        self.assertEqual(g.ident("_ab1"), "_ab1")
+        self.assertRaises(ParseError, g.ident, "1ab")
+        self.assertEqual(g.hex("fF0"), 0xff0)
+        self.assertRaises(ParseError, g.hex, "g")
+        self.assertEqual(g.quoted('"a b"'), "a b")
+        self.assertRaises(ParseError, g.quoted, '"a\\b"')
+        self.assertEqual([g.odd(c) for c in "-}\n"], ["-", "}", "\n"])
+        self.assertRaises(ParseError, g.odd, "n")
+
+
+    def test_regular(self):
+        """
+        Regular parts of a grammar match as PEGs: choices commit to the
+        first alternative that matches and repetitions to as much as they
+        can match, and failures are reported where the PEG finds them.
+        """
+        g = self.compile("""
+        word ::= $(<letter> (<letterOrDigit> | '-')*)
+        choice ::= ('a' | 'a' 'b') 'c'
+        greedy ::= 'a'* 'a' => 'x'
+        kw ::= $('i' 'f' | 'i' 'n' | <letter>):k ~<letterOrDigit> => k
+        text ::= (~('<' | '&' '&') <anything>)+:cs '<' => ''.join(cs)
+        """)
+        self.assertEqual(g.word("ab-1"), "ab-1")
+        e = self.assertRaises(ParseError, g.word, "1ab")
+        self.assertEqual(e, ParseError(0, expected("letter")))
+        self.assertEqual(g.choice("ac"), "c")
+        e = self.assertRaises(ParseError, g.choice, "abc")
+        self.assertEqual(e, ParseError(1, expected(None, "c")))
+        e = self.assertRaises(ParseError, g.greedy, "aaa")
+        self.assertEqual(e.position, 3)
+        self.assertEqual(g.kw("in"), "in")
+        self.assertEqual(g.kw("x"), "x")
+        e = self.assertRaises(ParseError, g.kw, "ifs")
+        self.assertEqual(e.position, 3)
+        self.assertEqual(g.text("a&b<"), "a&b")
+        e = self.assertRaises(ParseError, g.text, "a&&<")
+        self.assertEqual(e, ParseError(1, expected(None, "<")))
+
+
+    def test_dispatch(self):
+        """
+        Choices whose alternatives start with literals still try them in
+        order, so an earlier alternative that matches wins over a longer
+        later one, and one that fails after its literal leaves the next to
+        match. Their errors are those of trying every alternative.
+        """
+        g = self.compile("""
+        op ::= ('=' '=' => 'eq'
+               |'=' => 'assign'
+               |'<' '=' => 'le'
+               |'<' => 'lt'
+               |'!' '=' => 'ne')
+        first ::= ('a' => 1
+                  |'a' 'b' => 2
+                  |'b' => 3):x <anything>* => x
+        escaped ::= '\\\\' ('n' => 10
+                            |'t' => 9
+                            |'\\\\' => 92)
+        """)
+        self.assertEqual(g.op("=="), "eq")
+        self.assertEqual(g.op("="), "assign")
+        self.assertEqual(g.op("<"), "lt")
+        self.assertEqual(g.op("!="), "ne")
+        self.assertEqual(g.first("ab"), 1)
+        self.assertEqual(g.first("b"), 3)
+        self.assertEqual(g.escaped("\\t"), 9)
+        e = self.assertRaises(ParseError, g.op, "!<")
+        self.assertEqual(e, ParseError(1, expected(None, "=")))
+        e = self.assertRaises(ParseError, g.op, "x")
+        self.assertEqual(e.position, 0)
+        self.assertEqual(sorted(e.error), [("expected", None, "!"),
+                                           ("expected", None, "<"),
+                                           ("expected", None, "=")])
+        e = self.assertRaises(ParseError, g.escaped, "\\x")
+        self.assertEqual(e.position, 1)
+        self.assertEqual(sorted(e.error), [("expected", None, "\\"),
+                                           ("expected", None, "n"),
+                                           ("expected", None, "t")])
+
+
+    def test_predict(self):
+        """
+        Choices still match as they would trying every alternative where
+        alternatives skip whitespace, check what follows with negative
+        lookaheads, can match nothing, or recurse on the left.
+        """
+        g = self.compile("""
+        newline ::= (<token 'a'>? '\\n' => 'nl'
+                    |<token 'b'> => 'b')
+        notToken ::= (~('x') <token 'x'> => 'x'
+                     |<token 'y'> => 'y')
+        afterSpaces ::= (<spaces> ~('a') <letter> => 'letter'
+                        |<spaces> 'a' => 'a')
+        sum ::= (<sum>:a '+' <digit>:b => a + int(b)
+                |<digit>:d => int(d))
+        maybe ::= (<letter>* '!' => 'bang'
+                  |'?' => 'question'
+                  | => 'none')
+        """)
+        self.assertEqual(g.newline("\n"), "nl")
+        self.assertEqual(g.newline(" a\n"), "nl")
+        self.assertEqual(g.newline(" b"), "b")
+        self.assertEqual(g.notToken(" x"), "x")
+        self.assertEqual(g.notToken("y"), "y")
+        self.assertEqual(g.afterSpaces(" b"), "letter")
+        self.assertEqual(g.afterSpaces(" a"), "a")
+        self.assertEqual(g.sum("1+2+3"), 6)
+        self.assertEqual(g.maybe("ab!"), "bang")
+        self.assertEqual(g.maybe("!"), "bang")
+        self.assertEqual(g.maybe("?"), "question")
+        self.assertEqual(g.maybe(""), "none")
+        e = self.assertRaises(ParseError, g.notToken, " z")
+        self.assertEqual(e.position, 1)
+        self.assertEqual(sorted(e.error), [("expected", "token", "x"),
+                                           ("expected", "token", "y")])
+
+
+    def test_factor(self):
+        """
+        Alternatives that start the same way match as they would matching
+        the start again for each, keep what they bind when the rest of an
+        earlier alternative binds a name again, and fail with the same
+        errors.
+        """
+        g = self.compile("""
+        hole ::= (<token '${'> <digit>:n '}' => 'value ' + n
+                 |<token '$'> <digit>:n => 'value ' + n
+                 |<token '$'> <letter>:t => 'named ' + t
+                 |<token '@'> <letter>:t => 'pattern ' + t)
+        number ::= (<digit>+:ds '.' <digit>+:fs => float(''.join(ds + ['.'] + fs))
+                   |<digit>+:ds => int(''.join(ds)))
+        rebind ::= (<letter>:x <digit>:x '!' => x
+                   |<letter>:x <anything> => x)
+        """)
+        self.assertEqual(g.hole(" ${1}"), "value 1")
+        self.assertEqual(g.hole(" $1"), "value 1")
+        self.assertEqual(g.hole(" $x"), "named x")
+        self.assertEqual(g.hole("@x"), "pattern x")
+        self.assertEqual(g.number("12.5"), 12.5)
+        self.assertEqual(g.number("12"), 12)
+        self.assertEqual(g.rebind("a1"), "a")
+        e = self.assertRaises(ParseError, g.hole, " $-")
+        self.assertEqual(e.position, 2)
+        self.assertEqual(sorted(e.error), [("expected", "digit", None),
+                                           ("expected", "letter", None),
+                                           ("expected", "token", "${")])
+
+
+    def test_cutRepetition(self):
+        """
+        A cut commits a repetition to the item it's in, and an optional
+        pattern to matching.
+        """
+        g = self.compile("""
+        items ::= ('(' ^ <letter>+ ')')*:xs <anything>* => len(xs)
+        opt ::= ('(' ^ <letter> ')')? '('
+        """)
+        self.assertEqual(g.items("(a)(bc)"), 2)
+        self.assertRaises(ParseError, g.items, "(a)(")
+        self.assertEqual(g.opt("(a)("), '(')
+        self.assertRaises(ParseError, g.opt, "(")
+
+
+    def test_cutLeftRecursion(self):
+        """
+        Memo records dropped at a cut don't include those left recursion
+        depends on.
+        """
+        g = self.compile("""
+        expr ::= (<expr>:e '+' <num>:n => e + n
+                 |<num>)
+        num ::= <digit>:d ^ => int(d)
+        """)
+        self.assertEqual(g.expr("1+2+3"), 6)
+
+
 
 class V2TestCase(unittest.TestCase):
     """
@@ -740,6 +1146,44 @@ class V2TestCase(unittest.TestCase):
         self.assertEqual(g.broken('ab'), 'ab')
 
 
+    def test_cut(self):
+        """
+        Once a cut is passed, the alternative it's in is committed to: if it
+        fails, the alternatives after it aren't tried.
+        """
+        g = self.compile("""
+            stmt = 'x' ^ '=' digit:d -> int(d)
+                 | letter:c -> c.upper()
+        """)
+        self.assertEqual(g.stmt("x=1"), 1)
+        self.assertEqual(g.stmt("y"), 'Y')
+        e = self.assertRaises(ParseError, g.stmt, "x")
+        self.assertEqual(e.position, 1)
+
+
+    def test_capture(self):
+        """
+        C{$(expr)} matches expr and returns the input it matched.
+        """
+        g = self.compile("""
+            name = $(letter letterOrDigit*)
+        """)
+        self.assertEqual(g.name("abc1"), "abc1")
+
+
+    def test_charSet(self):
+        """
+        C{{...}} matches a character in a set, or with C{^} not in it.
+        """
+        g = self.compile("""
+            digits = {0-9}+:ds -> ''.join(ds)
+            other = {^0-9}
+        """)
+        self.assertEqual(g.digits("123"), "123")
+        self.assertEqual(g.other("x"), "x")
+        self.assertRaises(ParseError, g.other, "1")
+
+
 
 class PyExtractorTest(unittest.TestCase):
     """
@@ -848,6 +1292,453 @@ class MakeGrammarTest(unittest.TestCase):
         self.assertEqual(TestGrammar2("x").apply("expr")[0], "x")
         self.assertEqual(TestGrammar2("3").apply("expr")[0], "3")
 
+class StreamingTest(unittest.TestCase):
+    """
+    Tests for parsing input pushed to a grammar with L{OMetaBase.feed}.
+    """
+
+    def compile(self, grammar):
+        """
+        Define a grammar class with L{OMeta.makeGrammar}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        from pymeta.grammar import OMeta
+        return OMeta.makeGrammar(grammar, {})
+
+
+    def setUp(self):
+        grammar = """
+        num ::= (<num>:n <digit>:d => n * 10 + int(d)
+                | <digit>:d => int(d))
+        record ::= <spaces> <num>:n ';' => n
+        """
+        self.Grammar = self.compile(grammar)
+
+
+    def test_feed(self):
+        """
+        Each application of the streaming rule is returned from L{feed} as
+        soon as it's complete, however the input is split up.
+        """
+        source = "12; 345;6;78;"
+        for split in range(len(source) + 1):
+            g = self.Grammar.streaming("record")
+            results = g.feed(source[:split])
+            results += g.feed(source[split:])
+            results += g.close()
+            self.assertEqual(results, [12, 345, 6, 78])
+
+
+    def test_feedCharacters(self):
+        """
+        Results that could still grow are held back until they can't, and
+        the data before them is dropped once they are returned.
+        """
+        g = self.Grammar.streaming("record")
+        self.assertEqual(g.feed(b"12"), [])
+        self.assertEqual(g.feed(b";3"), [12])
+        self.assertEqual(g.input.data, "3")
+        self.assertEqual(g.feed(b"4;"), [34])
+        self.assertEqual(g.close(), [])
+
+
+    def test_parseError(self):
+        """
+        Input that can't match raises L{ParseError} from L{feed}, and input
+        left over when the stream is closed raises it from L{close}.
+        """
+        g = self.Grammar.streaming("record")
+        e = self.assertRaises(ParseError, g.feed, "1;x")
+        self.assertEqual(e.position, 2)
+        g = self.Grammar.streaming("record")
+        self.assertEqual(g.feed("1;2"), [1])
+        e = self.assertRaises(ParseError, g.close)
+        self.assertEqual(e.position, 3)
+
+
+    def test_cut(self):
+        """
+        Data dropped at a cut is still available to parse from the start of
+        the rule's application again when more data arrives.
+        """
+        Grammar = self.compile("""
+        record ::= <spaces> <digit>:d ^ <digit>*:ds ';' => d + ''.join(ds)
+        """)
+        source = "12; 345;6;"
+        for split in range(len(source) + 1):
+            g = Grammar.streaming("record")
+            results = g.feed(source[:split])
+            results += g.feed(source[split:])
+            results += g.close()
+            self.assertEqual(results, ["12", "345", "6"])
+
+
+
+class IterparseTest(unittest.TestCase):
+    """
+    Tests for producing the items of a repetition one at a time with
+    L{OMetaBase.iterparse}.
+    """
+
+    def compile(self, grammar):
+        """
+        Define a grammar class with L{OMeta.makeGrammar}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        from pymeta.grammar import OMeta
+        return OMeta.makeGrammar(grammar, {})
+
+
+    def setUp(self):
+        grammar = """
+        record ::= <spaces> <digit>+:ds ';' => int(''.join(ds))
+        records ::= <record>*
+        prefixed :sep ::= <token "#"> (<spaces> <exactly sep> <digit>)+
+        """
+        self.Grammar = self.compile(grammar)
+
+
+    def test_iterparse(self):
+        """
+        Each item is produced as soon as it has been matched, with the input
+        before it forgotten.
+        """
+        for inputClass in [InputStream, CursorInput]:
+            Grammar = type("Grammar", (self.Grammar,),
+                           {"inputClass": inputClass})
+            g = Grammar("12; 345;6;")
+            items = g.iterparse("records")
+            self.assertEqual(next(items), 12)
+            self.assertEqual(g.input.position, 3)
+            self.assertEqual(g.input.memo.get("record", 0), None)
+            self.assertEqual(list(items), [345, 6])
+            self.assertEqual(g.rule_end()[0], True)
+
+
+    def test_arguments(self):
+        """
+        Arguments for the rule are passed after its name, and a repetition
+        of at least one item raises L{ParseError} if there are none.
+        """
+        g = self.Grammar("# ,1 ,2,3")
+        self.assertEqual(list(g.iterparse("prefixed", ",")), ["1", "2", "3"])
+        g = self.Grammar("# 1")
+        items = g.iterparse("prefixed", ",")
+        self.assertRaises(ParseError, next, items)
+
+
+    def test_notRepetition(self):
+        """
+        Rules that don't end with a repetition can't be iterated over.
+        """
+        g = self.Grammar("1;")
+        self.assertRaises(ValueError, g.iterparse, "record")
+        self.assertRaises(NameError, g.iterparse, "nothing")
+
+
+
+class SentinelOMetaTestCase(OMetaTestCase):
+    """
+    Tests of OMeta grammar compilation, with generated code that signals
+    failure by returning a sentinel rather than raising L{ParseError}.
+    """
+
+    def compile(self, grammar):
+        """
+        Produce an object capable of parsing via this grammar, generated by
+        L{SentinelPythonWriter}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        g = self.classTested(grammar)
+        tree = g.parseGrammar('TestGrammar', TreeBuilder)
+        result = moduleFromGrammar(tree, 'TestGrammar', SentinelOMetaBase, {},
+                                   SentinelPythonWriter)
+        return HandyWrapper(result)
+
+
+    def test_noExceptions(self):
+        """
+        Failed alternatives and repetitions don't create L{ParseError}s; only
+        the one describing the error C{apply} returns is made.
+        """
+        g = self.compile("""
+              digits ::= (<letter> | '-' | <digit>)+:ds (<token "x"> | ';') => ds
+              """)
+        made = []
+        def init(e, *a):
+            made.append(a)
+            Exception.__init__(e, *a)
+        self.patch(ParseError, "__init__", init)
+        ds, err = g.klass("123;").apply("digits")
+        self.assertEqual(ds, ["1", "2", "3"])
+        self.assertEqual(len(made), 1)
+
+
+
+class SentinelStreamingTest(StreamingTest):
+    """
+    Tests for L{OMetaBase.feed} with grammars defined with L{SentinelOMeta}.
+    """
+
+    def compile(self, grammar):
+        """
+        Define a grammar class with L{SentinelOMeta.makeGrammar}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        from pymeta.grammar import SentinelOMeta
+        return SentinelOMeta.makeGrammar(grammar, {})
+
+
+
+class SentinelIterparseTest(IterparseTest):
+    """
+    Tests for L{OMetaBase.iterparse} with grammars defined with
+    L{SentinelOMeta}.
+    """
+
+    def compile(self, grammar):
+        """
+        Define a grammar class with L{SentinelOMeta.makeGrammar}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        from pymeta.grammar import SentinelOMeta
+        return SentinelOMeta.makeGrammar(grammar, {})
+
+
+
+def fastGrammar(tree, base=FastOMetaBase):
+    """
+    Define a grammar class on L{FastOMetaBase} (or a subclass) from a grammar
+    tree, with the same rules on L{SentinelOMetaBase} as its
+    C{detailedClass}.
+    """
+    result = moduleFromGrammar(tree, 'TestGrammar', base, {},
+                               FastPythonWriter)
+    result.detailedClass = moduleFromGrammar(tree, 'TestGrammar',
+                                             SentinelOMetaBase, {},
+                                             SentinelPythonWriter)
+    return result
+
+
+
+class FastOMetaTestCase(OMetaTestCase):
+    """
+    Tests of OMeta grammar compilation, with generated code that tracks no
+    errors and reparses to find them.
+    """
+
+    def compile(self, grammar):
+        """
+        Produce an object capable of parsing via this grammar, generated by
+        L{FastPythonWriter}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        g = self.classTested(grammar)
+        tree = g.parseGrammar('TestGrammar', TreeBuilder)
+        return HandyWrapper(fastGrammar(tree))
+
+
+    def test_reparse(self):
+        """
+        The errors of a fast grammar come from parsing again with its
+        C{detailedClass}, from where the rule started: when a match fails,
+        at once, and when it succeeds, only once the L{ParseError} returned
+        with its value is read.
+        """
+        from pymeta.runtime import ReparsedError
+        g = self.compile("""
+              digits ::= <spaces> <digit>+:ds => ds
+              """)
+        o = g.klass("12 34 x")
+        v, e = o.apply("digits")
+        self.assertEqual(v, ["1", "2"])
+        self.assertIsInstance(e, ReparsedError)
+        self.assertIdentical(e.found, None)
+        detailed = g.klass.detailedClass("12 34 x").apply("digits")[1]
+        self.assertEqual(e, detailed)
+        self.assertEqual(e.position, detailed.position)
+        self.assertEqual(o.apply("digits")[0], ["3", "4"])
+        e = self.assertRaises(ParseError, o.apply, "digits")
+        self.assertEqual(e, ParseError(6, expected("digit")))
+        self.assertRaises(ParseError, g.digits, "12 x")
+
+
+    def test_reparsedErrorRaised(self):
+        """
+        The error returned with a fast grammar's match can be raised, as
+        L{OMetaGrammarMixin.parseGrammar} does when input is left over, and
+        is found by a C{detailedClass} instance with the grammar's builder.
+        """
+        from pymeta import grammar
+        from pymeta.grammar import FastOMeta, OMetaGrammarMixin
+        fast = FastOMeta.makeGrammar(grammar.ometaGrammar, vars(grammar),
+                                     name="OMetaGrammar")
+        detailed = type("Detailed", (OMetaGrammarMixin, fast.detailedClass),
+                        {})
+        Grammar = type("Grammar", (OMetaGrammarMixin, fast),
+                       {"detailedClass": detailed})
+        self.assertEqual(
+            Grammar("x ::= 'a'\n").parseGrammar("T", TreeBuilder),
+            grammar.OMetaGrammar("x ::= 'a'\n").parseGrammar("T", TreeBuilder))
+        e = self.assertRaises(ParseError, Grammar("x ::= 'a'\n ???").
+                              parseGrammar, "T", TreeBuilder)
+        self.assertEqual(e.position, 11)
+
+
+    def test_reparseSpans(self):
+        """
+        A grammar tracking spans reparses with an instance of its
+        C{detailedClass} that applies rules to its own input.
+        """
+        g = self.compile("""
+              num ::= <digit>+:ds => ds
+              pair ::= <num>:a ',' <num>:b => [a, b]
+              """)
+        Grammar = type("Grammar", (g.klass,), {"trackSpans": True})
+        e = self.assertRaises(ParseError, Grammar("12,x").apply, "pair")
+        self.assertEqual(e, ParseError(3, expected("digit")))
+        pair, err = Grammar("12,3").apply("pair")
+        self.assertEqual(err, ParseError(3, None))
+
+
+
+class CursorFastOMetaBase(FastOMetaBase):
+    """
+    Grammar base class that tracks no errors and parses with L{CursorInput}.
+    """
+    inputClass = CursorInput
+
+
+
+class FastCursorInputTest(OMetaTestCase):
+    """
+    Tests of OMeta grammar compilation, with generated code that tracks no
+    errors, run over L{CursorInput}, where the regular parts of grammars are
+    matched with regular expressions. Their results and errors must be those
+    of the other grammars.
+    """
+
+    def compile(self, grammar):
+        """
+        Produce an object capable of parsing via this grammar, generated by
+        L{FastPythonWriter} and parsing with L{CursorInput}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        g = self.classTested(grammar)
+        tree = g.parseGrammar('TestGrammar', TreeBuilder)
+        return HandyWrapper(fastGrammar(tree, CursorFastOMetaBase))
+
+
+    def test_regularBytes(self):
+        """
+        Regular expressions match bytes as the characters they decode to as
+        Latin-1.
+        """
+        g = self.compile("""
+        word ::= $(<letter>+):w <digit>* => w
+        chars ::= (~(' ') <anything>)+:cs ' ' ('x' | "\xe9t\xe9"):e => (cs, e)
+        """)
+        self.assertEqual(bytes(g.word(b"\xe9t\xe912")), b"\xe9t\xe9")
+        self.assertEqual(g.chars(b"a\xff \xe9t\xe9"), (["a", "\xff"], "\xe9t\xe9"))
+
+
+    def test_redefinedBuiltin(self):
+        """
+        A grammar that redefines a builtin rule used by a regular part of it
+        matches that part with its own code.
+        """
+        g = self.compile("""
+        digit ::= 'x'
+        num ::= $(<digit>+)
+        """)
+        self.assertEqual(g.num("xx"), "xx")
+        self.assertRaises(ParseError, g.num, "12")
+
+
+    def test_predictRedefined(self):
+        """
+        A grammar class that redefines a rule that which alternatives of a
+        choice can match was worked out from tries all of them.
+        """
+        g = self.compile("""
+        d ::= <digit>
+        num ::= (<d>+ => 'number'
+                |<digit>+ => 'digits'
+                |<anything>* => 'other')
+        """)
+        self.assertEqual(g.num("x"), "other")
+        class NewRule(g.klass):
+            def rule_d(self):
+                return self.exactly("x")
+        self.assertEqual(HandyWrapper(NewRule).num("x"), "number")
+        class NewBuiltin(g.klass):
+            def rule_digit(self):
+                return self.exactly("x")
+        self.assertEqual(HandyWrapper(NewBuiltin).num("x"), "number")
+        self.assertEqual(g.num("1"), "number")
+
+
+    def test_predictSubgrammar(self):
+        """
+        A subgrammar defined with makeGrammar that redefines a rule a
+        prediction depends on tries every alternative, though its rules are
+        generated into a module of the same name.
+        """
+        from pymeta.grammar import FastOMeta
+        base = FastOMeta.makeGrammar("""
+        foo ::= 'a' => 'A'
+        item ::= (<foo>
+                 |'b' => 'plain')
+        """, {})
+        sub = base.makeGrammar("""
+        foo ::= 'b' => 'B'
+        """, {})
+        self.assertEqual(HandyWrapper(base).item("b"), "plain")
+        self.assertEqual(HandyWrapper(sub).item("b"), "B")
+        self.assertEqual(HandyWrapper(base).item("a"), "A")
+
+
+
+class FastStreamingTest(StreamingTest):
+    """
+    Tests for L{OMetaBase.feed} with grammars defined with L{FastOMeta}.
+    """
+
+    def compile(self, grammar):
+        """
+        Define a grammar class with L{FastOMeta.makeGrammar}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        from pymeta.grammar import FastOMeta
+        return FastOMeta.makeGrammar(grammar, {})
+
+
+
+class FastIterparseTest(IterparseTest):
+    """
+    Tests for L{OMetaBase.iterparse} with grammars defined with
+    L{FastOMeta}.
+    """
+
+    def compile(self, grammar):
+        """
+        Define a grammar class with L{FastOMeta.makeGrammar}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        from pymeta.grammar import FastOMeta
+        return FastOMeta.makeGrammar(grammar, {})
+
+
+
 class SelfHostingTest(OMetaTestCase):
     """
     Tests for the OMeta grammar parser defined with OMeta.
@@ -888,6 +1779,189 @@ class NullOptimizerTest(OMetaTestCase):
         grammarClass = moduleFromGrammar(tree, 'TestGrammar', OMetaBase, {})
         return HandyWrapper(grammarClass)
 
+class GrammarOptimizerTest(OMetaTestCase):
+    """
+    Tests of OMeta grammar compilation via every pass of the grammar
+    optimizer.
+    """
+
+    def compile(self, grammar):
+        """
+        Produce an object capable of parsing via this grammar, with its tree
+        rewritten by a L{GrammarOptimizer} that also inlines rules.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        from pymeta.grammar import OMetaGrammar, GrammarOptimizer
+        class InliningOptimizer(GrammarOptimizer):
+            inlineRules = True
+        g = OMetaGrammar(grammar)
+        tree = g.parseGrammar('TestGrammar', TreeBuilder)
+        tree = InliningOptimizer().optimize(tree)
+        grammarClass = moduleFromGrammar(tree, 'TestGrammar', OMetaBase, {})
+        return HandyWrapper(grammarClass)
+
+
+
+class OptimizerPassesTest(unittest.TestCase):
+    """
+    Tests of the rewrites made by each of the grammar optimizer's passes.
+    """
+
+    def optimize(self, grammar, **passes):
+        """
+        Return the rule bodies of a grammar, by name, as rewritten by the
+        given passes only.
+
+        @param grammar: A string containing an OMeta grammar.
+        @param passes: The L{GrammarOptimizer} attributes to set.
+        """
+        from pymeta.grammar import OMetaGrammar, GrammarOptimizer
+        attrs = {"foldConstants": False, "inlineRules": False,
+                 "flatten": False, "dropOptionals": False}
+        attrs.update(passes)
+        optimizer = type("GrammarOptimizer", (GrammarOptimizer,), attrs)
+        tree = OMetaGrammar(dedent(grammar)).parseGrammar('TestGrammar',
+                                                          TreeBuilder)
+        tree = optimizer().optimize(tree)
+        return dict([(rule[1], rule[2]) for rule in tree[2]])
+
+
+    def test_noPasses(self):
+        """
+        With every pass turned off, the tree is unchanged.
+        """
+        grammar = """
+        x ::= ('a' => "\\n"
+              |<y>?)
+        y ::= 'b'*
+        """
+        tree = OMetaGrammarTree(dedent(grammar))
+        self.assertEqual(self.optimize(grammar),
+                         dict([(rule[1], rule[2]) for rule in tree[2]]))
+
+
+    def test_foldConstants(self):
+        """
+        Python expressions and actions that are literals become constants,
+        including those passed to rules. Others are left alone.
+        """
+        rules = self.optimize("""
+        x ::= <token "a"> => "\\n"
+        y ::= !((1, 'b')) => x
+        """, foldConstants=True, flatten=True)
+        self.assertEqual(rules["x"],
+                         ["And", [["Apply", "token", "x", (["Constant", "a"],)],
+                                  ["Constant", "\n"]]])
+        self.assertEqual(rules["y"],
+                         ["And", [["Constant", (1, "b")], ["Python", "x"]]])
+
+
+    def test_flatten(self):
+        """
+        Sequences are spliced into sequences and choices into choices, and
+        those of one expression are replaced by it. Empty sequences are
+        kept only at the end of a sequence, and choices with a cut aren't
+        spliced.
+        """
+        rules = self.optimize("""
+        x ::= 'a' ('b' 'c') ('d' | ('e' | 'f'))
+        y ::= 'a' ('b' | ('c' ^ 'd' | 'e'))
+        z ::= 'a' !(None)
+        """, flatten=True)
+        self.assertEqual(rules["x"],
+                         ["And", [["Exactly", "a"], ["Exactly", "b"],
+                                  ["Exactly", "c"],
+                                  ["Or", [["Exactly", "d"], ["Exactly", "e"],
+                                          ["Exactly", "f"]]]]])
+        self.assertEqual(rules["y"],
+                         ["And", [["Exactly", "a"],
+                                  ["Or", [["Exactly", "b"],
+                                          ["Or", [["And", [["Exactly", "c"],
+                                                           ["Cut"],
+                                                           ["Exactly", "d"]]],
+                                                  ["Exactly", "e"]]]]]]])
+        self.assertEqual(rules["z"],
+                         ["And", [["Exactly", "a"], ["Action", "None"]]])
+
+
+    def test_dropOptionals(self):
+        """
+        Optional expressions that always match lose the '?', unless they
+        contain a cut.
+        """
+        rules = self.optimize("""
+        x ::= ('a'*)?:xs ('b'?)? 'c'?
+        y ::= (('a' ^ 'b')*)?
+        """, dropOptionals=True, foldConstants=True, flatten=True)
+        self.assertEqual(rules["x"],
+                         ["And", [["Bind", "xs", ["Many", ["Exactly", "a"]]],
+                                  ["Optional", ["Exactly", "b"]],
+                                  ["Optional", ["Exactly", "c"]]]])
+        self.assertEqual(rules["y"][0], "Optional")
+
+
+    def test_inlineRules(self):
+        """
+        Applications without arguments of small rules that don't apply
+        themselves and have no bindings, actions or cuts are replaced by
+        the rules' bodies, inlined in turn.
+        """
+        rules = self.optimize("""
+        x ::= <y> <z> <w> <v> <u>
+        y ::= 'a' <v>
+        v ::= 'b'
+        z ::= 'c' <z>?
+        w ::= 'd':d => d
+        u ::= 'e' 'f' 'g' 'h' 'i'
+        """, inlineRules=True, flatten=True)
+        self.assertEqual(rules["x"],
+                         ["And", [["Exactly", "a"], ["Exactly", "b"],
+                                  ["Apply", "z", "x", ()],
+                                  ["Apply", "w", "x", ()],
+                                  ["Exactly", "b"],
+                                  ["Apply", "u", "x", ()]]])
+        self.assertEqual(rules["y"],
+                         ["And", [["Exactly", "a"], ["Exactly", "b"]]])
+
+
+    def test_makeGrammar(self):
+        """
+        L{OMeta.makeGrammar} writes grammars as parsed unless the class it's
+        called on has an C{optimizerClass}, such as L{GrammarOptimizer}, to
+        rewrite them with first, so constant values are written into the
+        code. Subclasses of that class are optimized too.
+        """
+        from pymeta.grammar import OMeta, SentinelOMeta, FastOMeta
+        from pymeta.grammar import GrammarOptimizer
+        self.assertIdentical(OMeta.optimizerClass, None)
+        grammar = dedent("""
+        x ::= ('a' => "\\n"
+              |'b')?
+        """)
+        for base in (OMeta, SentinelOMeta, FastOMeta):
+            class Optimized(base):
+                optimizerClass = GrammarOptimizer
+            sub = Optimized.makeGrammar("y ::= <x>\n", {})
+            for cls, optimized in [(base, False), (Optimized, True),
+                                   (sub, True)]:
+                g = cls.makeGrammar(grammar, {})
+                self.assertEqual(g("a").apply("x")[0], "\n")
+                module = sys.modules[g.__module__]
+                source = module.__loader__.get_source(g.__module__)
+                self.assertEqual("eval(" not in source, optimized)
+
+
+
+def OMetaGrammarTree(grammar):
+    """
+    Return the tree of a grammar parsed by the metagrammar.
+    """
+    from pymeta.grammar import OMetaGrammar
+    return OMetaGrammar(grammar).parseGrammar('TestGrammar', TreeBuilder)
+
+
+
 class ErrorReportingTests(unittest.TestCase):
 
 
@@ -992,3 +2066,190 @@ class ErrorReportingTests(unittest.TestCase):
                          Parse error at line 1, column 3: expected a digit
                          """))
         
+
+
+class SentinelErrorReportingTests(ErrorReportingTests):
+    """
+    Errors are reported the same way by grammars that signal failure with a
+    sentinel.
+    """
+
+    def compile(self, grammar):
+        """
+        Produce an object capable of parsing via this grammar, generated by
+        L{SentinelPythonWriter}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        g = BootOMetaGrammar(grammar)
+        tree = g.parseGrammar('TestGrammar', TreeBuilder)
+        result = moduleFromGrammar(tree, 'TestGrammar', SentinelOMetaBase, {},
+                                   SentinelPythonWriter)
+        return HandyWrapper(result)
+
+
+
+class FastErrorReportingTests(ErrorReportingTests):
+    """
+    Grammars that track no errors report the same ones as those that do,
+    by parsing again.
+    """
+
+    def compile(self, grammar):
+        """
+        Produce an object capable of parsing via this grammar, generated by
+        L{FastPythonWriter}.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        g = BootOMetaGrammar(grammar)
+        tree = g.parseGrammar('TestGrammar', TreeBuilder)
+        return HandyWrapper(fastGrammar(tree))
+
+
+
+class CursorInputTest(OMetaTestCase):
+    """
+    Tests of OMeta grammar compilation, run over L{CursorInput}.
+    """
+
+    def compile(self, grammar):
+        """
+        Produce an object capable of parsing via this grammar, using the
+        integer-cursor input engine.
+
+        @param grammar: A string containing an OMeta grammar.
+        """
+        g = self.classTested(grammar)
+        tree = g.parseGrammar('TestGrammar', TreeBuilder)
+        result = moduleFromGrammar(tree, 'TestGrammar', CursorOMetaBase, {})
+        return HandyWrapper(result)
+
+
+    def test_bytes(self):
+        """
+        Grammars can parse bytes with the cursor engine.
+        """
+        g = self.compile("""
+              num ::= <digit>+:ds => int(''.join(ds))
+              pair ::= <num>:a <token ','> <spaces> <num>:b => (a, b)
+            """)
+        self.assertEqual(g.pair(b"12, 34"), (12, 34))
+        self.assertEqual(g.pair(memoryview(b"1,2")), (1, 2))
+        self.assertRaises(ParseError, g.pair, b"1;2")
+
+
+    def test_stringLiteral(self):
+        """
+        Strings in double quotes match runs of characters in string and
+        bytes input, and single items in other input.
+        """
+        g = self.compile("""
+              kw ::= ("letrec" | "let"):k <spaces> <letter>+ => k
+              """)
+        self.assertEqual(g.kw("let x"), "let")
+        self.assertEqual(g.kw(b"letrec f"), "letrec")
+        self.assertEqual(g.kw(["let", " ", "x"]), "let")
+        e = self.assertRaises(ParseError, g.kw, "lex")
+        self.assertEqual(e.position, 2)
+
+
+
+class FactorChoicesTest(unittest.TestCase):
+    """
+    Grammars whose choices have what their alternatives start with factored
+    out of them parse a corpus of inputs as they do without it.
+    """
+
+    grammar = r"""
+    start ::= <term>:t <spaces> <end> => t
+    term ::= <functor>:f (<token '('> <args>:a <token ')'> => [f, a]
+                         | => f)
+    args ::= (<term>:t (<token ','> <term>)*:ts => [t] + ts
+             | => [])
+    functor ::= <spaces> (<number> | <hole> | <pair> | $(<letter>+))
+    hole ::= (<token '${'> <digits>:n '}' => ['value', n]
+             |<token '$'> <digits>:n => ['value', n]
+             |<token '$'> $(<letter>+):t => ['named', t]
+             |<token '@'> <digits>:n => ['pattern', n]
+             |<token '@'> $(<letter>+):t => ['named pattern', t])
+    number ::= '-'?:sign ('0' ('x' <hexdigit>+:hs => int(''.join(hs), 16)
+                              | => 0)
+                         |<digits>:ds '.' <digits>:fs => float(ds + '.' + fs)
+                         |<digits>:ds 'e' <digits>:es => float(ds + 'e' + es)
+                         |<digits>:ds => int(ds))
+    digits ::= $(<digit>+)
+    hexdigit ::= {0-9a-f}
+    pair ::= (<letter>:x <digit>:x '!' => x
+             |<letter>:x '=' <letter> => x)
+    """
+
+    inputs = ["f(1, 2.5, 3e4, 0x1f, 0, x)", "$1", "${12}", "$name", "@3",
+              "@pat(a=b, c1!)", "a(b(c(d)))", "f()", "12.", "1e", "$", "${1",
+              "@-", "0x", "f(1,", "a=", "a1", "f(1 2)", ""]
+
+    def parses(self, grammarClass):
+        """
+        Return what a grammar class parses each input to, or its error.
+        """
+        results = []
+        for text in self.inputs:
+            try:
+                results.append(grammarClass(text).apply("start")[0])
+            except ParseError as e:
+                results.append((e.position, e.error))
+        return results
+
+
+    def assertSameParses(self, makeGrammar, writerClass):
+        """
+        Assert that grammars generated by a writer class, and by a subclass
+        of it that doesn't factor choices, parse the inputs the same way,
+        and that their code differs.
+
+        @param makeGrammar: A callable making a grammar class from a tree
+        and a writer class.
+        """
+        class Unfactored(writerClass):
+            factorChoices = False
+        tree = BootOMetaGrammar(self.grammar).parseGrammar('TestGrammar',
+                                                           TreeBuilder)
+        self.assertNotEqual(writePython(tree, writerClass),
+                            writePython(tree, Unfactored))
+        self.assertEqual(self.parses(makeGrammar(tree, writerClass)),
+                         self.parses(makeGrammar(tree, Unfactored)))
+
+
+    def test_ometa(self):
+        """
+        Factoring doesn't change what L{OMetaBase} grammars parse.
+        """
+        self.assertSameParses(
+            lambda tree, writer: moduleFromGrammar(tree, 'TestGrammar',
+                                                   OMetaBase, {}, writer),
+            PythonWriter)
+
+
+    def test_sentinel(self):
+        """
+        Factoring doesn't change what L{SentinelOMetaBase} grammars parse.
+        """
+        self.assertSameParses(
+            lambda tree, writer: moduleFromGrammar(tree, 'TestGrammar',
+                                                   SentinelOMetaBase, {},
+                                                   writer),
+            SentinelPythonWriter)
+
+
+    def test_fast(self):
+        """
+        Factoring doesn't change what L{FastOMetaBase} grammars parse.
+        """
+        def makeGrammar(tree, writer):
+            result = moduleFromGrammar(tree, 'TestGrammar', FastOMetaBase, {},
+                                       writer)
+            result.detailedClass = moduleFromGrammar(tree, 'TestGrammar',
+                                                     SentinelOMetaBase, {},
+                                                     SentinelPythonWriter)
+            return result
+        self.assertSameParses(makeGrammar, FastPythonWriter)
@@ -1,7 +1,16 @@
 
 
+import gc
+import mmap
 from twisted.trial import unittest
-from pymeta.runtime import OMetaBase, ParseError, expected, eof
+from pymeta.runtime import OMetaBase, ParseError, EOFError, Committed, expected
+from pymeta.runtime import eof, joinErrors, ExpectedSet, LineIndex, CharRanges
+from pymeta.runtime import Regular, Dispatch, FirstSet, Prediction
+from pymeta.runtime import WhitespaceIndex, indexedSkip, CharacterClassIndex
+from pymeta.runtime import CursorInput, StringInput, BytesInput, ArgInput
+from pymeta.runtime import StreamInput, NeedMoreInput
+from pymeta.runtime import ArrayMemo, DictMemo, evicted, BacktrackError
+from pymeta.runtime import SentinelOMetaBase, FastOMetaBase, InputStream, failed
 
 class RuntimeTests(unittest.TestCase):
     """
@@ -76,6 +85,34 @@ class RuntimeTests(unittest.TestCase):
         self.assertEqual(e[1], expected("token", "fog"))
 
 
+    def test_characterFailures(self):
+        """
+        The builtin character rules fail the same way on every base: with
+        an L{EOFError} at the end of the input, or what they expected where
+        the next character doesn't match; only how they signal it differs.
+        """
+        rules = [("letter", (), expected("letter")),
+                 ("digit", (), expected("digit")),
+                 ("letterOrDigit", (), expected("letter or digit")),
+                 ("charSet", (frozenset("ab"), False, "{ab}"),
+                  expected("character in", "{ab}"))]
+        for name, args, expectation in rules:
+            for data, error in [("", ParseError(0, eof())),
+                                ("!", ParseError(0, expectation))]:
+                o = OMetaBase(data)
+                e = self.assertRaises(ParseError,
+                                      getattr(o, "rule_" + name), *args)
+                self.assertEqual(e.args, error.args)
+                self.assertEqual(isinstance(e, EOFError), not data)
+                o = SentinelOMetaBase(data)
+                self.assertEqual(getattr(o, "rule_" + name)(*args),
+                                 (failed, list(error.args)))
+                o = FastOMetaBase(data)
+                self.assertEqual(getattr(o, "rule_" + name)(*args),
+                                 (failed, None))
+                self.assertEqual(o.input.position, 0)
+
+
     def test_many(self):
         """
         L{OMetaBase.many} returns a list of parsed values and the error that
@@ -155,7 +192,27 @@ class RuntimeTests(unittest.TestCase):
                                lambda: o.token("foz"),
                                lambda: o.token("f")])
         self.assertEqual(e[0], 2)
-        self.assertEqual(e[1], [expected("token", "fog")[0], expected("token", "foz")[0]])
+        self.assertEqual(sorted(ParseError(*e).error),
+                         [expected("token", "fog")[0], expected("token", "foz")[0]])
+
+
+    def test_joinErrors(self):
+        """
+        L{joinErrors} keeps what each of the errors at the farthest position
+        expected in an L{ExpectedSet}, which is only merged into a list of
+        distinct items by L{ParseError.error}.
+        """
+        inner = joinErrors([[3, expected("digit")], [3, expected("letter")]])
+        self.assertIsInstance(inner[1], ExpectedSet)
+        joined = joinErrors([None, [1, expected("x")], inner,
+                             ParseError(3, expected("digit")), [3, None]])
+        self.assertEqual(joined[0], 3)
+        self.assertIsInstance(joined[1], ExpectedSet)
+        self.assertEqual(sorted(ParseError(*joined).error),
+                         expected("digit") + expected("letter"))
+        self.assertEqual(joinErrors([[2, expected("x")], [None, None]]),
+                         [2, expected("x")])
+        self.assertEqual(joinErrors([None]), [None, []])
 
 
     def test_notError(self):
@@ -257,3 +314,1382 @@ class RuntimeTests(unittest.TestCase):
         o = OMetaBase([["a"]])
         v, e = o.listpattern(lambda: o.exactly("a"))
         self.assertEqual((v, e), (["a"], [0, None]))
+
+
+    def test_capture(self):
+        """
+        L{OMetaBase.capture} returns the input matched by a function, joined
+        back into a string when it was read from one.
+        """
+        o = OMetaBase("aab")
+        v, e = o.capture(lambda: o.many(lambda: o.exactly("a")))
+        self.assertEqual(v, "aa")
+        self.assertEqual(o.input.position, 2)
+        o = OMetaBase([1, 2, 3])
+        v, e = o.capture(lambda: o.exactly(1))
+        self.assertEqual(v, [1])
+
+
+    def test_captureEmpty(self):
+        """
+        L{OMetaBase.capture} of nothing returns an empty string when the
+        input was read from one, even an empty one, and an empty list
+        otherwise.
+        """
+        for data, empty in [("", ""), ("b", ""), ([], []), ([1], [])]:
+            o = OMetaBase(data)
+            v, e = o.capture(lambda: o.many(lambda: o.exactly("a")))
+            self.assertEqual((v, v.__class__), (empty, empty.__class__))
+
+
+    def test_cut(self):
+        """
+        L{OMetaBase.cut} drops the memo records before the current position,
+        except those of rule applications still in progress.
+        """
+        for memoClass in [ArrayMemo, DictMemo]:
+            class Grammar(OMetaBase):
+                def rule_a(self):
+                    return self.exactly("a")
+                def rule_outer(self):
+                    self._apply(self.rule_a, "a", [])
+                    self.cut()
+                    return self._apply(self.rule_a, "a", [])
+            Grammar.memoClass = memoClass
+            o = Grammar("aab")
+            self.assertEqual(o.apply("outer")[0], "a")
+            memo = o.input.memo
+            self.assertEqual(memo.get("a", 0), None)
+            self.assertNotEqual(memo.get("a", 1), None)
+            self.assertNotEqual(memo.get("outer", 0), None)
+
+
+    def test_committed(self):
+        """
+        L{OMetaBase.committed} turns a failure into L{Committed}, which fails
+        a choice without trying its remaining options.
+        """
+        o = OMetaBase("ab")
+        def committed():
+            o.exactly("a")
+            return o.committed(lambda: o.exactly("c"))
+        e = self.assertRaises(ParseError, o._or,
+                              [committed, lambda: o.exactly("a")])
+        self.assertNotIsInstance(e, Committed)
+        self.assertEqual(e.position, 1)
+        self.assertEqual(o.input.position, 0)
+        self.assertRaises(ParseError, o.many, committed)
+
+
+
+class MemoWindowTests(unittest.TestCase):
+    """
+    Tests for parsing with a bounded memo, set with L{OMetaBase.memoWindow}.
+    """
+
+    def grammar(self, memoClass):
+        class Grammar(OMetaBase):
+            inputClass = CursorInput
+            memoWindow = 5
+            def rule_letters(self):
+                return self.many(lambda: self._apply(self.rule_letter,
+                                                     "letter", []))
+            def rule_word(self):
+                def number():
+                    self._apply(self.rule_letters, "letters", [])
+                    return self._apply(self.rule_digit, "digit", [])
+                return self._or([number,
+                                 lambda: self._apply(self.rule_letter,
+                                                     "letter", [])])
+        Grammar.memoClass = memoClass
+        return Grammar
+
+
+    def test_window(self):
+        """
+        Memo records are only kept within the window, so parsing input much
+        longer than it keeps the memo small.
+        """
+        for memoClass in [ArrayMemo, DictMemo]:
+            o = self.grammar(memoClass)("abc" * 100)
+            self.assertEqual(len(o.apply("letters")[0]), 300)
+            self.assertIdentical(o.input.memo.get("letter", 250), evicted)
+
+
+    def test_backtrackError(self):
+        """
+        Backtracking past the window raises L{BacktrackError}, which no
+        alternative catches.
+        """
+        for memoClass in [ArrayMemo, DictMemo]:
+            o = self.grammar(memoClass)("abc" * 10)
+            e = self.assertRaises(BacktrackError, o.apply, "word")
+            self.assertEqual(e.position, 0)
+            o = self.grammar(memoClass)("abc")
+            self.assertEqual(o.apply("word")[0], "a")
+
+
+
+class WhitespaceIndexTests(unittest.TestCase):
+    """
+    Tests for L{pymeta.runtime.WhitespaceIndex}.
+    """
+
+    def test_skip(self):
+        """
+        L{WhitespaceIndex.skip} returns the position of the next item that
+        isn't whitespace, for strings and bytes alike.
+        """
+        for data in [" ab \t\n c", b" ab \t\n c"]:
+            index = WhitespaceIndex(data)
+            self.assertEqual([index.skip(p) for p in range(len(data) + 1)],
+                             [1, 1, 2, 7, 7, 7, 7, 7, 8])
+
+
+    def test_comments(self):
+        """
+        Comments are skipped from their start, but text inside one is only
+        skipped where it's whitespace, as a PEG repetition would.
+        """
+        class CommentIndex(WhitespaceIndex):
+            comment = r'#[^\n]*'
+        data = "a # b c\n d"
+        index = CommentIndex(data)
+        self.assertEqual([index.skip(p) for p in range(len(data) + 1)],
+                         [0, 9, 9, 4, 4, 6, 6, 9, 9, 9, 10])
+
+
+    def test_sparse(self):
+        """
+        Only the runs of whitespace are stored, one span of positions for
+        each, and bytes are scanned in place with the Latin-1 meaning of
+        the patterns' class escapes.
+        """
+        class CommentIndex(WhitespaceIndex):
+            comment = r'#\S*'
+        data = b"ab  \xa0cd" + b"x" * 1000 + b" #\xe9\xe9 e"
+        index = CommentIndex(memoryview(data))
+        self.assertEqual(list(index.starts), [2, 1007, 1011])
+        self.assertEqual([index.skip(p) for p in [0, 2, 4, 5, 1007, 1008,
+                                                  1009, 1011, 1012]],
+                         [0, 5, 5, 5, 1012, 1012, 1009, 1012, 1012])
+
+
+    def test_eatWhitespace(self):
+        """
+        Grammars with a C{whitespaceIndex} skip whitespace on string and
+        bytes input with it, reporting the end of the input as the builtin
+        rule does, and read other input an item at a time.
+        """
+        class Grammar(OMetaBase):
+            whitespaceIndex = WhitespaceIndex
+        for base in [Grammar, type("Grammar", (SentinelOMetaBase,),
+                                   {"whitespaceIndex": WhitespaceIndex})]:
+            o = base(CursorInput.fromIterable("  x  "))
+            self.assertEqual(o.rule_token("x"), ("x", None))
+            self.assertEqual(o.rule_spaces(), (True, [5, eof()]))
+            o = base(CursorInput.fromIterable(b" \xa0 x"))
+            self.assertEqual(o.rule_token("x")[0], "x")
+            o = base(InputStream.fromIterable(" x"))
+            self.assertEqual(o.rule_token("x")[0], "x")
+
+
+    def test_indexedSkip(self):
+        """
+        L{indexedSkip} makes a rule that skips what an index finds, or falls
+        back to the grammar's own rule on input that can't be indexed.
+        """
+        class BlankIndex(WhitespaceIndex):
+            spaces = r'[ \t]'
+        def rule_spaces(self):
+            return "fallback", None
+        class Grammar(OMetaBase):
+            pass
+        Grammar.rule_spaces = indexedSkip(BlankIndex, rule_spaces)
+        o = Grammar(CursorInput.fromIterable(" \t\nx"))
+        self.assertEqual(o.rule_spaces(), (True, None))
+        self.assertEqual(o.input.position, 2)
+        o = Grammar(" x")
+        self.assertEqual(o.rule_spaces(), ("fallback", None))
+
+
+    def test_shared(self):
+        """
+        An input makes an index of each kind once, and shares it with its
+        forks.
+        """
+        i = CursorInput.fromIterable("a b")
+        index = i.indexFor(WhitespaceIndex)
+        self.assertIdentical(i.indexFor(WhitespaceIndex), index)
+        self.assertIdentical(i.fork(1).indexFor(WhitespaceIndex), index)
+        self.assertEqual(StreamInput().indexFor, None)
+
+
+
+class HexIndex(CharacterClassIndex):
+    classes = CharacterClassIndex.classes + [
+        ("hex", lambda c: c in "0123456789abcdefABCDEF")]
+
+
+
+class CharacterClassIndexTests(unittest.TestCase):
+    """
+    Tests for L{pymeta.runtime.CharacterClassIndex}.
+    """
+
+    def test_codes(self):
+        """
+        Each position's code has the bit of every class its character is in,
+        for strings and bytes alike.
+        """
+        for data in [u"a1_ \xe9", b"a1_ \xe9"]:
+            index = HexIndex(data)
+            self.assertEqual(list(bytearray(index.codes)),
+                             [1 | 4 | 8, 2 | 4 | 8, 4, 0, 1 | 4])
+
+
+    def test_chunks(self):
+        """
+        Input is translated a chunk at a time, bytes in place through a
+        memoryview, to the same codes as in one go.
+        """
+        class Small(HexIndex):
+            chunkSize = 3
+        text = u"a1_ \xe9fG9 z"
+        data = text.encode('latin-1')
+        whole = list(bytearray(HexIndex(data).codes))
+        self.assertEqual(len(whole), len(data))
+        for d in [text, data, bytearray(data), memoryview(data)]:
+            self.assertEqual(list(Small(d).codes), whole)
+
+
+    def test_tooManyClasses(self):
+        """
+        Only eight classes fit in a byte.
+        """
+        class Big(CharacterClassIndex):
+            classes = [(str(n), str.isalpha) for n in range(9)]
+        self.assertRaises(ValueError, Big, "a")
+
+
+    def test_builtins(self):
+        """
+        Grammars with C{characterClasses} match the builtin classes by
+        looking characters up in the index, and fail as the builtins do.
+        """
+        for base in [OMetaBase, SentinelOMetaBase, FastOMetaBase]:
+            grammar = type("Grammar", (base,), {"characterClasses": HexIndex})
+            for data in ["a1!", b"a1!"]:
+                o = grammar(CursorInput.fromIterable(data))
+                self.assertEqual(o.rule_letter()[0], "a")
+                self.assertEqual(o.rule_letterOrDigit()[0], "1")
+                self.assertEqual(o.input.position, 2)
+                if base is OMetaBase:
+                    e = self.assertRaises(ParseError, o.rule_digit)
+                    self.assertEqual(e, ParseError(2, expected("digit")))
+                else:
+                    self.assertEqual(o.rule_digit()[0], failed)
+                self.assertEqual(o.input.position, 2)
+            o = grammar("ab")
+            self.assertEqual(o.rule_letter()[0], "a")
+
+
+    def test_charClass(self):
+        """
+        C{charClass} matches a character in a declared class, with or
+        without an index of the input.
+        """
+        class Grammar(OMetaBase):
+            characterClasses = HexIndex
+        for data in [CursorInput.fromIterable("fg"), "fg"]:
+            o = Grammar(data)
+            self.assertEqual(o.rule_charClass("hex")[0], "f")
+            e = self.assertRaises(ParseError, o.rule_charClass, "hex")
+            self.assertEqual(e, ParseError(1, expected("hex")))
+
+
+
+class LineIndexTests(unittest.TestCase):
+    """
+    Tests for L{LineIndex} and the error formatting that uses it.
+    """
+
+    def test_lineColumn(self):
+        """
+        L{LineIndex.lineColumn} finds the line, from 1, and column, from 0,
+        of a position. A newline belongs to the line it ends.
+        """
+        index = LineIndex("foo\nbaz\n\ncharlie")
+        self.assertEqual(index.starts, None)
+        self.assertEqual([index.lineColumn(p) for p in [0, 2, 3, 4, 8, 9, 16]],
+                         [(1, 0), (1, 2), (1, 3), (2, 0), (3, 0), (4, 0),
+                          (4, 7)])
+        self.assertEqual(index.starts, [0, 4, 8, 9])
+        self.assertEqual([index.line(n) for n in [1, 2, 3, 4]],
+                         ["foo", "baz", "", "charlie"])
+
+
+    def test_reuse(self):
+        """
+        L{ParseError.lineColumn} and L{ParseError.formatError} take a
+        L{LineIndex} in place of the string, and L{LineIndex.of} returns
+        one as is. A grammar's L{OMetaBase.lineIndex} is made once for its
+        input's text.
+        """
+        text = "a\nbcd\n" * 3
+        e = ParseError(4, expected("digit"))
+        self.assertEqual(e.lineColumn(text), (2, 2))
+        index = LineIndex.of(text)
+        self.assertNotIdentical(LineIndex.of(text), index)
+        self.assertIdentical(LineIndex.of(index), index)
+        self.assertEqual(e.formatError(index), e.formatError(text))
+        self.assertEqual(e.formatError(index),
+                         "\nbcd\n  ^\nParse error at line 2, column 2: "
+                         "expected a digit\n")
+        o = OMetaBase(text)
+        index = o.lineIndex()
+        self.assertIdentical(index.text, o.input.text())
+        self.assertIdentical(o.lineIndex(), index)
+        self.assertEqual(e.lineColumn(index), (2, 2))
+
+
+    def test_inputText(self):
+        """
+        L{LineIndex} finds the lines of what inputs' C{text} methods return:
+        lists of characters and buffers of bytes as well as strings. A
+        stream whose start has been discarded can't give its text.
+        """
+        for i in [InputStream.fromIterable("a\nbc"),
+                  CursorInput.fromIterable("a\nbc"),
+                  CursorInput.fromIterable(bytearray(b"a\nbc"))]:
+            self.assertEqual(LineIndex(i.text()).lineColumn(3), (2, 1))
+        self.assertRaises(ValueError, InputStream.fromIterable([1]).text)
+        self.assertRaises(ValueError, CursorInput.fromIterable([1]).text)
+        i = StreamInput()
+        i.feed("a\nbc")
+        self.assertEqual(i.text(), "a\nbc")
+        i.discard(2)
+        self.assertRaises(ValueError, i.text)
+
+
+
+class SentinelRuntimeTests(unittest.TestCase):
+    """
+    Tests for L{SentinelOMetaBase}, which returns L{failed} rather than
+    raising L{ParseError}.
+    """
+
+    def test_peek(self):
+        """
+        At the end of the input, C{peek} returns L{failed} and an end of
+        input error where C{head} raises L{EOFError}.
+        """
+        for i in [InputStream.fromIterable("a"), CursorInput.fromIterable("a"),
+                  CursorInput.fromIterable(b"a")]:
+            self.assertEqual(i.peek()[0], "a")
+            self.assertEqual(i.tail().peek(), (failed, [1, eof()]))
+
+
+    def test_exactlyFail(self):
+        """
+        L{SentinelOMetaBase.exactly} returns L{failed} with the error
+        L{OMetaBase.exactly} would raise.
+        """
+        o = SentinelOMetaBase("foo")
+        self.assertEqual(o.exactly("g"), (failed, [0, expected(None, "g")]))
+        self.assertEqual(o.token("fog"), (failed, [2, expected("token", "fog")]))
+        self.assertEqual(o.input.position, 0)
+
+
+    def test_many(self):
+        """
+        L{SentinelOMetaBase.many} stops at the first failure, leaving the
+        input where the last item ended.
+        """
+        o = SentinelOMetaBase("ooops")
+        v, e = o.many(lambda: o.rule_exactly('o'))
+        self.assertEqual(v, ['o'] * 3)
+        self.assertEqual(o.input.position, 3)
+        self.assertEqual(o.many(lambda: o.rule_exactly('o'),
+                                o.rule_exactly('o'))[0], failed)
+
+
+    def test_committed(self):
+        """
+        A failure returned through L{SentinelOMetaBase.committed} fails a
+        choice without trying its remaining options.
+        """
+        o = SentinelOMetaBase("ab")
+        def committed():
+            o.exactly("a")
+            return o.committed(lambda: o.exactly("c"))
+        v, e = o._or([committed, lambda: o.exactly("a")])
+        self.assertIdentical(v, failed)
+        self.assertEqual(e[0], 1)
+        self.assertEqual(o.input.position, 0)
+        self.assertIdentical(o.many(committed)[0], failed)
+
+
+    def test_apply(self):
+        """
+        L{SentinelOMetaBase.apply} raises L{ParseError} if the rule fails.
+        """
+        o = SentinelOMetaBase("x")
+        e = self.assertRaises(ParseError, o.apply, "digit")
+        self.assertEqual(e, ParseError(0, expected("digit")))
+        self.assertEqual(o.apply("letter")[0], "x")
+
+
+
+class FastRuntimeTests(unittest.TestCase):
+    """
+    Tests for L{FastOMetaBase}, which tracks no errors.
+    """
+
+    def test_noErrors(self):
+        """
+        Matches report no error, whether they succeed or fail.
+        """
+        o = FastOMetaBase("foo")
+        self.assertEqual(o.exactly("f"), ("f", None))
+        self.assertEqual(o.exactly("g"), (failed, None))
+        self.assertEqual(o.token("oz"), (failed, None))
+        self.assertEqual(o._or([lambda: o.token("oz"), o.rule_letter]),
+                         ("o", None))
+        self.assertEqual(o.many(o.rule_letter), (["o"], None))
+
+
+    def test_reparse(self):
+        """
+        When L{FastOMetaBase.apply} fails, the L{ParseError} comes from
+        applying the rule again with a C{detailedClass} instance, over a
+        fork of the input from where the rule started.
+        """
+        for inputClass in [InputStream, CursorInput]:
+            class Grammar(FastOMetaBase):
+                pass
+            Grammar.inputClass = inputClass
+            o = Grammar("ab1")
+            self.assertEqual(o.apply("letter")[0], "a")
+            e = self.assertRaises(ParseError, o.apply, "digit")
+            self.assertEqual(e, ParseError(1, expected("digit")))
+
+
+    def test_fork(self):
+        """
+        Forking an input makes a new one over the same data, with an empty
+        memo store of the same kind.
+        """
+        for i in [InputStream.fromIterable("abc", DictMemo),
+                  CursorInput.fromIterable("abc", DictMemo),
+                  ArgInput(1, CursorInput.fromIterable(b"abc", DictMemo))]:
+            i.setMemo("x", "rec")
+            f = i.fork(2)
+            self.assertEqual(f.position, 2)
+            self.assertEqual(f.head()[0], "c")
+            self.assertIsInstance(f.memo, DictMemo)
+            self.assertEqual(f.getMemo("x"), None)
+
+
+
+class CursorOMetaBase(OMetaBase):
+    inputClass = CursorInput
+
+
+
+class CursorInputTests(unittest.TestCase):
+    """
+    Tests for L{pymeta.runtime.CursorInput}.
+    """
+
+    def test_headTail(self):
+        """
+        L{CursorInput.tail} advances the input in place, and L{CursorInput.head}
+        raises L{EOFError} at the end of the data.
+        """
+        i = CursorInput.fromIterable("ab")
+        self.assertEqual(i.head()[0], "a")
+        self.assertIdentical(i.tail(), i)
+        self.assertEqual((i.head()[0], i.position), ("b", 1))
+        i.tail()
+        e = self.assertRaises(EOFError, i.head)
+        self.assertEqual(e.position, 2)
+
+
+    def test_markRewind(self):
+        """
+        Positions saved with L{CursorInput.mark} can be restored with
+        L{CursorInput.rewind}.
+        """
+        i = CursorInput.fromIterable("abc")
+        m = i.mark()
+        i.tail().tail()
+        self.assertIdentical(i.rewind(m), i)
+        self.assertEqual(i.head()[0], "a")
+
+
+    def test_memo(self):
+        """
+        Memo records are kept per rule and per position.
+        """
+        i = CursorInput.fromIterable("abc")
+        i.setMemo("foo", 1)
+        self.assertEqual(i.getMemo("foo"), 1)
+        i.tail()
+        self.assertEqual(i.getMemo("foo"), None)
+        i.setMemo("foo", 2)
+        i.rewind(0)
+        self.assertEqual(i.getMemo("foo"), 1)
+
+
+    def test_argInput(self):
+        """
+        Rewinding to an L{ArgInput} stacked on a cursor restores the cursor's
+        position once the argument is consumed.
+        """
+        i = CursorInput.fromIterable("abc")
+        i.tail()
+        a = ArgInput("x", i)
+        m = a.mark()
+        self.assertEqual(a.head()[0], "x")
+        a.tail().tail()
+        self.assertEqual(i.position, 2)
+        inp = i.rewind(m)
+        self.assertIdentical(inp, a)
+        self.assertEqual(inp.tail().head()[0], "b")
+
+
+    def test_stringInput(self):
+        """
+        L{CursorInput.fromIterable} indexes strings directly with a
+        L{StringInput} instead of copying them into a list.
+        """
+        data = "abc"
+        i = CursorInput.fromIterable(data)
+        self.assertIsInstance(i, StringInput)
+        self.assertIdentical(i.data, data)
+        self.assertEqual(i.tail().head()[0], "b")
+
+
+    def test_stringCharactersNotIterable(self):
+        """
+        Items read from a L{StringInput} are characters, so
+        L{OMetaBase.listpattern} does not match inside them.
+        """
+        o = CursorOMetaBase("ab")
+        e = self.assertRaises(ParseError, o.listpattern,
+                              lambda: o.exactly("a"))
+        self.assertEqual(e[1], expected("an iterable"))
+        o = CursorOMetaBase(["ab"])
+        self.assertEqual(o.listpattern(lambda: o.many(o.rule_anything))[0],
+                         "ab")
+
+
+    def test_exactlyFail(self):
+        """
+        A failed L{OMetaBase.exactly} leaves the cursor where it was.
+        """
+        o = CursorOMetaBase("foo")
+        e = self.assertRaises(ParseError, o.rule_exactly, "g")
+        self.assertEqual(e, ParseError(0, expected(None, "g")))
+        self.assertEqual(o.input.position, 0)
+
+
+    def test_tokenFailed(self):
+        """
+        L{OMetaBase.rule_token} rewinds the cursor past any whitespace it ate
+        when the token doesn't match.
+        """
+        o = CursorOMetaBase("  foozle")
+        e = self.assertRaises(ParseError, o.rule_token, "fog")
+        self.assertEqual(e[0], 4)
+        self.assertEqual(e[1], expected("token", "fog"))
+        self.assertEqual(o.input.position, 0)
+
+
+    def test_matchLength(self):
+        """
+        L{StringInput.matchLength} counts the characters of a string the
+        input has from the current position on.
+        """
+        i = CursorInput.fromIterable("foozle")
+        i.tail()
+        self.assertEqual(i.matchLength("ooz"), 3)
+        self.assertEqual(i.matchLength("oops"), 2)
+        self.assertEqual(i.matchLength("oozles"), 5)
+        self.assertEqual(CursorInput.fromIterable(["foo"]).matchLength, None)
+
+
+    def test_exactlyString(self):
+        """
+        L{OMetaBase.exactlyString} matches a run of characters from a string,
+        failing where they first differ, and a single item from a list.
+        """
+        o = CursorOMetaBase("foozle")
+        self.assertEqual(o.exactlyString("foo"), ("foo", None))
+        self.assertEqual(o.input.position, 3)
+        e = self.assertRaises(ParseError, o.exactlyString, "zap")
+        self.assertEqual(e, ParseError(4, expected(None, "zap")))
+        self.assertEqual(o.input.position, 3)
+        o = CursorOMetaBase(["foo", "bar"])
+        self.assertEqual(o.exactlyString("foo")[0], "foo")
+        self.assertEqual(o.input.position, 1)
+
+
+    def test_exactlyStringEngines(self):
+        """
+        L{OMetaBase.exactlyString} and its sentinel and fast counterparts
+        match a run of characters from a string on either input engine.
+        """
+        for base in [OMetaBase, SentinelOMetaBase, FastOMetaBase]:
+            for inputClass in [InputStream, CursorInput]:
+                o = base(inputClass.fromIterable("foozle"))
+                self.assertEqual(o.exactlyString("foo")[0], "foo")
+                self.assertEqual(o.input.position, 3)
+                o = base(inputClass.fromIterable("fop"))
+                try:
+                    v, e = o.exactlyString("foo")
+                except ParseError as err:
+                    v, e = failed, list(err.args)
+                self.assertEqual(v, failed)
+                if base is not FastOMetaBase:
+                    self.assertEqual(e, [2, expected(None, "foo")])
+                self.assertEqual(o.input.position, 0)
+
+
+    def test_charSet(self):
+        """
+        L{OMetaBase.charSet} matches a character in a set, or not in it when
+        negated, and L{OMetaBase.charSetMany} scans a run of them.
+        """
+        digits = frozenset("0123456789")
+        o = CursorOMetaBase("12ab")
+        self.assertEqual(o.charSet(digits, False, "{0-9}"), ("1", None))
+        self.assertEqual(o.charSetMany(digits, False, "{0-9}"), (["2"], None))
+        self.assertEqual(o.input.position, 2)
+        e = self.assertRaises(ParseError, o.charSetMany, digits, False,
+                              "{0-9}", True)
+        self.assertEqual(e, ParseError(2, expected("character in", "{0-9}")))
+        self.assertEqual(o.charSetMany(digits, True, "{^0-9}", True),
+                         (["a", "b"], None))
+        self.assertRaises(EOFError, o.charSet, digits, True, "{^0-9}")
+        o = CursorOMetaBase([1, "1", 2])
+        self.assertEqual(o.charSetMany(digits, False, "{0-9}"), ([], None))
+        self.assertEqual(o.charSetMany(digits, True, "{^0-9}"), ([1], None))
+
+
+    def test_charSetInputStream(self):
+        """
+        On input that can't scan, L{OMetaBase.charSetMany} repeats
+        L{OMetaBase.charSet} as L{OMetaBase.many} would.
+        """
+        o = OMetaBase("ab1")
+        letters = frozenset("ab")
+        self.assertEqual(o.charSetMany(letters, False, "{ab}", True)[0],
+                         ["a", "b"])
+        self.assertEqual(o.input.position, 2)
+
+
+    def test_charRanges(self):
+        """
+        L{CharRanges} holds the characters in any of its ranges, and nothing
+        that isn't a string.
+        """
+        r = CharRanges([("0", "9"), ("a", "z")])
+        self.assertEqual([c in r for c in "/09:`az{"],
+                         [False, True, True, False, False, True, True, False])
+        self.assertNotIn(5, r)
+
+
+    def test_many(self):
+        """
+        L{OMetaBase.many} stops at the first failure, leaving the cursor after
+        the last match.
+        """
+        o = CursorOMetaBase("ooops")
+        v, e = o.many(lambda: o.rule_exactly('o'))
+        self.assertEqual(v, ['o'] * 3)
+        self.assertEqual(o.input.position, 3)
+
+
+    def test_or(self):
+        """
+        L{OMetaBase._or} rewinds the cursor between alternatives.
+        """
+        o = CursorOMetaBase("foozle")
+        v, e = o._or([lambda: o.token("fog"),
+                      lambda: o.token("foozik"),
+                      lambda: o.token("fooz")])
+        self.assertEqual(v, "fooz")
+        self.assertEqual(e[0], 4)
+        self.assertEqual(e[1], expected("token", "foozik"))
+        self.assertEqual(o.input.position, 4)
+
+
+    def test_listpattern(self):
+        """
+        L{OMetaBase.listpattern} parses nested lists with cursors too, and
+        restores the outer cursor on failure.
+        """
+        o = CursorOMetaBase([["a"], ["b"]])
+        v, e = o.listpattern(lambda: o.exactly("a"))
+        self.assertEqual(v, ["a"])
+        self.assertEqual(o.input.position, 1)
+        outer = o.input
+        self.assertRaises(ParseError, o.listpattern, lambda: o.exactly("a"))
+        self.assertIdentical(o.input, outer)
+
+
+
+class BytesInputTests(unittest.TestCase):
+    """
+    Tests for L{pymeta.runtime.BytesInput}.
+    """
+
+    def test_bufferTypes(self):
+        """
+        L{CursorInput.fromIterable} reads bytes, bytearrays and memoryviews
+        with a L{BytesInput}, without copying them.
+        """
+        for data in [b"ab", bytearray(b"ab"), memoryview(b"ab")]:
+            i = CursorInput.fromIterable(data)
+            self.assertIsInstance(i, BytesInput)
+            self.assertEqual(i.head()[0], "a")
+            self.assertEqual(i.tail().head()[0], "b")
+            self.assertIdentical(i.slice(0, 2).obj,
+                                 getattr(data, "obj", data))
+
+
+    def test_builtins(self):
+        """
+        The builtin rules match bytes like the characters with the same
+        ordinals.
+        """
+        o = CursorOMetaBase(b"  ab1 x\xff")
+        self.assertEqual(o.rule_spaces()[0], True)
+        self.assertEqual(o.rule_letter()[0], "a")
+        self.assertEqual(o.rule_exactly("b")[0], "b")
+        self.assertEqual(o.rule_digit()[0], "1")
+        self.assertEqual(o.rule_token("x")[0], "x")
+        self.assertEqual(o.rule_exactly("\xff")[0], "\xff")
+        self.assertEqual(o.rule_end()[0], True)
+        o = CursorOMetaBase(b"1")
+        e = self.assertRaises(ParseError, o.rule_letter)
+        self.assertEqual(e, ParseError(0, expected("letter")))
+
+
+    def test_slice(self):
+        """
+        L{BytesInput.slice} returns a memoryview of the input between two
+        positions.
+        """
+        data = bytearray(b"foo bar")
+        i = CursorInput.fromIterable(data)
+        s = i.slice(4, 7)
+        self.assertEqual(s.tobytes(), b"bar")
+        data[4:7] = b"baz"
+        self.assertEqual(s.tobytes(), b"baz")
+
+
+    def test_matchLength(self):
+        """
+        L{BytesInput.matchLength} compares bytes in place with the Latin-1
+        encoding of a string.
+        """
+        i = CursorInput.fromIterable(b"to\xff!")
+        self.assertEqual(i.matchLength("to\xff"), 3)
+        self.assertEqual(i.matchLength("tox"), 2)
+        self.assertEqual(i.matchLength("t\u1234"), 1)
+        o = CursorOMetaBase(b"  to\xff")
+        self.assertEqual(o.rule_token("to\xff")[0], "to\xff")
+        e = self.assertRaises(ParseError, CursorOMetaBase(b" tx").rule_token,
+                              "to")
+        self.assertEqual(e, ParseError(2, expected("token", "to")))
+
+
+    def test_scan(self):
+        """
+        L{BytesInput.scan} reads bytes as the characters they decode to.
+        """
+        i = CursorInput.fromIterable(b"\xe9t\xe9!")
+        self.assertEqual(i.scan(frozenset("\xe9t"), False), ["\xe9", "t", "\xe9"])
+        self.assertEqual(i.position, 3)
+        self.assertEqual(i.scan(frozenset("x"), True), ["!"])
+
+
+    def test_capture(self):
+        """
+        L{OMetaBase.capture} of bytes input returns a memoryview sharing
+        the input's buffer.
+        """
+        data = b"abc1 x"
+        o = CursorOMetaBase(data)
+        v, e = o.capture(lambda: o.many(o.rule_letterOrDigit))
+        self.assertEqual(v.tobytes(), b"abc1")
+        self.assertIdentical(v.obj, data)
+
+
+    def test_fromFile(self):
+        """
+        L{OMetaBase.fromFile} parses a file, given by name or as a file
+        object, straight from a memory map of it.
+        """
+        path = self.mktemp()
+        f = open(path, 'wb')
+        f.write(b"foo 1")
+        f.close()
+        o = OMetaBase.fromFile(path)
+        self.assertIsInstance(o.input, BytesInput)
+        self.assertIsInstance(o.input.data.obj, mmap.mmap)
+        self.assertEqual(o.rule_token("foo")[0], "foo")
+        self.assertEqual(o.rule_token("1")[0], "1")
+        self.assertEqual(o.rule_end()[0], True)
+        f = open(path, 'rb')
+        self.addCleanup(f.close)
+        o = OMetaBase.fromFile(f)
+        self.assertEqual(o.input.slice(0, 3).tobytes(), b"foo")
+
+
+    def test_fromFileClosed(self):
+        """
+        Finding the lines of input parsed from a file keeps nothing of the
+        memory map once the grammar is gone, so the map can be closed.
+        """
+        path = self.mktemp()
+        f = open(path, 'wb')
+        f.write(b"foo\n  1")
+        f.close()
+        Grammar = type("Grammar", (OMetaBase,), {"trackSpans": True})
+        o = Grammar.fromFile(path)
+        o.apply("token", "foo")
+        one, e = o.apply("token", "1")
+        self.assertEqual(o.lineSpan(one), ((1, 3), (2, 3)))
+        self.assertEqual(ParseError(5).lineColumn(o.input.text()), (2, 1))
+        data = o.input.data.obj
+        del o
+        gc.collect()
+        data.close()
+        self.assertTrue(data.closed)
+
+
+    def test_fromEmptyFile(self):
+        """
+        L{OMetaBase.fromFile} can parse empty files, which can't be mapped.
+        """
+        path = self.mktemp()
+        open(path, 'wb').close()
+        o = OMetaBase.fromFile(path)
+        self.assertEqual(o.rule_end()[0], True)
+
+
+    def test_discardPages(self):
+        """
+        Discarding input read from a memory map releases the pages wholly
+        before the position discarded to, which can still be read again.
+        """
+        path = self.mktemp()
+        f = open(path, 'wb')
+        f.write(b"x" * (mmap.PAGESIZE * 3))
+        f.close()
+        o = OMetaBase.fromFile(path)
+        i = o.input
+        i.discard(mmap.PAGESIZE * 2 + 5)
+        if hasattr(mmap, "MADV_DONTNEED"):
+            self.assertEqual(i.released, mmap.PAGESIZE * 2)
+        i.discard(mmap.PAGESIZE)
+        self.assertEqual(i.head()[0], "x")
+
+
+class StreamInputTests(unittest.TestCase):
+    """
+    Tests for L{pymeta.runtime.StreamInput}.
+    """
+
+    def test_needMoreInput(self):
+        """
+        Reading past the data fed to an open L{StreamInput} raises
+        L{NeedMoreInput}; once it's closed, L{EOFError} is raised instead.
+        """
+        i = StreamInput()
+        e = self.assertRaises(NeedMoreInput, i.head)
+        self.assertEqual(e.position, 0)
+        i.feed("a")
+        i.feed(b"b")
+        self.assertEqual(i.head()[0], "a")
+        self.assertEqual(i.tail().head()[0], "b")
+        i.tail()
+        self.assertRaises(NeedMoreInput, i.head)
+        i.close()
+        self.assertRaises(EOFError, i.head)
+
+
+    def test_discard(self):
+        """
+        L{StreamInput.discard} drops buffered data and memo records before a
+        position, without renumbering the positions after it.
+        """
+        i = StreamInput(ArrayMemo(0))
+        i.feed("abcd")
+        i.tail().tail()
+        i.setMemo("foo", 1)
+        i.discard(2)
+        self.assertEqual(i.data, "cd")
+        self.assertEqual((i.position, i.head()[0]), (2, "c"))
+        self.assertEqual(i.getMemo("foo"), 1)
+        self.assertEqual(i.slice(2, 4), "cd")
+
+
+    def test_incompleteRule(self):
+        """
+        When a rule needs more input than a stream holds, it isn't memoized,
+        so it's run again once more data has arrived.
+        """
+        class Grammar(OMetaBase):
+            def rule_foo(self):
+                return self.token("foo")
+        o = Grammar(StreamInput())
+        o.input.feed("fo")
+        self.assertRaises(NeedMoreInput, o.apply, "foo")
+        o.input = o.input.rewind(0)
+        self.assertEqual(o.input.getMemo("foo"), None)
+        o.input.feed("o")
+        self.assertEqual(o.apply("foo")[0], "foo")
+
+
+    def test_matchLength(self):
+        """
+        L{StreamInput.matchLength} raises L{NeedMoreInput} when the data runs
+        out before a character differs, unless the stream is closed.
+        """
+        i = StreamInput()
+        i.feed("ab")
+        self.assertEqual(i.matchLength("ax"), 1)
+        e = self.assertRaises(NeedMoreInput, i.matchLength, "abc")
+        self.assertEqual(e.position, 2)
+        i.close()
+        self.assertEqual(i.matchLength("abc"), 2)
+
+
+    def test_scan(self):
+        """
+        L{StreamInput.scan} raises L{NeedMoreInput} when the data runs out
+        during a run of characters in the set, unless the stream is closed.
+        """
+        i = StreamInput()
+        i.feed("aab")
+        self.assertEqual(i.scan(frozenset("a"), False), ["a", "a"])
+        self.assertEqual(i.position, 2)
+        e = self.assertRaises(NeedMoreInput, i.scan, frozenset("b"), False)
+        self.assertEqual(e.position, 3)
+        i.close()
+        self.assertEqual(i.scan(frozenset("b"), False), ["b"])
+        self.assertEqual(i.position, 3)
+
+
+
+class CursorFastOMetaBase(FastOMetaBase):
+    inputClass = CursorInput
+
+
+
+class RegularTests(unittest.TestCase):
+    """
+    Tests for L{Regular} and L{FastOMetaBase.regular}.
+    """
+
+    def test_source(self):
+        """
+        Choices become atomic groups and repetitions possessive ones, so the
+        expression never backtracks into what a part of it matched.
+        """
+        r = Regular(["Or", [["Exactly", "ab"],
+                            ["Many1", ["CharSet", [("0", "9")], False]]]])
+        self.assertEqual(r.source(r.expr, False),
+                         r"(?>\x61\x62|(?:[\x30-\x39])++)")
+        self.assertEqual(r.compiled(True).pattern,
+                         br"(?>\x61\x62|(?:[\x30-\x39])++)")
+        self.assertEqual(r.rules, set())
+        r = Regular(["And", [["Not", ["Exactly", "x"]],
+                             ["Many", ["Apply", "anything", "main", ()]]]])
+        self.assertEqual(r.source(r.expr, False), r"(?!\x78)(?:.)*+")
+        self.assertEqual(r.rules, set(["anything"]))
+
+
+    def test_bytes(self):
+        """
+        Compiled for bytes, characters past 0xff match nothing.
+        """
+        r = Regular(["Or", [["Exactly", "\u0101"],
+                            ["CharSet", [("a", "\u0101")], False]]])
+        self.assertEqual(r.compiled(True).match(b"\xff").end(), 1)
+        self.assertEqual(r.compiled(True).match(b"\x01"), None)
+
+
+    def test_builtinClasses(self):
+        """
+        The expressions for the builtin letter, digit and letterOrDigit
+        rules match the same characters as the rules do.
+        """
+        o = OMetaBase("")
+        for name in ("letter", "digit", "letterOrDigit"):
+            rule = getattr(o, "rule_" + name)
+            pattern = Regular(["Apply", name, "main", ()]).compiled(False)
+            for i in range(0, 0x3000):
+                c = chr(i)
+                o.input = InputStream.fromIterable(c)
+                try:
+                    rule()
+                    matched = True
+                except ParseError:
+                    matched = False
+                self.assertEqual(bool(pattern.match(c)), matched,
+                                 "%s %r" % (name, c))
+            pattern = Regular(["Apply", name, "main", ()]).compiled(True)
+            for i in range(0, 0x100):
+                o.input = InputStream.fromIterable(chr(i))
+                try:
+                    rule()
+                    matched = True
+                except ParseError:
+                    matched = False
+                self.assertEqual(bool(pattern.match(bytes([i]))), matched,
+                                 "%s %r" % (name, i))
+
+
+    def test_regular(self):
+        """
+        L{FastOMetaBase.regular} matches the pattern in one step on string
+        and bytes input, returning what C{kind} asks for.
+        """
+        digits = Regular(["Many1", ["Apply", "digit", "main", ()]])
+        for data in ["123a", b"123a"]:
+            for kind, value in [("skip", True), ("text", "123"),
+                                ("list", ["1", "2", "3"])]:
+                o = CursorFastOMetaBase(data)
+                self.assertEqual(o.regular(digits, kind, None), (value, None))
+                self.assertEqual(o.input.position, 3)
+            o = CursorFastOMetaBase(data)
+            o.input.position = 3
+            self.assertEqual(o.regular(digits, "text", None), (failed, None))
+            self.assertEqual(o.input.position, 3)
+        o = CursorFastOMetaBase("12")
+        self.assertEqual(o.regular(digits, "slice", None), ("12", None))
+
+
+    def test_fallback(self):
+        """
+        L{FastOMetaBase.regular} calls the part's own code on input that
+        can't match regular expressions, and in grammars that redefine a
+        builtin rule the pattern uses.
+        """
+        digits = Regular(["Many1", ["Apply", "digit", "main", ()]])
+        fallback = lambda: ("fallback", None)
+        o = FastOMetaBase("123")
+        self.assertEqual(o.regular(digits, "text", fallback),
+                         ("fallback", None))
+        class Redefined(CursorFastOMetaBase):
+            def rule_digit(self):
+                return self.exactly("1")
+        o = Redefined("123")
+        self.assertEqual(o.regular(digits, "text", fallback),
+                         ("fallback", None))
+        o = Redefined("abc")
+        letters = Regular(["Many1", ["Apply", "letter", "main", ()]])
+        self.assertEqual(o.regular(letters, "text", fallback), ("abc", None))
+
+
+
+def sequence(o, *wanted):
+    """
+    Return a function matching each of C{wanted} in turn with
+    C{o.exactly}.
+    """
+    def fn():
+        for w in wanted:
+            v, e = o.exactly(w)
+            if v is failed:
+                break
+        return v, e
+    return fn
+
+
+
+class DispatchTests(unittest.TestCase):
+    """
+    Tests for L{Dispatch} and L{OMetaBase.dispatch}.
+    """
+
+    def test_candidates(self):
+        """
+        L{Dispatch.candidates} returns, in order, the alternatives whose
+        literal starts with an item or is equal to it, and None for items
+        that can't be looked up.
+        """
+        table = Dispatch(["ab", "a", "b", "abc"])
+        self.assertEqual(table.candidates("a"), (0, 1, 3))
+        self.assertEqual(table.candidates("ab"), (0,))
+        self.assertEqual(table.candidates("c"), ())
+        self.assertEqual(table.candidates(["a"]), None)
+
+
+    def test_sameAsOr(self):
+        """
+        L{OMetaBase.dispatch} matches and fails as L{OMetaBase._or} does, with
+        the same errors, in each kind of grammar.
+        """
+        alternatives = [("=", "="), ("=",), ("<", "="), ("<",), ("!", "=")]
+        table = Dispatch([a[0] for a in alternatives])
+        for base in [OMetaBase, CursorOMetaBase, SentinelOMetaBase]:
+            for data in ["==", "=<", "<", "!", "!=", "x", "", [["="]]]:
+                results = []
+                for call in ["dispatch", "_or"]:
+                    o = base(data)
+                    fns = [sequence(o, *a) for a in alternatives]
+                    args = [fns]
+                    if call == "dispatch":
+                        args.insert(0, table)
+                    try:
+                        v, err = getattr(o, call)(*args)
+                    except ParseError as e:
+                        v, err = failed, e
+                    results.append((v, ParseError(*joinErrors([err])),
+                                    o.input.position))
+                self.assertEqual(results[0], results[1], (base, data))
+
+
+    def test_committed(self):
+        """
+        An alternative that fails after a cut fails the whole choice, as in
+        L{OMetaBase._or}.
+        """
+        o = CursorOMetaBase("ab")
+        def committing():
+            o.exactly("a")
+            return o.committed(lambda: o.exactly("c"))
+        fns = [committing, sequence(o, "a")]
+        e = self.assertRaises(ParseError, o.dispatch, Dispatch(["a", "a"]),
+                              fns)
+        self.assertEqual(e, ParseError(1, expected(None, "c")))
+
+
+    def test_fast(self):
+        """
+        L{FastOMetaBase.dispatch} calls only the alternatives that can match.
+        """
+        o = FastOMetaBase("<=")
+        called = []
+        def alternative(n, *wanted):
+            fn = sequence(o, *wanted)
+            def tracked():
+                called.append(n)
+                return fn()
+            return tracked
+        fns = [alternative(0, "=", "="), alternative(1, "<", "<"),
+               alternative(2, "<", "=")]
+        self.assertEqual(o.dispatch(Dispatch(["=", "<", "<"]), fns),
+                         ("=", None))
+        self.assertEqual(called, [1, 2])
+        self.assertEqual(o.dispatch(Dispatch(["=", "<", "<"]), fns),
+                         (failed, None))
+
+
+
+class PredictionTests(unittest.TestCase):
+    """
+    Tests for L{FirstSet}, L{Prediction} and L{FastOMetaBase.dispatch} with
+    a prediction.
+    """
+
+    def test_firstSet(self):
+        """
+        A L{FirstSet} holds its items, the strings in its ranges and those in
+        its character classes, or when negated everything but its items.
+        """
+        first = FirstSet(["-", "if"], [("a", "c")], ["digit"])
+        self.assertEqual([x in first for x in ["-", "if", "b", "7", "d", 7]],
+                         [True, True, True, True, False, False])
+        self.assertNotIn(["a"], first)
+        first = FirstSet(["<"], negated=True)
+        self.assertEqual([x in first for x in ["<", "a", 7, ["<"]]],
+                         [False, True, True, True])
+
+
+    def test_candidates(self):
+        """
+        L{Prediction.candidates} returns, in order, the alternatives whose
+        first set has an item, and those with none, which can start with
+        anything.
+        """
+        table = Prediction([FirstSet(["<"]), None, FirstSet([], [], ["letter"])],
+                           False, [], [], globals(), "Grammar")
+        self.assertEqual(table.candidates("<"), (0, 1))
+        self.assertEqual(table.candidates("a"), (1, 2))
+        self.assertEqual(table.candidates(["a"]), None)
+
+
+    def test_dispatch(self):
+        """
+        L{FastOMetaBase.dispatch} calls only the alternatives a prediction
+        says can match the next item, or for a spaced prediction the item
+        after any whitespace.
+        """
+        o = CursorFastOMetaBase("  b")
+        called = []
+        def alternative(n):
+            def fn():
+                called.append(n)
+                return o.token("b")
+            return fn
+        fns = [alternative(0), alternative(1)]
+        firsts = [FirstSet(["a"]), FirstSet(["b"])]
+        table = Prediction(firsts, True, [], ["token"], globals(), "Grammar")
+        self.assertEqual(o.dispatch(table, fns), ("b", None))
+        self.assertEqual(called, [1])
+        del called[:]
+        o.input.position = 0
+        table = Prediction(firsts, False, [], ["token"], globals(), "Grammar")
+        self.assertEqual(o.dispatch(table, fns), (failed, None))
+        self.assertEqual(called, [])
+
+
+    def test_redefined(self):
+        """
+        A prediction is ignored, and every alternative tried, in grammars
+        that redefine a rule it depends on.
+        """
+        class Redefined(CursorFastOMetaBase):
+            def rule_letter(self):
+                return self.exactly("1")
+        fns = [lambda: o.rule_letter(), lambda: (2, None)]
+        table = Prediction([FirstSet([], [], ["letter"]), None], False, [],
+                           ["letter"], globals(), "Grammar")
+        o = Redefined("1")
+        self.assertEqual(o.dispatch(table, fns), ("1", None))
+        o = CursorFastOMetaBase("1")
+        self.assertEqual(o.dispatch(table, fns), (2, None))
+        self.assertTrue(table.validFor(CursorFastOMetaBase, FastOMetaBase))
+        self.assertFalse(table.validFor(Redefined, FastOMetaBase))
+        class Grammar(CursorFastOMetaBase):
+            def rule_rule(self):
+                return self.exactly("1")
+        class Inherited(Grammar):
+            pass
+        class Overridden(Grammar):
+            def rule_rule(self):
+                return self.exactly("2")
+        table = Prediction([None], False, ["rule"], [], {"Grammar": Grammar},
+                           "Grammar")
+        self.assertTrue(table.validFor(Inherited, FastOMetaBase))
+        self.assertFalse(table.validFor(Overridden, FastOMetaBase))
+        self.assertFalse(table.validFor(Redefined, FastOMetaBase))
+
+
+
+class MemoStoreTests(unittest.TestCase):
+    """
+    Tests for the memo stores in L{pymeta.runtime}.
+    """
+
+    def checkStore(self, memoClass):
+        memo = memoClass(3)
+        self.assertEqual(memo.get("foo", 0), None)
+        self.assertEqual(memo.set("foo", 0, 1), 1)
+        memo.set("foo", 3, 2)
+        memo.set("baz", 0, 3)
+        self.assertEqual([memo.get("foo", 0), memo.get("foo", 1),
+                          memo.get("foo", 3), memo.get("baz", 0)],
+                         [1, None, 2, 3])
+
+
+    def test_arrayMemo(self):
+        """
+        L{ArrayMemo} stores records by rule name and position, including the
+        position at the end of the input.
+        """
+        self.checkStore(ArrayMemo)
+
+
+    def test_dictMemo(self):
+        """
+        L{DictMemo} stores records by rule name and position.
+        """
+        self.checkStore(DictMemo)
+
+
+    def test_discard(self):
+        """
+        Memo stores can forget the records before a position, and carry on
+        storing records after it.
+        """
+        for memoClass in [ArrayMemo, DictMemo]:
+            memo = memoClass(3)
+            memo.set("foo", 1, 1)
+            memo.set("foo", 2, 2)
+            memo.discard(2)
+            self.assertEqual([memo.get("foo", 1), memo.get("foo", 2)],
+                             [None, 2])
+            memo.set("foo", 10, 3)
+            self.assertEqual(memo.get("foo", 10), 3)
+
+
+    def test_discardIncrementally(self):
+        """
+        L{ArrayMemo} clears records discarded a few at a time in place, and
+        shrinks its lists once at least half of them is cleared.
+        """
+        memo = ArrayMemo(9)
+        for i in range(10):
+            memo.set("foo", i, i)
+        memo.discard(2)
+        self.assertEqual(memo.tables["foo"],
+                         [None, None, 2, 3, 4, 5, 6, 7, 8, 9])
+        memo.discard(4)
+        self.assertEqual(memo.tables["foo"],
+                         [None, None, None, None, 4, 5, 6, 7, 8, 9])
+        memo.discard(5)
+        self.assertEqual(memo.tables["foo"], [5, 6, 7, 8, 9])
+        self.assertEqual([memo.get("foo", 4), memo.get("foo", 5),
+                          memo.get("foo", 9)], [None, 5, 9])
+
+
+    def test_window(self):
+        """
+        Memo stores with a window evict the records for positions more than
+        the window behind the farthest one stored, and return L{evicted} for
+        them.
+        """
+        for memoClass in [ArrayMemo, DictMemo]:
+            memo = memoClass(1000)
+            memo.setWindow(10)
+            for i in range(100):
+                memo.set("foo", i, i)
+            self.assertIdentical(memo.get("foo", 50), evicted)
+            self.assertEqual(memo.get("foo", 95), 95)
+            self.assertEqual(memo.get("bar", 95), None)
+        self.assertTrue(len(memo.positions) <= 20)
+        memo = ArrayMemo(1000)
+        memo.setWindow(10)
+        for i in range(100):
+            memo.set("foo", i, i)
+        self.assertTrue(len(memo.tables["foo"]) <= 42)
+
+
+    def test_memoClass(self):
+        """
+        Rule applications are memoized in the store named by
+        L{OMetaBase.memoClass}, so a rule applied twice at the same position
+        only runs once.
+        """
+        for memoClass in [ArrayMemo, DictMemo]:
+            class Grammar(OMetaBase):
+                calls = []
+                def rule_foo(self):
+                    self.calls.append(self.input.position)
+                    return self.exactly("a")
+            Grammar.memoClass = memoClass
+            o = Grammar("ab")
+            o.apply("foo")
+            o.input = o.input.prev()
+            self.assertEqual(o.apply("foo")[0], "a")
+            self.assertEqual(Grammar.calls, [0])
+            self.assertIsInstance(o.input.memo, memoClass)